@@ -3,31 +3,105 @@
 #
 # See LICENSE file in the project root for details.
 
+import asyncio
 from datetime import datetime
+from collections.abc import AsyncIterator
+from json import dumps
 from traceback import format_exc
-from sanic import Blueprint, HTTPResponse, Sanic, empty, json
+from sanic import Blueprint, HTTPResponse, empty, json
 from sanic.request import Request
 
 from anonymizer import tasks
-from anonymizer.config import version, config, log
-from anonymizer.execution.engine import ExecutionEngine
+from anonymizer.clients.valkey import ValkeyClient
+from anonymizer.config import config, version, log
+from anonymizer.execution.engine import ExecutionEngine, summarize_response
 from anonymizer.models.auth import protected
-from anonymizer.transformers import RequestBody
-from anonymizer.util import import_from_str
-from anonymizer.validation import validate
+from anonymizer.transformers import RequestBody, Transformer
+from anonymizer.util import UnknownTypeError
+from anonymizer.validation import (
+    HEADER_TTYPE,
+    BatchItem,
+    Validator,
+    validate,
+    validate_batch,
+    validate_stream,
+)
+
+# Clients can ask for the request to be queued instead of waiting for
+# the pipeline, either with "Prefer: respond-async" or "?async=true"
+HEADER_PREFER = 'Prefer'
+PREFER_ASYNC = 'respond-async'
+QUERY_ASYNC = 'async'
 
 bp_anonymizer = Blueprint('anonymizer')
 bp_tasks = Blueprint('tasks', url_prefix='/tasks')
 bg_anonymizer = Blueprint.group(bp_anonymizer, bp_tasks)
 
 
-def _can_create_task(app: Sanic, task: tasks.Task) -> bool:
-    if (isinstance(task, tasks.PeriodicTask)
-        and app.get_task(task.identifier, raise_exception=False) is not None):
-        log.error('Attempted to create duplicate periodic task')
-        log.debug('Task name: %s', task.name)
-        return False
-    return True
+async def _stream_lines(request: Request,
+                        limit: int,
+                        ) -> AsyncIterator[bytes | None]:
+    """Read the non-empty lines of a streamed request body.
+
+    Lines longer than `limit` bytes are discarded as they arrive, and
+    `None` is yielded in their place.
+    """
+    buffer = bytearray()
+    # Whether the rest of the current line is being discarded
+    discarding = False
+    while (chunk := await request.stream.read()) is not None:
+        *lines, rest = chunk.split(b'\n')
+        for line in lines:
+            if discarding or len(buffer) + len(line) > limit:
+                yield None
+            else:
+                buffer += line
+                if buffer.strip():
+                    yield bytes(buffer)
+            buffer.clear()
+            discarding = False
+        if not discarding:
+            buffer += rest
+            if len(buffer) > limit:
+                discarding = True
+                buffer.clear()
+    if discarding:
+        yield None
+    elif buffer.strip():
+        yield bytes(buffer)
+
+
+def _wants_async(request: Request) -> bool:
+    """Whether the client asked for an asynchronous response."""
+    preferences = request.headers.get(HEADER_PREFER, '')
+    if PREFER_ASYNC in (p.strip() for p in preferences.split(',')):
+        return True
+    return request.args.get(QUERY_ASYNC, '').lower() in {'1', 'true'}
+
+
+async def _run_item(request: Request,
+                    transformer: Transformer,
+                    item: BatchItem,
+                    shared: dict,
+                    ) -> dict:
+    """Execute the pipeline on a valid item of a batch.
+
+    Failures are contained to the item, which gets a 500 status, so
+    the other items of the batch still get their results.
+    """
+    engine: ExecutionEngine = request.app.ctx.engine
+    try:
+        response = await engine.run(request,
+                                    transformer.transform(item.body),
+                                    item.body,
+                                    datetime.now().timestamp(),
+                                    document=item.document,
+                                    shared=shared)
+    except Exception:
+        log.error('Unable to process batch item')
+        log.debug(format_exc())
+        return {'status': 500, 'result': None}
+    return summarize_response(response)
 
 
 @bp_anonymizer.get('/version')
@@ -84,84 +158,186 @@ def verify_credentials(_: Request) -> HTTPResponse:
 @validate()
 @protected
 async def anonymize(request: Request, body: RequestBody) -> HTTPResponse:
-    """Execute the pipeline on the received data."""
+    """Execute the pipeline on the received data.
+
+    If the client asks for an asynchronous response, the request is
+    added to the job queue instead, and the response contains the
+    identifier to poll `/anonymizer/jobs/<id>` with.
+    """
     snapshot = request.ctx.transformer.snapshot(body)
     #timestamp = await request.app.ctx.valkey.log_audit(snapshot)
-    log.debug('Pipeline file: %s', config.pipeline.file)
-    engine = ExecutionEngine(config.pipeline.file)
+    if _wants_async(request):
+        job_id = await request.app.ctx.valkey.enqueue_job(
+            {
+                'transformer': request.headers[HEADER_TTYPE],
+                'document': request.json,
+                'timestamp': datetime.now().timestamp(),
+            },
+            config.queue.result_ttl,
+        )
+        log.info('Queued request "%s"', job_id)
+        return json({'id': job_id},
+                    status=202,
+                    headers={'Location': f'{request.path}/jobs/{job_id}'})
+    engine: ExecutionEngine = request.app.ctx.engine
     return await engine.run(request,
                             request.ctx.transformer.transform(body),
                             body,
                             datetime.now().timestamp())
 
 
+@bp_anonymizer.get('/anonymizer/jobs/<job_id:str>')
+@protected
+async def get_job(request: Request, job_id: str) -> HTTPResponse:
+    """Retrieve the state of a queued request.
+
+    Responds with 202 until the request has been processed, and with
+    200 and the request's status and result afterwards.
+    """
+    job = await request.app.ctx.valkey.get_job(job_id)
+    if job is None:
+        log.error('Unknown or expired job "%s"', job_id)
+        return empty(404)
+    status = 200 if job['state'] == ValkeyClient.JOB_DONE else 202
+    return json({'id': job_id} | job, status=status)
+
+
+@bp_anonymizer.post('/anonymizer/batch')
+@validate_batch()
+@protected
+async def anonymize_batch(request: Request,
+                          items: list[BatchItem],
+                          ) -> HTTPResponse:
+    """Execute the pipeline on every item of a batch.
+
+    The request body is either a JSON list or newline-delimited JSON.
+    The response is a JSON list with the status and result of each
+    item, in the same order.  Invalid items get a 400 status, and
+    items the pipeline fails on get a 500 status.
+    """
+    transformer = request.ctx.transformer
+    window = asyncio.Semaphore(max(config.pipeline.max_in_flight, 1))
+    shared = {}
+
+    async def _run(item: BatchItem) -> dict:
+        if item.error is not None:
+            log.error('Skipping invalid batch item: %s', item.error)
+            return {'status': 400, 'result': None}
+        async with window:
+            return await _run_item(request, transformer, item, shared)
+
+    return json(await asyncio.gather(*(_run(i) for i in items)))
+
+
+@bp_anonymizer.post('/anonymizer/stream', stream=True)
+@validate_stream()
+@protected
+async def anonymize_stream(request: Request,
+                           validator: Validator,
+                           ) -> None:
+    """Execute the pipeline on a stream of newline-delimited JSON.
+
+    Items are read from the request body as they arrive, and at most
+    `max_in_flight` of them are processed at the same time; the body
+    isn't read any further until one of them finishes.  Results are
+    streamed back as newline-delimited JSON as soon as they're ready,
+    so they may be out of order: each one carries the position of its
+    item in the request body.  Items the pipeline fails on get a 500
+    status, and items larger than `max_item_size` a 413 status,
+    without interrupting the stream.
+    """
+    transformer = validator.transformer
+    window = max(config.pipeline.max_in_flight, 1)
+    limit = config.pipeline.max_item_size
+    shared = {}
+
+    async def _run(index: int, item: BatchItem | None) -> bytes:
+        if item is None:
+            log.error('Skipping stream item larger than %s bytes', limit)
+            result = {'status': 413, 'result': None}
+        elif item.error is not None:
+            log.error('Skipping invalid stream item: %s', item.error)
+            result = {'status': 400, 'result': None}
+        else:
+            result = await _run_item(request, transformer, item, shared)
+        return (dumps({'index': index} | result) + '\n').encode()
+
+    stream = await request.respond(content_type='application/x-ndjson')
+    in_flight: set[asyncio.Task] = set()
+    index = 0
+    try:
+        async for line in _stream_lines(request, limit):
+            item = validator.item(line) if line is not None else None
+            in_flight.add(asyncio.create_task(_run(index, item)))
+            index = index + 1
+            if len(in_flight) >= window:
+                done, in_flight = await asyncio.wait(
+                    in_flight,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    await stream.send(task.result())
+        for task in asyncio.as_completed(in_flight):
+            await stream.send(await task)
+    finally:
+        # Only left over if the stream was interrupted
+        for task in in_flight:
+            task.cancel()
+    await stream.eof()
+    log.info('Streamed %s results', index)
+
+
 @bp_tasks.put('/<task_name:str>')
 def add_task(request: Request, task_name: str) -> HTTPResponse:
     log.info('Adding task "%s"', task_name)
     try:
-        task_class = import_from_str(tasks.Task,
-                                     task_name,
-                                     'anonymizer.tasks')
-    except (AttributeError, ImportError, ModuleNotFoundError):
+        task_class = tasks.registry.get(task_name)
+    except UnknownTypeError:
         log.error('Unable to locate task "%s"', task_name)
         log.debug(format_exc())
         return empty(400)
-    if task_class is None:
-        log.error('Task "%s" not found')
-        return empty(400)
 
     task = task_class(request.app)
 
-    if not _can_create_task(request.app, task):
+    log.debug('Adding task "%s"', task_name)
+    if not tasks.start_task(request.app, task):
         log.error('Unable to create task "%s"', task_name)
         return empty(500)
-
-    log.debug('Adding task "%s"', task_name)
-    request.app.add_task(**task())
     return empty(200)
 
 
 @bp_tasks.patch('/<task_name:str>')
 async def reset_task(request: Request, task_name: str) -> HTTPResponse:
     log.info('Resetting task "%s"', task_name)
-    task_class = import_from_str(tasks.Task,
-                                 task_name,
-                                 'anonymizer.tasks')
-    if task_class is None:
-        log.error('Task "%s" not found')
+    try:
+        task_class = tasks.registry.get(task_name)
+    except UnknownTypeError:
+        log.error('Task "%s" not found', task_name)
         return empty(400)
 
     task = task_class(request.app)
 
     log.debug('Removing task "%s"', task_name)
-    await request.app.cancel_task(task.identifier,
-                                  raise_exception=False)
-    request.app.purge_tasks()
+    await tasks.stop_task(request.app, task.identifier)
 
-    if not _can_create_task(request.app, task):
+    log.debug('Readding task "%s"', task_name)
+    if not tasks.start_task(request.app, task):
         log.error('Unable to recreate task "%s"', task_name)
         return empty(500)
-
-    log.debug('Readding task "%s"', task_name)
-    request.app.add_task(**task())
     return empty(200)
 
 
 @bp_tasks.delete('/<task_name:str>')
 async def delete_task(request: Request, task_name: str) -> HTTPResponse:
     log.info('Deleting task "%s"', task_name)
-    task_class = import_from_str(tasks.Task,
-                                 task_name,
-                                 'anonymizer.tasks')
-    if task_class is None:
-        log.error('Task "%s" not found')
+    try:
+        task_class = tasks.registry.get(task_name)
+    except UnknownTypeError:
+        log.error('Task "%s" not found', task_name)
         return empty(400)
 
     task = task_class(request.app)
 
     log.debug('Removing task "%s"', task_name)
-    await request.app.cancel_task(task.identifier,
-                                  'Cancelled by endpoint',
-                                  raise_exception=False)
-    request.app.purge_tasks()
+    await tasks.stop_task(request.app, task.identifier)
     return empty(200)
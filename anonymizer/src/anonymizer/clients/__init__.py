@@ -6,13 +6,24 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
 import asyncio
-from typing import TYPE_CHECKING, Self, override
+from contextlib import asynccontextmanager
+from contextvars import Context
+from dataclasses import dataclass, field
+from random import sample
+from time import monotonic
+from typing import TYPE_CHECKING, Any, Self, override
 
-from aiohttp import ClientSession
+from aiohttp import ClientResponseError, ClientSession, TCPConnector
+
+from anonymizer.config import log
+from anonymizer.execution import remaining_time
+from anonymizer.util import backoff
 
 if TYPE_CHECKING:
-    from anonymizer.config import ConnectionSettings
-    from collections.abc import Awaitable, Callable
+    from aiohttp import ClientResponse
+
+    from anonymizer.config import BalanceSettings, ConnectionSettings
+    from collections.abc import AsyncIterator, Awaitable, Callable
 
 
 class ClientError(Exception):
@@ -31,6 +42,242 @@ class ClientRequestError(ClientError):
     """Raised when a client fails a request."""
 
 
+class ClientUnavailableError(ClientError):
+    """Raised when a service's circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stop sending requests to a service that keeps failing.
+
+    The breaker starts closed.  After `threshold` consecutive failures
+    it opens, and requests fail immediately for `reset` seconds.  Then
+    it becomes half-open, and lets a single request through: if it
+    succeeds the breaker closes, and otherwise it opens again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold: int, reset: float) -> None:
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        # When the half-open request was let through, if any
+        self._probed_at: float | None = None
+
+    @property
+    def state(self) -> str:
+        """The current state of the breaker."""
+        if (self._state == self.OPEN
+                and monotonic() - self._opened_at >= self.reset):
+            self._state = self.HALF_OPEN
+            self._probed_at = None
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a request can be sent to the service."""
+        match self.state:
+            case self.CLOSED:
+                return True
+            case self.HALF_OPEN:
+                # If the request let through never reported back (for
+                # example, because it was cancelled), let another one
+                if (self._probed_at is not None
+                        and monotonic() - self._probed_at < self.reset):
+                    return False
+                self._probed_at = monotonic()
+                return True
+        return False
+
+    def record_success(self):
+        """Record a successful request, closing the breaker."""
+        if self._state != self.CLOSED:
+            log.info('Circuit breaker closed')
+        self.failures = 0
+        self._state = self.CLOSED
+        self._probed_at = None
+
+    def record_failure(self):
+        """Record a failed request, opening the breaker if needed."""
+        self.failures = self.failures + 1
+        if (self._state == self.HALF_OPEN
+                or self.failures >= self.threshold):
+            if self._state != self.OPEN:
+                log.warning('Circuit breaker opened after %s failures',
+                            self.failures)
+            self._state = self.OPEN
+            self._opened_at = monotonic()
+            self._probed_at = None
+
+
+class RetryBudget:
+    """Limit retries to a fraction of the requests sent to a service.
+
+    Every request deposits `ratio` tokens, up to `burst`, and every
+    retry withdraws one.  While a service is failing, this keeps
+    retries from multiplying the load sent to it.
+    """
+
+    def __init__(self, ratio: float, burst: int) -> None:
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+
+    def deposit(self):
+        """Record a request sent to the service."""
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Spend a token on a retry, if there's any left."""
+        if self.tokens < 1:
+            return False
+        self.tokens = self.tokens - 1
+        return True
+
+
+# Breakers and budgets are shared by every client of a service in the
+# same worker
+_breakers: dict[str, CircuitBreaker] = {}
+_budgets: dict[str, RetryBudget] = {}
+
+
+def circuit_breaker(service: str,
+                    connection_settings: ConnectionSettings,
+                    ) -> CircuitBreaker:
+    """Get the circuit breaker of a service."""
+    if service not in _breakers:
+        _breakers[service] = CircuitBreaker(
+            connection_settings.breaker_threshold,
+            connection_settings.breaker_reset,
+        )
+    return _breakers[service]
+
+
+def retry_budget(service: str,
+                 connection_settings: ConnectionSettings,
+                 ) -> RetryBudget:
+    """Get the retry budget of a service."""
+    if service not in _budgets:
+        _budgets[service] = RetryBudget(connection_settings.retry_ratio,
+                                        connection_settings.retry_burst)
+    return _budgets[service]
+
+
+@dataclass
+class _Replica:
+    url: str
+    outstanding: int = 0
+    failures: int = 0
+    # Moving average of the response time, in seconds
+    latency: float | None = None
+    ejected_until: float = 0.0
+
+
+class LoadBalancer:
+    """Spread the requests to a service across its replicas.
+
+    Each request goes to whichever of two random replicas has the
+    fewest outstanding requests.  Replicas are checked passively:
+    those failing `eject_failures` times in a row, or responding
+    `slow_factor` times slower than the fastest replica, are left out
+    of rotation for `eject_time` seconds.  If every replica is out of
+    rotation, all of them are used.
+    """
+
+    # Weight of the latest response time in the moving average
+    LATENCY_WEIGHT = 0.3
+
+    def __init__(self, urls: list[str], settings: BalanceSettings) -> None:
+        self.settings = settings
+        self.replicas = [_Replica(url) for url in urls]
+
+    def _healthy(self) -> list[_Replica]:
+        now = monotonic()
+        healthy = []
+        for replica in self.replicas:
+            if replica.ejected_until == 0:
+                healthy.append(replica)
+            elif replica.ejected_until <= now:
+                # Back in rotation, with a clean record
+                log.info('Replica "%s" back in rotation', replica.url)
+                replica.ejected_until = 0
+                replica.failures = 0
+                replica.latency = None
+                healthy.append(replica)
+        return healthy or self.replicas
+
+    def _choose(self) -> _Replica:
+        healthy = self._healthy()
+        if len(healthy) == 1:
+            return healthy[0]
+        return min(sample(healthy, 2),
+                   key=lambda r: (r.outstanding, r.latency or 0))
+
+    def _eject(self, replica: _Replica, reason: str):
+        if replica.ejected_until == 0:
+            log.warning('Replica "%s" out of rotation: %s',
+                        replica.url,
+                        reason)
+        replica.ejected_until = monotonic() + self.settings.eject_time
+
+    def _success(self, replica: _Replica, elapsed: float):
+        replica.failures = 0
+        if replica.latency is None:
+            replica.latency = elapsed
+        else:
+            replica.latency = (self.LATENCY_WEIGHT * elapsed
+                               + (1 - self.LATENCY_WEIGHT) * replica.latency)
+        healthy = [r for r in self._healthy() if r.latency is not None]
+        if len(healthy) < 2:
+            return
+        fastest = min(r.latency for r in healthy)
+        if replica.latency > self.settings.slow_factor * fastest:
+            self._eject(replica, 'too slow')
+
+    def _failure(self, replica: _Replica):
+        replica.failures = replica.failures + 1
+        if replica.failures >= self.settings.eject_failures:
+            self._eject(replica, f'{replica.failures} failures in a row')
+
+    @asynccontextmanager
+    async def endpoint(self) -> AsyncIterator[str]:
+        """Choose the replica to send a request to.
+
+        The request is considered failed if it raises an exception
+        inside the context.
+        """
+        replica = self._choose()
+        replica.outstanding = replica.outstanding + 1
+        start = monotonic()
+        try:
+            yield replica.url
+        except Exception:
+            self._failure(replica)
+            raise
+        else:
+            self._success(replica, monotonic() - start)
+        finally:
+            replica.outstanding = replica.outstanding - 1
+
+
+# Load balancers are shared by every client of a service in the same
+# worker
+_balancers: dict[str, LoadBalancer] = {}
+
+
+def load_balancer(service: str,
+                  urls: list[str],
+                  settings: BalanceSettings,
+                  ) -> LoadBalancer:
+    """Get the load balancer of a service."""
+    if service not in _balancers:
+        _balancers[service] = LoadBalancer(urls, settings)
+    return _balancers[service]
+
+
 class Client[C](ABC):
     """Base class for any external service client.
 
@@ -40,7 +287,9 @@ class Client[C](ABC):
 
     The `Client` class includes a `retry()` method, which should be
     used when interacting with the service in order to provide
-    resiliency against service downtime.
+    resiliency against service downtime.  Retries are spread out with
+    exponential backoff, limited by the service's `RetryBudget`, and
+    skipped entirely while its `CircuitBreaker` is open.
     """
 
     def __init__(self, connection_settings: ConnectionSettings) -> None:
@@ -93,7 +342,16 @@ class Client[C](ABC):
     @property
     def initialized(self) -> bool:
         """Whether the client has been initialized or not."""
-        return self.client is not None
+        return self._client is not None
+
+    @property
+    def service(self) -> str:
+        """The name of the service, as seen by its circuit breaker.
+
+        Clients with the same service name share their circuit
+        breaker and retry budget.
+        """
+        return self.__class__.__name__
 
     async def retry[T](
         self,
@@ -127,10 +385,23 @@ class Client[C](ABC):
 
         :on_timeout: Optional function to run after each timeout.  The
         function can be async, and should take no arguments.
+
+        Attempts stop early if the deadline of the current pipeline
+        run would expire before the next one, if the retry budget of
+        the service is spent, or if its circuit breaker is open.
         """
+        settings = self.connection_settings
+        breaker = circuit_breaker(self.service, settings)
+        budget = retry_budget(self.service, settings)
+        budget.deposit()
         attempt = 0
         exc = []
-        while attempt < self.connection_settings.attempts:
+        while attempt < settings.attempts:
+            if not breaker.allow():
+                log.debug('Circuit breaker for "%s" is open', self.service)
+                msg = f'Service "{self.service}" is unavailable'
+                exc.append(ClientUnavailableError(msg))
+                break
             try:
                 if on_attempt_before is not None:
                     tmp = on_attempt_before(attempt)
@@ -139,19 +410,32 @@ class Client[C](ABC):
                 result = function()
                 if asyncio.iscoroutine(result):
                     result = await result
+                breaker.record_success()
                 if on_attempt_after is not None:
                     tmp = on_attempt_after(attempt)
                     if asyncio.iscoroutine(tmp):
                         await tmp
                 return result
             except until as e:
+                breaker.record_failure()
                 exc.append(e)
                 if on_timeout is not None:
                     tmp = on_timeout(attempt)
                     if asyncio.iscoroutine(tmp):
                         await tmp
                 attempt = attempt + 1
-                await asyncio.sleep(self.connection_settings.timeout)
+                if attempt >= settings.attempts:
+                    break
+                if not budget.withdraw():
+                    log.debug('Retry budget for "%s" is spent', self.service)
+                    break
+                delay = backoff(attempt - 1,
+                                settings.backoff_base,
+                                settings.timeout)
+                remaining = remaining_time()
+                if remaining is not None and remaining <= delay:
+                    break
+                await asyncio.sleep(delay)
                 continue
         ret = otherwise(exc)
         if asyncio.iscoroutine(ret):
@@ -159,11 +443,217 @@ class Client[C](ABC):
         return ret
 
 
+class SharedSession(Client[ClientSession]):
+    """A pooled aiohttp session shared by every client of a service.
+
+    Shared sessions are created once at startup, so connections are
+    kept alive and reused between requests.  The connection pool is
+    configured through the service's `ConnectionSettings`.
+    """
+
+    @override
+    async def _start(self) -> ClientSession:
+        connector = TCPConnector(
+            limit=self.connection_settings.limit,
+            limit_per_host=self.connection_settings.limit_per_host,
+            ttl_dns_cache=self.connection_settings.dns_cache_ttl,
+            keepalive_timeout=self.connection_settings.keepalive_timeout,
+        )
+        return ClientSession(connector=connector)
+
+    @override
+    async def _stop(self, client: ClientSession):
+        await client.close()
+
+
+# HTTP responses with this status or above are failures of the
+# service, rather than of the request
+SERVER_ERROR = 500
+
+
+class ResponseStatusError(ClientResponseError):
+    """Raised when an HTTP service responds with an error status."""
+
+    @classmethod
+    def of(cls, response: ClientResponse) -> Self:
+        """Get the error for an HTTP response."""
+        return cls(response.request_info,
+                   response.history,
+                   status=response.status,
+                   message=str(response.reason),
+                   headers=response.headers)
+
+
 class AiohttpClient(Client[ClientSession]):
+    """Base class for clients of HTTP services.
+
+    If a `SharedSession` is supplied, requests are sent through its
+    connection pool, and leaving the client leaves the pool open.
+    Otherwise, the client uses a session of its own.
+
+    Requests are sent to `url` if there's one, and otherwise to the
+    replica chosen by the `LoadBalancer`.
+    """
+
+    def __init__(self,
+                 connection_settings: ConnectionSettings,
+                 shared: SharedSession | None = None,
+                 *,
+                 url: str | None = None,
+                 balancer: LoadBalancer | None = None,
+                 ) -> None:
+        super().__init__(connection_settings)
+        self.shared = shared
+        self.url = url
+        self.balancer = balancer
+        self._owns_session = True
+
+    @asynccontextmanager
+    async def endpoint(self) -> AsyncIterator[str]:
+        """Get the base URL to send a request to.
+
+        Each request should get its own, so retries can go to a
+        different replica.
+        """
+        if self.url is not None or self.balancer is None:
+            yield self.url
+            return
+        async with self.balancer.endpoint() as url:
+            yield url
+
+    async def send[T](self,
+                      post: Callable[[str], Awaitable[T]],
+                      ) -> T | None:
+        """Send a request to the endpoint.
+
+        :param post: A function sending the request, given the base
+        URL.  It should raise `ResponseStatusError` for responses with
+        an error status.
+
+        :return: The result of `post`, or `None` if the request got a
+        client error status.  Client errors are the request's fault,
+        so they count as successes of the replica.  Server error
+        statuses count as failures of the replica, and are raised
+        again so `retry()` counts them as failures of the service.
+        """
+        async with self.endpoint() as base:
+            try:
+                return await post(base)
+            except ResponseStatusError as e:
+                if e.status >= SERVER_ERROR:
+                    raise
+                return None
+
     @override
     async def _start(self) -> ClientSession:
+        if self.shared is not None and self.shared.initialized:
+            self._owns_session = False
+            return self.shared.client
+        self._owns_session = True
         return ClientSession()
 
     @override
     async def _stop(self, client: ClientSession):
-        await client.close()
+        if self._owns_session:
+            await client.close()
+
+
+@dataclass
+class _Batch:
+    # Whatever the coalescer needs to send the batch, taken from its
+    # first request
+    context: Any
+    rows: list = field(default_factory=list)
+    # The slice of the rows belonging to each waiting request
+    waiters: list[tuple[int, int, asyncio.Future]] = field(
+        default_factory=list,
+    )
+    timer: asyncio.TimerHandle | None = None
+
+
+class Coalescer(ABC):
+    """Group compatible requests to a service into a single request.
+
+    Requests are held for up to `window` seconds, or until `max_rows`
+    rows are pending, and then sent together.  Only requests with the
+    same key are grouped.  Each requester receives the part of the
+    response matching its own rows.
+    """
+
+    def __init__(self,
+                 window: float,
+                 max_rows: int,
+                 shared: SharedSession | None = None,
+                 ) -> None:
+        self.window = window
+        self.max_rows = max_rows
+        # The session batches are sent through, if any
+        self.shared = shared
+        self._batches: dict[tuple, _Batch] = {}
+        self._sending: set[asyncio.Task] = set()
+
+    @abstractmethod
+    async def send(self, context: Any, rows: list) -> list:  # noqa: ANN401
+        """Send a batch of rows to the service.
+
+        :return: One result per row, in the same order.
+        """
+        ...
+
+    async def submit(self,
+                     key: tuple,
+                     context: Any,  # noqa: ANN401
+                     rows: list,
+                     ) -> list:
+        """Add rows to the batch with the given key.
+
+        :return: The results of the rows, once the batch is sent.
+        """
+        batch = self._batches.get(key)
+        if (batch is not None
+                and len(batch.rows) + len(rows) > self.max_rows):
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = _Batch(context)
+            self._batches[key] = batch
+            batch.timer = asyncio.get_running_loop().call_later(
+                self.window,
+                self._flush,
+                key,
+            )
+        future = asyncio.get_running_loop().create_future()
+        start = len(batch.rows)
+        batch.rows.extend(rows)
+        batch.waiters.append((start, len(batch.rows), future))
+        if len(batch.rows) >= self.max_rows:
+            self._flush(key)
+        return await future
+
+    def _flush(self, key: tuple):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        log.debug('%s: Sending %s requests (%s rows) at once',
+                  self.__class__.__name__,
+                  len(batch.waiters),
+                  len(batch.rows))
+        # The request is shared, so it isn't bound by the deadline of
+        # whichever job happened to fill the batch
+        task = asyncio.create_task(self._send(batch), context=Context())
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: _Batch):
+        try:
+            results = await self.send(batch.context, batch.rows)
+        except Exception as e:
+            for _, _, future in batch.waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for start, end, future in batch.waiters:
+            if not future.done():
+                future.set_result(results[start:end])
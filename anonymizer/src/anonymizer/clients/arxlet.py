@@ -3,28 +3,77 @@
 #
 # See LICENSE file in the project root for details.
 
-from json import loads
+from json import dumps, loads
+from typing import override
 import aiohttp
-from urllib.parse import urljoin
 
-from anonymizer.clients import AiohttpClient
+from anonymizer.clients import (
+    AiohttpClient,
+    Coalescer,
+    ResponseStatusError,
+    SharedSession,
+    load_balancer,
+)
 from anonymizer.config import config, log
 from anonymizer.execution.exceptions import JobError
 from anonymizer.models import arxlet
 
 
 class ARXletClient(AiohttpClient):
+    SERVICE = 'ARXlet'
     ENDPOINT_ATTRIBUTES = '/attributes'
     ENDPOINT_OBJECTS = '/objects'
 
-    def __init__(self, url: str):
-        super().__init__(config.services.arxlet.connection)
-        self.url = url
+    def __init__(self,
+                 url: str | None = None,
+                 shared: SharedSession | None = None,
+                 ):
+        """Create a client.
+
+        :param url: The URL to send requests to.  If `None`, requests
+        are spread across the replicas in the configuration.
+        """
+        settings = config.services.arxlet
+        balancer = None
+        if url is None:
+            balancer = load_balancer(self.SERVICE,
+                                     settings.endpoints,
+                                     settings.balance)
+        super().__init__(settings.connection,
+                         shared,
+                         url=url,
+                         balancer=balancer)
+
+    @property
+    @override
+    def service(self) -> str:
+        if self.url is None:
+            return self.SERVICE
+        return f'{self.SERVICE} {self.url}'
+
+    def _url(self, base: str, endpoint: str) -> str:
+        # Endpoints are relative to the path of the base URL, which
+        # urljoin() would discard
+        return base.rstrip('/') + endpoint
 
     def get_version(self) -> str:
         """Return the current ARXlet version."""
         return arxlet.VERSION
 
+    async def anonymize(self,
+                        endpoint: str,
+                        data: list,
+                        pets: list[arxlet.Pet],
+                        ) -> list | None:
+        """Apply the specified PETs to attributes or objects.
+
+        :param endpoint: Either `ENDPOINT_ATTRIBUTES` or
+        `ENDPOINT_OBJECTS`.
+        """
+        if endpoint == self.ENDPOINT_OBJECTS:
+            return await self.anonymize_objects(data, pets)
+        return await self.anonymize_attributes(data, pets)
+
     async def anonymize_attributes(self,
                                    attributes: list[arxlet.AttributeData],
                                    pets: list[arxlet.Pet],
@@ -37,15 +86,18 @@ class ARXletClient(AiohttpClient):
         :rtype: List[str] | None
         """
         request = arxlet.AttributeRequest(data=attributes, pets=pets)
-        url = urljoin(self.url, self.ENDPOINT_ATTRIBUTE)
         body = request.model_dump_json(by_alias=True)
         body = loads(body)
 
-        async def _function() -> list[str] | None:
+        async def _post(base: str) -> list[str]:
+            url = self._url(base, self.ENDPOINT_ATTRIBUTES)
+            log.debug('Using ARXlet URL %s', url)
             async with (self.client.post(url, json=body)
                         as response):
                 if response.status != 200:
-                    return None
+                    log.error('ARXlet request returned HTTP status %s',
+                              response.status)
+                    raise ResponseStatusError.of(response)
                 return await response.json()
 
         def _otherwise(e: list[Exception]):
@@ -53,7 +105,7 @@ class ARXletClient(AiohttpClient):
             raise JobError(msg) from e[-1]
 
         return await self.retry(
-            function=_function,
+            function=lambda: self.send(_post),
             until=(aiohttp.ClientError),
             otherwise=_otherwise,
         )
@@ -71,19 +123,19 @@ class ARXletClient(AiohttpClient):
 
         """
         request = arxlet.ObjectRequest(data=objects, pets=pets)
-        url = self.url + ARXletClient.ENDPOINT_OBJECTS
         body = request.model_dump_json(by_alias=True)
         body = loads(body)
-        log.debug('Using ARXlet URL %s', url)
 
-        async def _function() -> list[list[arxlet.Attribute]] | None:
+        async def _post(base: str) -> list[list[arxlet.Attribute]]:
+            url = self._url(base, self.ENDPOINT_OBJECTS)
+            log.debug('Using ARXlet URL %s', url)
             async with (self.client.post(url, json=body)
                         as response):
                 if response.status != 200:
                     log.error('ARXlet request returned HTTP status %s',
                               response.status)
                     log.debug('Request body: %s', body)
-                    return None
+                    raise ResponseStatusError.of(response)
                 response = await response.json()
                 formatted_response = []
                 for obj in response:
@@ -98,7 +150,50 @@ class ARXletClient(AiohttpClient):
             raise JobError(msg) from e[-1]
 
         return await self.retry(
-            function=_function,
+            function=lambda: self.send(_post),
             until=(aiohttp.ClientError),
             otherwise=_otherwise,
         )
+
+
+class ARXletCoalescer(Coalescer):
+    """Group compatible ARXlet requests into a single request.
+
+    Only requests to the same URL and endpoint, with the same PETs and
+    the same compatibility key are grouped.  Grouped rows are
+    anonymized as a single data set, so the compatibility key is
+    expected to identify requests whose data can be released
+    together.
+    """
+
+    async def anonymize(self,
+                        url: str | None,
+                        endpoint: str,
+                        data: list,
+                        pets: list[arxlet.Pet],
+                        key: tuple,
+                        ) -> list:
+        """Apply the specified PETs to attributes or objects.
+
+        :param key: The compatibility key of the request.
+
+        :return: The anonymized data, in the same order.
+        """
+        pets_key = dumps([p.model_dump(mode='json') for p in pets],
+                         sort_keys=True)
+        return await self.submit((url, endpoint, pets_key, *key),
+                                 (url, endpoint, pets),
+                                 data)
+
+    @override
+    async def send(self,
+                   context: tuple[str | None, str, list[arxlet.Pet]],
+                   rows: list,
+                   ) -> list:
+        url, endpoint, pets = context
+        async with ARXletClient(url, self.shared) as client:
+            response = await client.anonymize(endpoint, rows, pets)
+        if response is None:
+            msg = 'ARXlet request failed'
+            raise JobError(msg)
+        return response
@@ -12,6 +12,7 @@ from oic.utils.authn.client import CLIENT_AUTHN_METHOD
 from oic.utils.jwt import JWT
 from requests.exceptions import ConnectionError as RequestsConnectionError
 
+from anonymizer.clients import SharedSession
 from anonymizer.config import AuthProvider, config, log
 from anonymizer.models.auth import AuthenticationResponse
 from anonymizer.util import retry
@@ -49,16 +50,24 @@ class OpenIDConnectClient(AuthClient):
     _CREDENTIALS_DIRECT_GRANT = ('username',
                                  'password')
 
-    def __init__(self, url: str, redirect: str):
+    def __init__(self,
+                 url: str,
+                 redirect: str,
+                 shared: SharedSession | None = None):
         """Initialize the OpenID Connect client.
 
         :param url: The URL of the OpenID Connect authorization
         server.
 
         :param redirect: The redirect URL.
+
+        :param shared: The pooled session to send authorization
+        requests through.  If missing, every request uses a new
+        session.
         """
         super().__init__(url)
         self.redirect = redirect
+        self.shared = shared
         self.client = Client(client_authn_method=CLIENT_AUTHN_METHOD)
         self.config = {}  # Use to store authentication info such as endpoints
         self.config.update(**self.client.provider_config(self.url))
@@ -82,14 +91,25 @@ class OpenIDConnectClient(AuthClient):
             }
         if client_secret is not None:
             params['client_secret'] = client_secret.get_secret_value()
+        endpoint = self.config['token_endpoint']
+        if self.shared is not None and self.shared.initialized:
+            return await self._request_token(self.shared.client,
+                                             endpoint,
+                                             params)
         async with ClientSession() as session:
-            endpoint = self.config['token_endpoint']
-            async with session.post(endpoint, data=params) as resp:
-                data = await resp.json()
-                return (AuthenticationResponse.fail()
-                        if not all(k in data
-                                   for k in self._REQUIRED_FIELDS_TOKEN)
-                        else AuthenticationResponse.success(data))
+            return await self._request_token(session, endpoint, params)
+
+    async def _request_token(self,
+                             session: ClientSession,
+                             endpoint: str,
+                             params: dict,
+                             ) -> AuthenticationResponse:
+        async with session.post(endpoint, data=params) as resp:
+            data = await resp.json()
+            return (AuthenticationResponse.fail()
+                    if not all(k in data
+                               for k in self._REQUIRED_FIELDS_TOKEN)
+                    else AuthenticationResponse.success(data))
 
     async def _authorize_jwt(self, token: str) -> AuthenticationResponse:
         jwt = JWT(keyjar=self.client.keyjar, iss=self.client.issuer)
@@ -126,14 +146,16 @@ class OpenIDConnectClient(AuthClient):
         return AuthenticationResponse.fail()
 
 
-async def create_keycloak_client() -> AuthClient:
+async def create_keycloak_client(
+        shared: SharedSession | None = None,
+) -> AuthClient:
     """Initialize a Keycloak auth client.
 
     This method will either return a working `AuthClient`, or raise
     `ValueError`.
     """
     async def _inner() -> AuthClient:  # noqa: RUF029
-        return OpenIDConnectClient(url, 'http://localhost')
+        return OpenIDConnectClient(url, 'http://localhost', shared)
 
     async def on_failure():  # noqa: RUF029
         msg = 'Max retries exceeded when connecting to the Keycloak provider'
@@ -12,7 +12,11 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from mysql.connector import Error, connect
 
 from anonymizer.config import config, log
-from anonymizer.models.data_model import Request
+from anonymizer.models.data_model import (
+    Request,
+    decode_requests,
+    encode_request,
+)
 
 
 class ContextClient(ABC):
@@ -54,6 +58,19 @@ class ContextClient(ABC):
         """
         ...
 
+    @abstractmethod
+    async def rehash(self) -> int:
+        """Store every Request again under its current hash.
+
+        Requests are stored under their hash, so after a change to
+        how hashes are computed, Requests stored before are missed by
+        `record()` and stored twice.  This is a one-off migration, run
+        through the `rehash` script.
+
+        :return: The amount of Requests whose hash changed.
+        """
+        ...
+
     # In the future, an update() method might be required to make sure
     # types are propagated in case a new type is added.  This is
     # because the Request hash is calculated including types Check
@@ -69,6 +86,10 @@ class NoContextClient(ContextClient):
     async def record(self, *_) -> bool:
         return False
 
+    @override
+    async def rehash(self) -> int:
+        return 0
+
 
 class MongoDBContextClient(ContextClient):
     def __init__(self, url: str | None = None):
@@ -119,11 +140,8 @@ class MongoDBContextClient(ContextClient):
             # Look for a series of types in the Request as well
             query['$and'].append(request_filter)
 
-        ret = []
-        async for e in self.collection.find(query, projection):
-            req = Request.from_dict(e)
-            ret.append(req)
-        return ret
+        cursor = self.collection.find(query, projection)
+        return decode_requests(await cursor.to_list(None))
 
     @override
     async def record(self, request: Request) -> bool:
@@ -131,12 +149,25 @@ class MongoDBContextClient(ContextClient):
             '_id': request.to_hash(),
         }
         insert = {
-            '$set': Request.to_dict(request),
+            '$set': encode_request(request),
         }
         insert['$set'].update(filterr)
         await self.collection.update_one(filterr, insert, upsert=True)
         return True
 
+    @override
+    async def rehash(self) -> int:
+        rehashed = 0
+        async for document in self.collection.find({}):
+            old = document.pop('_id')
+            request = Request.from_dict(document)
+            if request.to_hash() == old:
+                continue
+            await self.record(request)
+            await self.collection.delete_one({'_id': old})
+            rehashed = rehashed + 1
+        return rehashed
+
 
 class MySQLContextClient(ContextClient):
     def __init__(self,
@@ -202,9 +233,7 @@ class MySQLContextClient(ContextClient):
                      # conditions
                      f'WHERE ({conditions})\n' if conditions != '' else '')
             cursor.execute(query)
-            response = []
-            for j in cursor:
-                response.append(Request.from_dict(loads(j[0])))
+            response = decode_requests(loads(j[0]) for j in cursor)
             cursor.close()
             connection.close()
             return response
@@ -233,7 +262,7 @@ class MySQLContextClient(ContextClient):
                 '(Hash, Json, ComponentTypes, RequestTypes)\n'
                 'VALUES (%s, %s, %s, %s);\n'
             )
-            request_json = dumps(Request.to_dict(request))
+            request_json = dumps(encode_request(request))
 
             data = [
                 request.to_hash(),
@@ -254,3 +283,43 @@ class MySQLContextClient(ContextClient):
             if connection is not None:
                 connection.close()
             return False
+
+    @override
+    async def rehash(self) -> int:
+        connection = None
+        cursor = None
+        rehashed = 0
+        try:
+            connection = connect(user=self.username,
+                                 password=self.password,
+                                 host=self.host,
+                                 port=self.port,
+                                 database=self.database)
+            cursor = connection.cursor()
+            query = f'SELECT Hash, Json FROM {self.table}\n'  # noqa: S608
+            cursor.execute(query)
+            stale = []
+            for old, request_json in cursor.fetchall():
+                request = Request.from_dict(loads(request_json))
+                if request.to_hash() != old:
+                    stale.append((old, request))
+            for old, request in stale:
+                if not await self.record(request):
+                    break
+                query = (
+                    f'DELETE FROM {self.table}\n'  # noqa: S608
+                    'WHERE Hash = %s;\n'
+                )
+                cursor.execute(query, [old])
+                connection.commit()
+                rehashed = rehashed + 1
+            cursor.close()
+            connection.close()
+        except Error:
+            log.error('Error while rehashing context in MySQL database')
+            log.debug(format_exc())
+            if cursor is not None:
+                cursor.close()
+            if connection is not None:
+                connection.close()
+        return rehashed
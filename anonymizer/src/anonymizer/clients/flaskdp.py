@@ -5,11 +5,17 @@
 
 from dataclasses import dataclass
 from json import loads
-from urllib.parse import urljoin
+from typing import override
 
 from aiohttp import ClientError
 
-from anonymizer.clients import AiohttpClient
+from anonymizer.clients import (
+    AiohttpClient,
+    Coalescer,
+    ResponseStatusError,
+    SharedSession,
+    load_balancer,
+)
 from anonymizer.config import config, log
 from anonymizer.execution.exceptions import JobError
 from anonymizer.models import flaskdp
@@ -25,11 +31,35 @@ class DPConfiguration:
 
 
 class FlaskDPClient(AiohttpClient):
+    SERVICE = 'FlaskDP'
     ENDPOINT_APPLY = '/api/dp/apply'
 
-    def __init__(self, url: str):
-        super().__init__(config.services.flaskdp.connection)
-        self.url = url
+    def __init__(self,
+                 url: str | None = None,
+                 shared: SharedSession | None = None,
+                 ):
+        """Create a client.
+
+        :param url: The URL to send requests to.  If `None`, requests
+        are spread across the replicas in the configuration.
+        """
+        settings = config.services.flaskdp
+        balancer = None
+        if url is None:
+            balancer = load_balancer(self.SERVICE,
+                                     settings.endpoints,
+                                     settings.balance)
+        super().__init__(settings.connection,
+                         shared,
+                         url=url,
+                         balancer=balancer)
+
+    @property
+    @override
+    def service(self) -> str:
+        if self.url is None:
+            return self.SERVICE
+        return f'{self.SERVICE} {self.url}'
 
     def get_version(self) -> str:
         """Return the current FlaskDP version."""
@@ -45,19 +75,21 @@ class FlaskDPClient(AiohttpClient):
 
         :rtype: FlaskDPResponse or None
         """
-        url = urljoin(self.url, self.ENDPOINT_APPLY)
         body = request.model_dump_json(by_alias=True)
         body = loads(body)
-        log.debug('Using FlaskDP URL %s', url)
 
-        async def _function() -> flaskdp.FlaskDPResponse | None:
+        async def _post(base: str) -> flaskdp.FlaskDPResponse:
+            # The endpoint is relative to the path of the base URL,
+            # which urljoin() would discard
+            url = base.rstrip('/') + self.ENDPOINT_APPLY
+            log.debug('Using FlaskDP URL %s', url)
             async with (self.client.post(url, json=body)
                         as response):
                 if response.status != 200:
                     log.error('FlaskDP request returned HTTP status %s',
                               response.status)
                     log.debug('Request body: %s', body)
-                    return None
+                    raise ResponseStatusError.of(response)
                 resp = await response.json()
                 return flaskdp.FlaskDPResponse.model_validate(resp)
 
@@ -66,7 +98,43 @@ class FlaskDPClient(AiohttpClient):
             raise JobError(msg) from e[-1]
 
         return await self.retry(
-            function=_function,
+            function=lambda: self.send(_post),
             until=(ClientError),
             otherwise=_otherwise,
         )
+
+
+class FlaskDPCoalescer(Coalescer):
+    """Send the DP items of concurrent requests in a single request.
+
+    Noise is drawn independently for every item, so the items of any
+    two requests to the same URL can be grouped.
+    """
+
+    async def apply_dp(self,
+                       url: str | None,
+                       items: list[flaskdp.ItemRequest],
+                       ) -> list[list[float]]:
+        """Apply DP to the specified items.
+
+        :return: The new values of each item, in the same order.
+        """
+        return await self.submit((url,), url, items)
+
+    @override
+    async def send(self,
+                   context: str | None,
+                   rows: list[flaskdp.ItemRequest],
+                   ) -> list[list[float]]:
+        # Item identifiers are only unique within their own request
+        items = [item.model_copy(update={'id': str(i)})
+                 for i, item in enumerate(rows)]
+        async with FlaskDPClient(context, self.shared) as client:
+            response = await client.apply_dp(
+                flaskdp.FlaskDPRequest(items=items),
+            )
+        if response is None:
+            msg = 'FlaskDP request failed'
+            raise JobError(msg)
+        values = {item.id: item.values for item in response.items}
+        return [values[str(i)] for i in range(len(rows))]
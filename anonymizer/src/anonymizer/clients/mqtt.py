@@ -3,8 +3,9 @@
 #
 # See LICENSE file in the project root for details.
 
+from collections.abc import Awaitable, Callable
 from json import dumps
-from typing import override
+from typing import Any, override
 from uuid import uuid4
 from gmqtt import Client as ClientMQTT
 
@@ -21,8 +22,22 @@ class MQTTClient(Client[ClientMQTT]):
                  ssl: bool | None = None,
                  topic: str | None = None,
                  client_id: str | None = None,
+                 *,
+                 optimistic_acknowledgement: bool = True,
+                 receive_maximum: int | None = None,
                  ) -> None:
+        """Create an MQTT client.
+
+        :param optimistic_acknowledgement: If False, messages received
+        are only acknowledged once the subscription callback returns,
+        instead of as soon as they arrive.
+
+        :param receive_maximum: Maximum amount of unacknowledged
+        messages the broker can send at the same time.
+        """
         super().__init__(config.services.mqtt.connection)
+        self.optimistic_acknowledgement = optimistic_acknowledgement
+        self.receive_maximum = receive_maximum
         if host is not None:
             self.host = host
         else:
@@ -63,7 +78,14 @@ class MQTTClient(Client[ClientMQTT]):
 
     @override
     async def _start(self) -> ClientMQTT:
-        c = ClientMQTT(self.client_id)
+        properties = {}
+        if self.receive_maximum is not None:
+            properties['receive_maximum'] = self.receive_maximum
+        c = ClientMQTT(
+            self.client_id,
+            optimistic_acknowledgement=self.optimistic_acknowledgement,
+            **properties,
+        )
 
         log.debug('Connecting to host %s, port %s', self.host, self.port)
 
@@ -81,3 +103,24 @@ class MQTTClient(Client[ClientMQTT]):
     def publish(self, topic: str, message: dict | list):
         """Publish an MQTT message."""
         self.client.publish(topic, dumps(message))
+
+    def subscribe(self,
+                  topic: str,
+                  callback: Callable[[bytes], Awaitable[None]],
+                  qos: int = 1):
+        """Subscribe to an MQTT topic.
+
+        The callback receives the payload of every message.  Unless
+        the client acknowledges messages optimistically, each message
+        is only acknowledged once the callback returns.
+        """
+        async def on_message(_client: ClientMQTT,
+                             _topic: str,
+                             payload: bytes,
+                             _qos: int,
+                             _properties: Any) -> int:  # noqa: ANN401
+            await callback(payload)
+            return 0
+
+        self.client.on_message = on_message
+        self.client.subscribe(topic, qos=qos)
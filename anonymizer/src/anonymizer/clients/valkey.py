@@ -6,10 +6,11 @@
 from collections.abc import Callable
 from datetime import datetime
 from typing import override
+from uuid import uuid4
 
 from msgpack import packb, unpackb
 from valkey import asyncio as valkey
-from valkey.backoff import ConstantBackoff
+from valkey.backoff import FullJitterBackoff
 from valkey.asyncio.retry import Retry
 
 from anonymizer.clients import Client
@@ -18,6 +19,11 @@ from anonymizer.config import config, log
 
 class ValkeyClient(Client[valkey.Valkey]):
     KEY_AUDITS = 'AUDITS'
+    KEY_QUEUE = 'QUEUE'
+
+    JOB_QUEUED = 'queued'
+    JOB_RUNNING = 'running'
+    JOB_DONE = 'done'
 
     def __init__(self) -> None:
         super().__init__(config.valkey.connection)
@@ -26,7 +32,8 @@ class ValkeyClient(Client[valkey.Valkey]):
     async def _start(self) -> valkey.Valkey:
         # Valkey includes retry helpers which can replace our own.
         retry = Retry(
-            ConstantBackoff(self.connection_settings.timeout),
+            FullJitterBackoff(cap=self.connection_settings.timeout,
+                              base=self.connection_settings.backoff_base),
             retries=self.connection_settings.attempts,
         )
 
@@ -71,9 +78,12 @@ class ValkeyClient(Client[valkey.Valkey]):
     async def _del_str(self, *keys: str) -> int:
         return await self.client.delete(*(self._str_key(k) for k in keys))
 
-    async def _set_dict(self, key: str, value: dict) -> bool:
+    async def _set_dict(self,
+                        key: str,
+                        value: dict,
+                        ttl: int | None = None) -> bool:
         pack = packb(value)
-        return await self.client.set(self._dict_key(key), pack)
+        return await self.client.set(self._dict_key(key), pack, ex=ttl)
 
     async def _get_dict(self, key: str) -> dict | None:
         pack = await self.client.get(self._dict_key(key))
@@ -84,6 +94,38 @@ class ValkeyClient(Client[valkey.Valkey]):
     async def _del_dict(self, *keys: str) -> int:
         return await self.client.delete(*(self._dict_key(k) for k in keys))
 
+    def _job_key(self, job_id: str) -> str:
+        return f'job-{job_id}'
+
+    async def enqueue_job(self, job: dict, ttl: int) -> str:
+        """Add a job to the end of the job queue.
+
+        :return: The identifier of the job, which can be used to
+        retrieve its state with `get_job()`.
+        """
+        job_id = uuid4().hex
+        await self.set_job(job_id, {'state': self.JOB_QUEUED}, ttl)
+        await self.client.rpush(self.KEY_QUEUE, packb({'id': job_id} | job))
+        return job_id
+
+    async def dequeue_job(self, timeout: int) -> dict | None:
+        """Take the first job from the job queue.
+
+        Waits up to `timeout` seconds for a job to be queued.
+        """
+        popped = await self.client.blpop([self.KEY_QUEUE], timeout)
+        if popped is None:
+            return None
+        return unpackb(popped[1])
+
+    async def set_job(self, job_id: str, state: dict, ttl: int) -> bool:
+        """Store the state of a job for `ttl` seconds."""
+        return await self._set_dict(self._job_key(job_id), state, ttl)
+
+    async def get_job(self, job_id: str) -> dict | None:
+        """Retrieve the state of a job, if it hasn't expired."""
+        return await self._get_dict(self._job_key(job_id))
+
     async def log_audit(self,
                         audit: dict,
                         timestamp: float | None = None) -> float:
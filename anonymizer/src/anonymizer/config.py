@@ -52,6 +52,26 @@ class BaseSettingsField(BaseModel):
 class ConnectionSettings(BaseSettingsField):
     timeout: int = 5
     attempts: int = 5
+    # Maximum amount of open connections to the service, in total and
+    # per host.  Zero means no limit.
+    limit: int = 100
+    limit_per_host: int = 0
+    # Seconds DNS lookups are cached for
+    dns_cache_ttl: int = 10
+    # Seconds idle connections are kept open for reuse
+    keepalive_timeout: float = 15
+    # Seconds to wait before the first retry.  Each retry waits a
+    # random time of up to twice as long as the previous one, but no
+    # longer than `timeout`.
+    backoff_base: float = 0.1
+    # Retries allowed per request sent to the service, and the amount
+    # of retries that can be spent at once
+    retry_ratio: float = 0.2
+    retry_burst: int = 10
+    # Consecutive failures before requests to the service fail fast,
+    # and seconds to wait before letting a request through again
+    breaker_threshold: int = 5
+    breaker_reset: float = 30
 
 
 class KeycloakSettings(BaseSettingsField):
@@ -74,13 +94,55 @@ class MySQLSettings(BaseSettingsField):
     table: str = 'Context'
 
 
-class ARXletSettings(BaseSettingsField):
-    url: HttpUrl
+class CoalesceSettings(BaseSettingsField):
+    # Milliseconds to wait for compatible requests before sending
+    window_ms: int = 20
+    # Maximum amount of rows sent in a single request
+    max_rows: int = 5000
+
+
+class BalanceSettings(BaseSettingsField):
+    # Consecutive failures before a replica is left out of rotation
+    eject_failures: int = 3
+    # Replicas this many times slower than the fastest one are left
+    # out of rotation too
+    slow_factor: float = 5
+    # Seconds a replica stays out of rotation
+    eject_time: float = 30
+
+
+class ReplicatedServiceSettings(BaseSettingsField):
+    # Either a single URL, a list of replicas to spread requests
+    # across, or both
+    url: HttpUrl | None = None
+    urls: list[HttpUrl] = []
+    balance: BalanceSettings = BalanceSettings()
+
+    @model_validator(mode='after')
+    def ensure_endpoints(self) -> Self:
+        """Ensure that there's at least one URL."""
+        if self.url is None and not self.urls:
+            msg = 'At least one of "url" or "urls" is required'
+            raise ValueError(msg)
+        return self
+
+    @property
+    def endpoints(self) -> list[str]:
+        """The URLs of every replica of the service."""
+        urls = self.urls if self.url is None else [self.url, *self.urls]
+        return [u.unicode_string() for u in urls]
+
+
+class ARXletSettings(ReplicatedServiceSettings):
+    # Group compatible requests of concurrent jobs into one.  Jobs
+    # still have to opt in, see `arxlet.FromPets`.
+    coalesce: CoalesceSettings | None = None
     connection: ConnectionSettings = ConnectionSettings()
 
 
-class FlaskDPSettings(BaseSettingsField):
-    url: HttpUrl
+class FlaskDPSettings(ReplicatedServiceSettings):
+    # Send the DP items of concurrent jobs in a single request
+    coalesce: CoalesceSettings | None = None
     connection: ConnectionSettings = ConnectionSettings()
 
 
@@ -91,6 +153,20 @@ class MISPSettings(BaseSettingsField):
     connection: ConnectionSettings = ConnectionSettings()
 
 
+class MQTTIngestSettings(BaseSettingsField):
+    # Topic to consume requests from.  Use a shared subscription
+    # ("$share/<group>/<topic>") to split messages across processes.
+    input_topic: str
+    # Topic to publish the results to
+    output_topic: str
+    # Transformer used to validate and transform every message
+    transformer: str = 'misp.MispTransformer'
+    qos: int = 1
+    # Maximum amount of messages executing the pipeline at the same
+    # time.  Consumption pauses while the limit is reached.
+    max_in_flight: int = 16
+
+
 class MQTTSettings(BaseSettingsField):
     host: str
     port: int | None = 1883
@@ -99,6 +175,7 @@ class MQTTSettings(BaseSettingsField):
     ssl: bool = True
     topic: str
     client_id: str | None = None
+    ingest: MQTTIngestSettings | None = None
     connection: ConnectionSettings = ConnectionSettings()
 
 
@@ -109,6 +186,15 @@ class AuditSettings(BaseSettingsField):
 
 class PipelineSettings(BaseSettingsField):
     file: FilePath | None = None
+    # Seconds between pipeline file modification checks.  Set to 0 to
+    # disable hot reloading.
+    reload_interval: int = 5
+    # Maximum amount of items of a batch executing the pipeline at the
+    # same time.
+    max_in_flight: int = 16
+    # Maximum size in bytes of each item of a streamed request (16
+    # MiB).  Larger items are skipped with a 413 status.
+    max_item_size: int = 16777216
 
 
 class AuthSettings(BaseSettingsField):
@@ -153,6 +239,23 @@ class ValkeySettings(BaseSettingsField):
     connection: ConnectionSettings = ConnectionSettings()
 
 
+class QueueSettings(BaseSettingsField):
+    # Amount of workers draining the job queue in each Anonymizer
+    # process.  Defaults to 0, which only enqueues requests, as the
+    # queue lives in Valkey and workers would otherwise keep polling
+    # a deployment without it.
+    workers: int = 0
+    # Seconds a worker waits for a queued request before checking
+    # again.
+    poll_timeout: int = 5
+    # Seconds the result of a queued request is kept after being
+    # stored.
+    result_ttl: int = 3600
+    # Whether to publish an MQTT message whenever a queued request
+    # finishes.
+    notify: bool = False
+
+
 class ContextSettings(BaseSettingsField):
     provider: ContextProvider = ContextProvider.NONE
     mongodb: MongoDBSettings | None = None
@@ -185,6 +288,7 @@ class Settings(BaseSettings):
     pipeline: PipelineSettings = PipelineSettings()
     auth: AuthSettings = AuthSettings()
     valkey: ValkeySettings = ValkeySettings()
+    queue: QueueSettings = QueueSettings()
     context: ContextSettings = ContextSettings()
     services: ServiceSettings = ServiceSettings()
 
@@ -4,9 +4,29 @@
 # See LICENSE file in the project root for details.
 
 from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
+from time import monotonic
+from types import SimpleNamespace
 from typing import Any
 
+# The environment of the pipeline run executing in the current task.
+# Pipelines are shared between concurrent requests, so jobs look up
+# their environment here instead of storing it themselves.
+_current_env: ContextVar[SimpleNamespace | None] = ContextVar(
+    'current_env',
+    default=None,
+)
+
+# The moment (as given by `time.monotonic()`) by which the work
+# executing in the current task must be done, if any.
+_deadline: ContextVar[float | None] = ContextVar(
+    'deadline',
+    default=None,
+)
+
 
 class ReadsFromPolicies(ABC):
     @abstractmethod
@@ -18,3 +38,65 @@ class ReadsFromPolicies(ABC):
 class Result:
     success: bool
     result: Any
+
+
+@dataclass(frozen=True)
+class Dataflow:
+    """The env locations a job depends on.
+
+    - reads: locations the job only reads from.
+    - writes: locations the job sets, replacing any previous value.
+    - updates: locations whose contents the job modifies in place.
+      Jobs updating the same location may run at the same time.
+    """
+
+    reads: frozenset[str] = frozenset()
+    writes: frozenset[str] = frozenset()
+    updates: frozenset[str] = frozenset()
+
+
+def current_env() -> SimpleNamespace | None:
+    """Get the environment of the current pipeline run, if any."""
+    return _current_env.get()
+
+
+@contextmanager
+def bind_env(env: SimpleNamespace) -> Iterator[SimpleNamespace]:
+    """Make `env` the current environment until the block exits."""
+    token = _current_env.set(env)
+    try:
+        yield env
+    finally:
+        _current_env.reset(token)
+
+
+def deadline_in(timeout: float | None) -> float | None:
+    """Get the deadline for something that must end in `timeout`."""
+    if timeout is None:
+        return None
+    return monotonic() + timeout
+
+
+def remaining_time() -> float | None:
+    """Get the seconds left until the current deadline, if any."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - monotonic()
+
+
+@contextmanager
+def bind_deadline(deadline: float | None) -> Iterator[None]:
+    """Bind a deadline to the code running inside the block.
+
+    Deadlines nest: the code inside the block must finish by the
+    earliest of the given deadline and any deadline already bound.
+    """
+    current = _deadline.get()
+    if deadline is None or (current is not None and current < deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
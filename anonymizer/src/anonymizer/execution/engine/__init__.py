@@ -3,79 +3,244 @@
 #
 # See LICENSE file in the project root for details.
 
-from json import load
+import asyncio
+from collections.abc import Coroutine
+from json import load, loads
 from pathlib import Path
 from types import SimpleNamespace
+from typing import Any
 
-from sanic import Request as WebRequest
+from sanic import Request as WebRequest, Sanic
 from sanic.response import HTTPResponse, empty
 
 from anonymizer.config import log
+from anonymizer.execution import bind_deadline, deadline_in
 from anonymizer.execution.jobs import RequestPong
-from anonymizer.execution.pipeline import Pipeline, parse
-from anonymizer.execution.stages import Stage
+from anonymizer.execution.pipeline import (
+    JobPlan,
+    Pipeline,
+    PipelinePlan,
+    PipelineResult,
+    PipelineRun,
+    StagePlan,
+    compile_plan,
+)
 from anonymizer.models.data_model import Request
 from anonymizer.transformers import RequestBody
 
 
+# HTTP header containing the amount of seconds the client is willing
+# to wait for a response
+HEADER_TIMEOUT = 'Request-Timeout'
+
+# Pipeline runs still executing after their response was sent
+_background_runs: set[asyncio.Task] = set()
+
+
+async def wait_for_background_runs():
+    """Wait for every pipeline run executing in the background."""
+    if _background_runs:
+        log.info('Waiting for %s background pipeline runs',
+                 len(_background_runs))
+        await asyncio.gather(*_background_runs, return_exceptions=True)
+
+
+def summarize_response(response: HTTPResponse) -> dict:
+    """Summarize a pipeline response as a JSON object.
+
+    Used wherever a response can't be sent as-is, such as for each
+    item of a batch.
+    """
+    result = None
+    if response.body and response.content_type == 'application/json':
+        result = loads(response.body)
+    return {'status': response.status, 'result': result}
+
+
+def default_plan() -> PipelinePlan:
+    default_job = JobPlan('default-pong', RequestPong)
+    default_stage = StagePlan('default-stage', jobs=(default_job,))
+    return PipelinePlan(stages=(default_stage,))
+
+
 def default_pipeline() -> Pipeline:
-    env = SimpleNamespace()
-    default_job = RequestPong('default-pong', env)
-    default_job.init_policies({})
-    default_stage = Stage('default-stage', env, default_job)
-    default_stage.init_policies({})
-    default_pipeline_object = Pipeline(env, default_stage)
-    default_pipeline_object.init_policies({})
-    return default_pipeline_object
+    return default_plan().build()
+
+
+def read_plan(pipeline_file: Path) -> PipelinePlan:
+    """Read and compile a pipeline file.
+
+    Unlike `load_plan()`, this function doesn't fall back to the
+    default pipeline, and raises on any error instead.
+    """
+    mtime = pipeline_file.stat().st_mtime_ns
+    with pipeline_file.open() as f:
+        return compile_plan(load(f), pipeline_file, mtime)
+
+
+def load_plan(pipeline_file: Path | None) -> PipelinePlan:
+    """Compile a pipeline file, or the default pipeline if missing."""
+    if pipeline_file is not None:
+        log.info('Loading pipeline from file "%s"',
+                 pipeline_file.as_posix())
+        try:
+            return read_plan(pipeline_file)
+        except FileNotFoundError:
+            log.error('Unable to load pipeline from file "%s": '
+                      'File not found',
+                      pipeline_file)
+    else:
+        log.info('Unable to load pipeline: No pipeline file supplied')
+    log.info('Loading default pipeline')
+    return default_plan()
 
 
 class ExecutionEngine:
-    def __init__(self, pipeline_file: Path | None):
-        if pipeline_file is not None:
-            log.info('Loading pipeline from file "%s"',
-                     pipeline_file.as_posix())
-            try:
-                with pipeline_file.open() as f:
-                    self.pipeline = parse(load(f))
-                    return
-            except FileNotFoundError:
-                log.error('Unable to load pipeline from file "%s": '
-                          'File not found',
-                          pipeline_file)
-        else:
-            log.info('Unable to load pipeline: No pipeline file supplied')
-        log.info('Loading default pipeline')
-        self.pipeline = default_pipeline()
-        return
-
-    def get_response_code(self) -> int:
-        if isinstance(self.pipeline.env.response_code, int):
-            return self.pipeline.env.response_code
+    """Execute a compiled pipeline.
+
+    The engine builds its pipeline once.  Every call to `run()` works
+    on its own `PipelineRun`, so a single engine can safely serve
+    concurrent requests.
+    """
+
+    def __init__(self, plan: PipelinePlan):
+        self.plan = plan
+        self.pipeline = plan.build()
+
+    def get_response_code(self, env: SimpleNamespace) -> int:
+        response_code = getattr(env, 'response_code', None)
+        if isinstance(response_code, int):
+            return response_code
         return 200
 
-    def get_response(self) -> HTTPResponse:
-        if isinstance(self.pipeline.env.response, HTTPResponse):
-            return self.pipeline.env.response
-        return empty(self.get_response_code())
+    def get_response(self, env: SimpleNamespace) -> HTTPResponse:
+        response = getattr(env, 'response', None)
+        if isinstance(response, HTTPResponse):
+            return response
+        return empty(self.get_response_code(env))
+
+    def get_request_deadline(self, request: WebRequest) -> float | None:
+        timeout = request.headers.get(HEADER_TIMEOUT)
+        if timeout is None:
+            return None
+        try:
+            return deadline_in(float(timeout))
+        except ValueError:
+            log.warning('Ignoring invalid "%s" header: %s',
+                        HEADER_TIMEOUT,
+                        timeout)
+            return None
 
     async def run(self,
                   request: WebRequest,
                   data: Request,
                   body: RequestBody,
                   audit_timestamp: float,
+                  document: dict | list | None = None,
+                  shared: dict | None = None,
                   **kwargs,
                   ) -> HTTPResponse:
-        env = SimpleNamespace(request=request,
+        """Execute the pipeline on a request body.
+
+        :param document: The JSON document `body` was parsed from.
+        Defaults to the HTTP request's JSON body.
+
+        :param shared: State shared with other runs, such as the
+        runs of every item in a batch.
+        """
+        env = SimpleNamespace(app=request.app,
+                              request=request,
                               data=data,
                               body=body,
+                              document=(document
+                                        if document is not None
+                                        else request.json),
+                              shared=shared,
                               audit_timestamp=audit_timestamp)
-        self.pipeline.reset(env)
-        env.pipeline_results = self.pipeline.result
+        run = self.pipeline.new_run(env)
+        env.pipeline_results = run.result
         log.info('Execution begin')
-        pipeline_result = await self.pipeline.run_wrapped(**kwargs)
-        log.info('Execution finished')
-        response = env.response if hasattr(env, 'response') else empty(200)
+        # The request deadline only applies until the response is
+        # sent, background stages are bound by the pipeline timeout
+        with bind_deadline(self.get_request_deadline(request)):
+            execution = asyncio.create_task(self.pipeline.run_wrapped(
+                run,
+                self.pipeline.respond_after,
+                **kwargs,
+            ))
+        try:
+            # Sanic cancels the handler when the client disconnects.
+            # Shielding the execution lets the pipeline cancel only
+            # the stages that don't need to complete.
+            pipeline_result = await asyncio.shield(execution)
+        except asyncio.CancelledError:
+            log.warning('Client disconnected, cancelling execution')
+            self.pipeline.cancel(run)
+            self._in_background(self._finish(run, execution, **kwargs))
+            raise
+        return self._respond(run, pipeline_result, **kwargs)
+
+    async def run_queued(self,
+                         app: Sanic,
+                         data: Request,
+                         body: RequestBody,
+                         audit_timestamp: float,
+                         document: dict | list | None,
+                         **kwargs,
+                         ) -> HTTPResponse:
+        """Execute the pipeline on a request body taken from a queue.
+
+        Unlike `run()`, there's no HTTP request behind the run, so
+        jobs can only reach the application through `Job.app()`.
+        """
+        env = SimpleNamespace(app=app,
+                              request=None,
+                              data=data,
+                              body=body,
+                              document=document,
+                              shared=None,
+                              audit_timestamp=audit_timestamp)
+        run = self.pipeline.new_run(env)
+        env.pipeline_results = run.result
+        log.info('Queued execution begin')
+        pipeline_result = await self.pipeline.run_wrapped(
+            run,
+            self.pipeline.respond_after,
+            **kwargs,
+        )
+        return self._respond(run, pipeline_result, **kwargs)
+
+    def _respond(self,
+                 run: PipelineRun,
+                 pipeline_result: PipelineResult,
+                 **kwargs,
+                 ) -> HTTPResponse:
+        response = self.get_response(run.env)
         if not pipeline_result.success:
             log.error('Pipeline was not successful')
             response.status = 400
+        if self.pipeline.finished(run):
+            log.info('Execution finished')
+        else:
+            log.info('Sending response, resuming execution in background')
+            self._in_background(self._finish(run, **kwargs))
         return response
+
+    def _in_background(self, coro: Coroutine[Any, Any, None]):
+        task = asyncio.create_task(coro)
+        _background_runs.add(task)
+        task.add_done_callback(_background_runs.discard)
+
+    async def _finish(self,
+                      run: PipelineRun,
+                      execution: asyncio.Task | None = None,
+                      **kwargs,
+                      ):
+        if execution is not None:
+            await execution
+        if self.pipeline.finished(run):
+            return
+        pipeline_result = await self.pipeline.run_wrapped(run, **kwargs)
+        log.info('Background execution finished')
+        if not pipeline_result.success:
+            log.error('Pipeline was not successful')
@@ -17,3 +17,7 @@ class StageError(ExecutionError):
 
 class JobError(ExecutionError):
     """Raised when a job fails."""
+
+
+class FatalFailureError(ExecutionError):
+    """Raised to stop execution after a fatal job failure."""
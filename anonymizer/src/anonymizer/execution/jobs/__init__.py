@@ -6,6 +6,7 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+import asyncio
 from dataclasses import asdict, dataclass
 from json import loads
 from traceback import format_exc
@@ -16,14 +17,22 @@ from uuid import uuid4
 from sanic.response import json
 
 from anonymizer.config import log
-from anonymizer.execution import ReadsFromPolicies, Result
+from anonymizer.execution import (
+    Dataflow,
+    ReadsFromPolicies,
+    Result,
+    bind_deadline,
+    current_env,
+    deadline_in,
+    remaining_time,
+)
 from anonymizer.execution.exceptions import JobError
 from anonymizer.models import data_model
 from anonymizer.models.base import Model
-from anonymizer.util import import_from_str
+from anonymizer.util import Registry
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable
+    from collections.abc import Awaitable, Callable, Iterable
     import sanic
 
     from anonymizer.transformers import RequestBody
@@ -39,6 +48,17 @@ class GeneratorJobResult(JobResult):
     result: list[Job]
 
 
+# Job policies used to declare the job's dataflow in the pipeline file
+POLICY_READS = 'reads'
+POLICY_WRITES = 'writes'
+POLICY_UPDATES = 'updates'
+
+# Well-known env locations set by the execution engine
+ENV_DOCUMENT = 'document'
+ENV_DATA = 'data'
+ENV_RESPONSE = 'response'
+
+
 class Job(ReadsFromPolicies, ABC):
     def __init__(self,
                  name: str,
@@ -57,11 +77,28 @@ class Job(ReadsFromPolicies, ABC):
         self.parent = None
         self.policies = {}
         self.generated_jobs_inherit_policies = True
+        self.dataflow: Dataflow | None = None
+        self.timeout: float | None = None
         if generator is not None:
             self.ephemeral = True
             self.parent = generator
             self.env = generator.env
 
+    @property
+    def env(self) -> SimpleNamespace:
+        """The environment the job reads from and writes to.
+
+        While a pipeline is running, this is the environment of the
+        run executing in the current task.  Outside of a run, it
+        falls back to the environment the job was created with.
+        """
+        env = current_env()
+        return env if env is not None else self._env
+
+    @env.setter
+    def env(self, env: SimpleNamespace):
+        self._env = env
+
     @override
     def init_policies(self, policies: dict):
         self.policies = policies
@@ -69,13 +106,55 @@ class Job(ReadsFromPolicies, ABC):
             'generated_jobs_inherit_policies',
             True,
         )
+        if any(p in policies
+               for p in (POLICY_READS, POLICY_WRITES, POLICY_UPDATES)):
+            self.dataflow = Dataflow(
+                reads=frozenset(policies.get(POLICY_READS, [])),
+                writes=frozenset(policies.get(POLICY_WRITES, [])),
+                updates=frozenset(policies.get(POLICY_UPDATES, [])),
+            )
+        else:
+            self.dataflow = self.declare_dataflow()
+        # Maximum amount of seconds a single execution of the job can
+        # take
+        self.timeout: float | None = policies.get('timeout')
+
+    def declare_dataflow(self) -> Dataflow | None:
+        """Declare the env locations this job depends on.
+
+        Used by the dataflow scheduler unless the pipeline file
+        declares them through the job's policies.  Jobs returning
+        `None` are treated as reading and writing everything.
+        """
+        return None
+
+    def locations(self, *params: str) -> frozenset[str]:
+        """Get the env locations contained in the given arguments."""
+        return frozenset(self.args[p]
+                         for p in params
+                         if isinstance(self.args.get(p), str))
 
-    def request(self) -> sanic.Request:
+    def app(self) -> sanic.Sanic:
+        return self.env.app
+
+    def request(self) -> sanic.Request | None:
+        """Get the HTTP request that started the run.
+
+        Runs taken from the job queue have no HTTP request.
+        """
         return self.env.request
 
     def data(self) -> data_model.Request:
         return self.env.data
 
+    def document(self) -> dict | list | None:
+        """Get the JSON document the run's body was parsed from.
+
+        This is the HTTP request's JSON body, except for runs on a
+        single item of a batch.
+        """
+        return self.env.document
+
     def body(self) -> RequestBody:
         return self.env.body
 
@@ -127,7 +206,7 @@ class Job(ReadsFromPolicies, ABC):
         rargs.update(self.args)
         rargs.update(kwargs)
         try:
-            result = await self.run(**rargs)
+            result = await self.run_bounded(lambda: self.run(**rargs))
             if result is None:
                 result = ''
             return JobResult(success=True, result=str(result))
@@ -139,6 +218,25 @@ class Job(ReadsFromPolicies, ABC):
             log.debug(format_exc())
             return JobResult(success=False, result='')
 
+    async def run_bounded[T](self, function: Callable[[], Awaitable[T]]) -> T:
+        """Execute a function within the job's time limits.
+
+        The function must finish before both the job's timeout and
+        the deadline of the current run expire.  Otherwise, it's
+        cancelled and `JobError` is raised.
+        """
+        with bind_deadline(deadline_in(self.timeout)):
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                msg = 'Deadline exceeded before execution'
+                raise JobError(msg)
+            try:
+                async with asyncio.timeout(remaining):
+                    return await function()
+            except TimeoutError as e:
+                msg = 'Execution timed out'
+                raise JobError(msg) from e
+
     def reset(self, env: SimpleNamespace | None = None):
         if env is None:
             env = SimpleNamespace()
@@ -155,7 +253,7 @@ class GeneratorJob(Job):
         rargs.update(self.args)
         rargs.update(kwargs)
         try:
-            result = await self.generate(**rargs)
+            result = await self.run_bounded(lambda: self.generate(**rargs))
             if self.generated_jobs_inherit_policies:
                 for job in result:
                     job.init_policies(self.policies)
@@ -180,12 +278,20 @@ class GeneratorJob(Job):
 class AnonymizingJob(Job):
     TYPE_ANONYMIZABLE = 'anonymizable'
 
-    def anonymizable_components(self) -> list[data_model.Component]:
+    def anonymizable_components[C: data_model.Component](
+        self,
+        *,
+        names: Iterable[str] | None = None,
+        kind: type[C] | None = None,
+    ) -> list[C]:
         """Filter the Anonymizer Request.
 
-        Returns only those components that can be anonymized.
+        Returns only those components that can be anonymized.  See
+        `Request.components()` for the meaning of the parameters.
         """
-        return self.data().types_get(self.TYPE_ANONYMIZABLE)
+        return self.data().components(self.TYPE_ANONYMIZABLE,
+                                      names=names,
+                                      kind=kind)
 
 
 class JsonReply(Job):
@@ -204,12 +310,22 @@ class JsonReply(Job):
 
 
 class RequestPong(JsonReply):
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=frozenset({ENV_DOCUMENT}),
+                        writes=frozenset({ENV_RESPONSE}))
+
     @override
     def json_body(self, **_) -> JsonReply._ParsableAsJson:
-        return self.request().json
+        return self.document()
 
 
 class DataPong(JsonReply):
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=frozenset({ENV_DATA}),
+                        writes=frozenset({ENV_RESPONSE}))
+
     @override
     def json_body(self, **_) -> JsonReply._ParsableAsJson:
         return data_model.Request.to_dict(self.data())
@@ -235,6 +351,11 @@ class ModelPong(JsonReply):
 
     PARAM_OBJL = 'object_location'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=self.locations(self.PARAM_OBJL),
+                        writes=frozenset({ENV_RESPONSE}))
+
     @override
     def json_body(self, **kwargs) -> JsonReply._ParsableAsJson:
         self.verify_parameters(kwargs,
@@ -248,6 +369,7 @@ class ModelPong(JsonReply):
 class Empty(Job):
     def __init__(self):
         super().__init__(f'empty-job-{uuid4}', SimpleNamespace())
+        self.dataflow = Dataflow()
 
     @override
     async def run(self, **_):
@@ -267,17 +389,28 @@ class DummyJob(Job):
     - fail: bool
         Whether the job should fail or not.  Defaults to False.
 
+    - delay: float
+        Seconds to wait before finishing.  Defaults to 0.
+
     """
 
     PARAM_MESG = 'message'
     PARAM_FAIL = 'fail'
+    PARAM_DELY = 'delay'
+
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow()
 
     @override
     async def run(self, **kwargs):
         self.verify_parameters(kwargs, self.PARAM_MESG)
         message = kwargs.get(self.PARAM_MESG)
         fail = bool(kwargs.get(self.PARAM_FAIL))
+        delay = float(kwargs.get(self.PARAM_DELY, 0))
         log.info('Job "%s": %s', self.name, message)
+        if delay > 0:
+            await asyncio.sleep(delay)
         if fail:
             msg = f'Dummy job {self.name} failed'
             raise JobError(msg)
@@ -314,7 +447,7 @@ class DummyGeneratorJob(GeneratorJob, DummyJob):
     async def generate(self, **kwargs) -> list[Job]:
         self.verify_parameters(kwargs, self.PARAM_JOBS)
         jobs = kwargs.get(self.PARAM_JOBS)
-        message = kwargs.get(self.PARAM_MESG, None)
+        message = kwargs.get(self.PARAM_MESG)
         fail = bool(kwargs.get(self.PARAM_FAIL))
         if message is not None:
             log.info('Job "%s": %s', self.name, message)
@@ -335,6 +468,18 @@ class DummyGeneratorJob(GeneratorJob, DummyJob):
         return ret
 
 
+registry = Registry(Job, 'anonymizer.execution.jobs')
+
+
+def job_class_from_string(job_type: str) -> type[Job]:
+    """Resolve a job type string into its `Job` subclass.
+
+    Raises `anonymizer.util.UnknownTypeError` if there's no such job
+    class.
+    """
+    return registry.get(job_type)
+
+
 def job_from_string(job_type: str,
                     name: str,
                     args: dict | None = None,
@@ -342,7 +487,4 @@ def job_from_string(job_type: str,
                     ) -> Job:
     if env is None:
         env = SimpleNamespace()
-    job_class = import_from_str(Job, job_type, 'anonymizer.execution.jobs')
-    if job_class is None:
-        return Empty()
-    return job_class(name, env, args)
+    return job_class_from_string(job_type)(name, env, args)
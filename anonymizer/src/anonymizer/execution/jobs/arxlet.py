@@ -5,20 +5,24 @@
 
 from abc import ABC, abstractmethod
 from collections.abc import Sequence
-from json import loads
+from json import dumps, loads
 from types import SimpleNamespace
 from typing import TYPE_CHECKING, override
 
-from anonymizer.clients import ClientError
-from anonymizer.clients.arxlet import ARXletClient
-from anonymizer.config import config, log
+from anonymizer.clients import ClientError, SharedSession
+from anonymizer.clients.arxlet import ARXletClient, ARXletCoalescer
+from anonymizer.config import log
+from anonymizer.execution import Dataflow
 from anonymizer.execution.jobs import (
+    ENV_DATA,
     AnonymizingJob,
     GeneratorJob,
     JobError,
+    job_class_from_string,
 )
 from anonymizer.models import arxlet as arxlet_model
 from anonymizer.models import data_model, policies
+from anonymizer.util import UnknownTypeError
 
 if TYPE_CHECKING:
     from anonymizer.clients.context import ContextClient
@@ -32,7 +36,8 @@ class ARXletJob(AnonymizingJob):
     - arxlet_url (Optional)
     - `str`
 
-    An alternative URL to send the ARXlet requests to.
+    An alternative URL to send the ARXlet requests to.  Otherwise,
+    requests are spread across the replicas in the configuration.
     """
 
     TYPE_ANONYMIZABLE = TYPE_ANONYMIZABLE_BY_ARXLET
@@ -46,6 +51,10 @@ class ARXletJob(AnonymizingJob):
                  generator: GeneratorJob | None = None):
         super().__init__(name, env, args, generator)
 
+    def shared_session(self) -> SharedSession | None:
+        """Get the pooled ARXlet session, if there is one."""
+        return getattr(self.app().ctx, 'arxlet_session', None)
+
     def prepare_attributes(self,
                            attributes: list[data_model.Attribute],
                            h: policies.HierarchyAttribute,
@@ -83,10 +92,9 @@ class ARXletJob(AnonymizingJob):
 
                 # Extract the Anonymizer Attribute from the Anonymizer
                 # Object
-                tmp = [a for a in obj.value
-                       if isinstance(a, data_model.Attribute)
-                       and a.type_is(self.TYPE_ANONYMIZABLE)
-                       and a.name == attribute_name]
+                tmp = obj.components(self.TYPE_ANONYMIZABLE,
+                                     names=[attribute_name],
+                                     kind=data_model.Attribute)
                 # Transform it into an ARXlet AttributeData (for the
                 # hierarchy it will contain)
                 tmp2 = self.prepare_attributes(tmp, att_h)
@@ -158,11 +166,25 @@ class FromPrivacyPolicy(GeneratorJob):
     - `str`
 
     An alternative URL to send the ARXlet requests to.
+
+    - coalesce (Optional)
+    - `bool`
+
+    Whether the ARXlet requests may be grouped with those of other
+    pipeline runs using a privacy policy of the same organization.
+    Defaults to `False`.  K-map is never grouped.
     """
 
     PARAM_LOCP = 'privacy_policy_location'
     PARAM_LOCH = 'hierarchy_policy_location'
     PARAM_URLA = 'arxlet_url'
+    PARAM_COAL = 'coalesce'
+
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=self.locations(self.PARAM_LOCP,
+                                             self.PARAM_LOCH),
+                        updates=frozenset({ENV_DATA}))
 
     def __init__(self, name:
                  str, env: SimpleNamespace | None = None,
@@ -174,8 +196,7 @@ class FromPrivacyPolicy(GeneratorJob):
     async def generate(self, **kwargs) -> list[AnonymizingJob]:
         self.verify_parameters(kwargs, self.PARAM_LOCP, self.PARAM_LOCH)
         # Prepare variables from kwargs and env
-        url = kwargs.get(self.PARAM_URLA,
-                         config.services.arxlet.url.unicode_string())
+        url = kwargs.get(self.PARAM_URLA)
         privacy_policy = self.get_from_env(kwargs[self.PARAM_LOCP],
                                            policies.PrivacyPolicy)
         hierarchy_policy = self.get_from_env(kwargs[self.PARAM_LOCH],
@@ -269,6 +290,8 @@ class FromPrivacyPolicy(GeneratorJob):
             FromPets.PARAM_OBJH: hierarchy_policy.hierarchy_objects,
             FromPets.PARAM_URLA: url,
         }
+        if kwargs.get(self.PARAM_COAL):
+            args[FromPets.PARAM_GRUP] = privacy_policy.organization
         job = FromPets(name='apply_pets', args=args, generator=self)
         ret.append(job)
 
@@ -331,6 +354,15 @@ class FromPets(ARXletJob):
     - `str`
 
     An alternative URL to send the ARXlet requests to.
+
+    - coalesce_group (Optional)
+    - `str`
+
+    If ARXlet request coalescing is configured, requests of jobs with
+    the same group, PETs, hierarchy and type may be sent as a single
+    request.  Grouped requests are anonymized as a single data set, so
+    only jobs whose data can be released together should share a
+    group.
     """  # noqa: W505
 
     PARAM_PETS = 'pets'
@@ -338,24 +370,63 @@ class FromPets(ARXletJob):
     PARAM_OBJS = 'objects'
     PARAM_OBJH = 'object_hierarchies'
     PARAM_ATTH = 'attribute_hierarchies'
+    PARAM_GRUP = 'coalesce_group'
+
+    async def anonymize(self,
+                        url: str | None,
+                        endpoint: str,
+                        data: list,
+                        pets: list[arxlet_model.Pet],
+                        key: tuple | None,
+                        ) -> list:
+        """Send an ARXlet request.
+
+        If a compatibility key is supplied and coalescing is
+        configured, the request is grouped with compatible ones.
+        """
+        coalescer: ARXletCoalescer | None = None
+        if key is not None:
+            coalescer = getattr(self.app().ctx, 'arxlet_coalescer', None)
+        try:
+            if coalescer is not None:
+                resp = await coalescer.anonymize(url,
+                                                 endpoint,
+                                                 data,
+                                                 pets,
+                                                 key)
+            else:
+                async with ARXletClient(url, self.shared_session()) as client:
+                    resp = await client.anonymize(endpoint, data, pets)
+        except ClientError as e:
+            msg = 'Client exception raised'
+            raise JobError(msg) from e
+        if resp is None:
+            msg = 'ARXlet request failed'
+            raise JobError(msg)
+        return resp
+
+    def get_pets(self, **kwargs) -> list:
+        """Get the PETs to apply.
+
+        Jobs applying a single PET build it from their own parameters
+        instead.
+        """
+        self.verify_parameters(kwargs, self.PARAM_PETS)
+        return kwargs[self.PARAM_PETS]
 
     @override
     async def run(self, **kwargs):
         self.verify_parameters(kwargs,
-                               self.PARAM_PETS,
-                               self.PARAM_ATTS,
                                self.PARAM_OBJS,
-                               self.PARAM_ATTH,
                                self.PARAM_OBJH)
         # Prepare variables from kwargs and env
-        data = self.anonymizable_components()
-        pets = kwargs[self.PARAM_PETS]
-        attributes: list[str] = kwargs[self.PARAM_ATTS]
+        pets = self.get_pets(**kwargs)
+        attributes: list[str] = kwargs.get(self.PARAM_ATTS, [])
         objects: list[dict] = kwargs[self.PARAM_OBJS]
-        att_hierarchies: list[dict] = kwargs[self.PARAM_ATTH]
+        att_hierarchies: list[dict] = kwargs.get(self.PARAM_ATTH, [])
         obj_hierarchies: list[dict] = kwargs[self.PARAM_OBJH]
-        url = kwargs.get(self.PARAM_URLA,
-                         config.services.arxlet.url.unicode_string())
+        url = kwargs.get(self.PARAM_URLA)
+        group: str | None = kwargs.get(self.PARAM_GRUP)
 
         # Extract PETs
         pets_to_apply = []
@@ -370,8 +441,8 @@ class FromPets(ARXletJob):
                     pet_parsed = arxlet_model.pet_from_scheme(
                         pet['scheme'],
                         pet['metadata'],
-                        pet['metadata'].get('sensitive', None),
-                        pet['metadata'].get('context', None),
+                        pet['metadata'].get('sensitive'),
+                        pet['metadata'].get('context'),
                     )
                 except TypeError:
                     log.info('Job "%s": Unknown ARXlet PET scheme "%s", '
@@ -385,8 +456,8 @@ class FromPets(ARXletJob):
                     pet_parsed = arxlet_model.pet_from_scheme(
                         pet_dict['scheme'],
                         pet_dict['metadata'],
-                        pet_dict['metadata'].get('sensitive', None),
-                        pet_dict['metadata'].get('context', None),
+                        pet_dict['metadata'].get('sensitive'),
+                        pet_dict['metadata'].get('context'),
                     )
                 except TypeError:
                     log.info('Job "%s": Unknown ARXlet PET scheme "%s", '
@@ -415,25 +486,24 @@ class FromPets(ARXletJob):
             if ah is None:
                 msg = f'No hierarchy for attribute "{_att}"'
                 raise JobError(msg)
-            eatts = [a for a in data
-                     if isinstance(a, data_model.Attribute)
-                     and a.name == _att]
+            eatts = self.anonymizable_components(
+                names=[_att],
+                kind=data_model.Attribute,
+            )
             atts = self.prepare_attributes(eatts, ah)
             log.debug('Job "%s": Prepared %s attributes of type %s',
                       self.name, len(atts), _att)
             if len(atts) == 0:
                 continue
-            try:
-                async with ARXletClient(url) as client:
-                    resp = await client.anonymize_attributes(atts,
-                                                             pets_to_apply)
-                    if resp is None:
-                        msg = 'ARXlet request failed'
-                        raise JobError(msg)
-                    self.update_components(eatts, resp, self.TYPE_ANONYMIZABLE)
-            except ClientError as e:
-                msg = 'Client exception raised'
-                raise JobError(msg) from e
+            key = (None
+                   if group is None
+                   else (group, _att, ah.model_dump_json()))
+            resp = await self.anonymize(url,
+                                        ARXletClient.ENDPOINT_ATTRIBUTES,
+                                        atts,
+                                        pets_to_apply,
+                                        key)
+            self.update_components(eatts, resp, self.TYPE_ANONYMIZABLE)
 
         # Apply PETs to objects
         for _obj in objects:
@@ -447,9 +517,10 @@ class FromPets(ARXletJob):
             if oh is None:
                 msg = f'No hierarchy for object "{o_name}"'
                 raise JobError(msg)
-            eatts = [o for o in data
-                     if isinstance(o, data_model.Object)
-                     and o.name == o_name]
+            eatts = self.anonymizable_components(
+                names=[o_name],
+                kind=data_model.Object,
+            )
 
             # Prune all non-sensitive attributes from the Object.  To
             # do this we create a new list with new Objects, but the
@@ -466,16 +537,14 @@ class FromPets(ARXletJob):
                       self.name, len(objs), o_name)
             if len(objs) == 0:
                 continue
-            try:
-                async with ARXletClient(url) as client:
-                    obj_resp = await client.anonymize_objects(objs,
-                                                              pets_to_apply)
-                    if obj_resp is None:
-                        msg = 'ARXlet request failed'
-                        raise JobError(msg)
-            except ClientError as e:
-                msg = 'Client exception raised'
-                raise JobError(msg) from e
+            key = (None
+                   if group is None
+                   else (group, o_name, oh.model_dump_json()))
+            obj_resp = await self.anonymize(url,
+                                            ARXletClient.ENDPOINT_OBJECTS,
+                                            objs,
+                                            pets_to_apply,
+                                            key)
 
             # obj_resp and _l_pruned should be the same length
 
@@ -542,7 +611,7 @@ class KAnonymity(FromPets):
     PARAM_ATTH = 'attribute_hierarchies'
 
     @override
-    async def run(self, **kwargs) -> None:
+    def get_pets(self, **kwargs) -> list:
         self.verify_parameters(kwargs,
                                self.PARAM_KVAL)
         k = kwargs[self.PARAM_KVAL]
@@ -550,11 +619,7 @@ class KAnonymity(FromPets):
         # The only PET to apply
         pet_k_anon = arxlet_model.Pet(scheme=arxlet_model.SCHEME_KANON,
                                       metadata=arxlet_model.KAnonMetadata(k=k))
-
-        # Rely on superclass
-        new_kwargs = {self.PARAM_PETS: pet_k_anon.model_dump()}
-        new_kwargs.update(kwargs)
-        return await super().run(**new_kwargs)
+        return [pet_k_anon]
 
 
 class _SensitivePETJob(FromPets, ABC):
@@ -592,13 +657,9 @@ class _SensitivePETJob(FromPets, ABC):
     PARAM_OBJH = 'object_hierarchies'
 
     @override
-    async def run(self, **kwargs) -> None:
+    def get_pets(self, **kwargs) -> list:
         self.verify_parameters(kwargs, self.PARAM_SENS)
-        pet = self.get_pet(**kwargs)
-        # Rely on FromPets
-        new_kwargs = {self.PARAM_PETS: pet}
-        new_kwargs.update(kwargs)
-        return await super().run(**new_kwargs)
+        return [self.get_pet(**kwargs)]
 
     @abstractmethod
     def get_pet(self, **kwargs) -> arxlet_model.Pet:
@@ -888,21 +949,18 @@ class KMap(FromPets):
         k = kwargs[self.PARAM_KVAL]
         objectt = kwargs[self.PARAM_OBTS]
         hierarchy = kwargs[self.PARAM_OBHS]
-        url = kwargs.get(self.PARAM_URLA,
-                         config.services.arxlet.url.unicode_string())
+        url = kwargs.get(self.PARAM_URLA)
 
         o_name = objectt['type']
         o_vals = objectt['values']
 
         # Extract context
-        context_client: ContextClient = self.request().app.ctx.context_client
+        context_client: ContextClient = self.app().ctx.context_client
         results = await context_client.lookup([o_name])
         context = []
         count = 0
         for req in results:
-            objs = [o for o in req.data
-                    if isinstance(o, data_model.Object)
-                    and o.name == o_name]
+            objs = req.components(names=[o_name], kind=data_model.Object)
             listt = self.prepare_objects(objs, hierarchy, *o_vals)
             context.append(listt)
             count = count + len(listt)
@@ -930,3 +988,99 @@ class KMap(FromPets):
             FromPets.PARAM_URLA: url,
         }
         return await super().run(**new_kwargs)
+
+
+def _merge_key(value: object) -> str:
+    return dumps(value,
+                 sort_keys=True,
+                 default=lambda m: m.model_dump(mode='json', by_alias=True))
+
+
+class MergePets(GeneratorJob):
+    """Apply several PET jobs with as few ARXlet requests as possible.
+
+    PET jobs (such as `KAnonymity` or `DistinctLDiversity`) targeting
+    the same attributes and objects with the same hierarchies are
+    merged into a single `FromPets` job, so the data is only prepared
+    and sent to ARXlet once.  If several merged jobs apply
+    k-anonymity, only the highest k is kept.
+
+    - jobs
+    - `list[dict]`
+
+    The PET jobs to apply.  Each entry shall contain the "type" of the
+    job (f.e. "arxlet.KAnonymity") and its "args".  `KMap` jobs can't
+    be merged.
+
+    - arxlet_url (Optional)
+    - `str`
+
+    An alternative URL to send the ARXlet requests to.  Jobs can still
+    override it with their own "arxlet_url" argument.
+    """
+
+    PARAM_JOBS = 'jobs'
+    PARAM_URLA = 'arxlet_url'
+
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(updates=frozenset({ENV_DATA}))
+
+    @override
+    async def generate(self, **kwargs) -> list[AnonymizingJob]:
+        self.verify_parameters(kwargs, self.PARAM_JOBS)
+        url = kwargs.get(self.PARAM_URLA)
+        groups: dict[str, dict] = {}
+        for i, entry in enumerate(kwargs[self.PARAM_JOBS]):
+            try:
+                job_class = job_class_from_string(entry['type'])
+            except (KeyError, TypeError, UnknownTypeError) as e:
+                msg = f'Unable to resolve the type of PET job {i}'
+                raise JobError(msg) from e
+            if not issubclass(job_class, FromPets) or job_class is KMap:
+                msg = f'Job type "{entry["type"]}" can\'t be merged'
+                raise JobError(msg)
+            args = {FromPets.PARAM_URLA: url} | entry.get('args', {})
+            job = job_class(name=str(i), args=args, generator=self)
+            target = {
+                FromPets.PARAM_ATTS: args.get(FromPets.PARAM_ATTS, []),
+                FromPets.PARAM_OBJS: args.get(FromPets.PARAM_OBJS, []),
+                FromPets.PARAM_ATTH: args.get(FromPets.PARAM_ATTH, []),
+                FromPets.PARAM_OBJH: args.get(FromPets.PARAM_OBJH, []),
+                FromPets.PARAM_URLA: args[FromPets.PARAM_URLA],
+            }
+            group = groups.setdefault(_merge_key(target),
+                                      target | {FromPets.PARAM_PETS: []})
+            group[FromPets.PARAM_PETS].extend(job.get_pets(**args))
+
+        ret = []
+        for group in groups.values():
+            group[FromPets.PARAM_PETS] = self._deduplicate(
+                group[FromPets.PARAM_PETS],
+            )
+            ret.append(FromPets(name=f'apply_pets_{len(ret)}',
+                                args=group,
+                                generator=self))
+        log.info('Job "%s": Merged %s PET jobs into %s',
+                 self.name,
+                 len(kwargs[self.PARAM_JOBS]),
+                 len(ret))
+        return ret
+
+    def _deduplicate(self, pets: list) -> list:
+        ret = []
+        k_anon: arxlet_model.Pet | None = None
+        seen = set()
+        for pet in pets:
+            if (isinstance(pet, arxlet_model.Pet)
+                    and pet.scheme == arxlet_model.SCHEME_KANON):
+                if k_anon is None or pet.metadata.k > k_anon.metadata.k:
+                    k_anon = pet
+                continue
+            key = _merge_key(pet)
+            if key not in seen:
+                seen.add(key)
+                ret.append(pet)
+        if k_anon is not None:
+            ret.insert(0, k_anon)
+        return ret
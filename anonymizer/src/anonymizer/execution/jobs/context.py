@@ -4,14 +4,19 @@
 # See LICENSE file in the project root for details.
 
 from typing import override
-from anonymizer.execution.jobs import Job
+from anonymizer.execution import Dataflow
+from anonymizer.execution.jobs import ENV_DATA, Job
 
 
 class StoreRequest(Job):
     """Store the current Request into the context database."""
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=frozenset({ENV_DATA}))
+
     @override
     async def run(self, **_):
-        context_client = self.request().app.ctx.context_client
+        context_client = self.app().ctx.context_client
         request = self.data()
         await context_client.record(request)
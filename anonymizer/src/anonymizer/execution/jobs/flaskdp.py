@@ -6,11 +6,16 @@
 from types import SimpleNamespace
 from typing import override
 
-from anonymizer.clients import ClientError
-from anonymizer.clients.flaskdp import FlaskDPClient
-from anonymizer.config import config, log
+from anonymizer.clients import ClientError, SharedSession
+from anonymizer.clients.flaskdp import FlaskDPClient, FlaskDPCoalescer
+from anonymizer.config import log
+from anonymizer.execution import Dataflow
 from anonymizer.execution.exceptions import JobError
-from anonymizer.execution.jobs import AnonymizingJob, GeneratorJob
+from anonymizer.execution.jobs import (
+    ENV_DATA,
+    AnonymizingJob,
+    GeneratorJob,
+)
 from anonymizer.models import data_model
 from anonymizer.models import flaskdp as flaskdp_model
 from anonymizer.models.policies import PrivacyPolicy
@@ -24,7 +29,8 @@ class FlaskDPJob(AnonymizingJob):
     - flaskdp_url (Optional)
     - `str`
 
-    An alternative URL to send the FlaskDP requests to.
+    An alternative URL to send the FlaskDP requests to.  Otherwise,
+    requests are spread across the replicas in the configuration.
     """
 
     TYPE_ANONYMIZABLE = TYPE_ANONYMIZABLE_BY_FLASKDP
@@ -46,6 +52,10 @@ class FlaskDPJob(AnonymizingJob):
                  ):
         super().__init__(name, env, args, generator)
 
+    def shared_session(self) -> SharedSession | None:
+        """Get the pooled FlaskDP session, if there is one."""
+        return getattr(self.app().ctx, 'flaskdp_session', None)
+
     def prepare_values(self,
                        _id: str,
                        values: list[data_model.Attribute],
@@ -82,12 +92,19 @@ class FlaskDPJob(AnonymizingJob):
                       values[i])
             att.value = str(values[i])
 
-    async def _inner(self,
-                     mechanism: flaskdp_model.Mechanism,
-                     **kwargs,
-                     ):
-        # Prepare variables
-        data = self.anonymizable_components()
+    def prepare_items(self,
+                      mechanism: flaskdp_model.Mechanism,
+                      prefix: str = '',
+                      **kwargs,
+                      ) -> list[tuple[flaskdp_model.ItemRequest,
+                                      list[data_model.Attribute]]]:
+        """Prepare the FlaskDP items for a single technique.
+
+        :param prefix: A prefix for the item identifiers, so items of
+        several techniques can be sent in the same request.
+
+        :return: Each item, along with the Attributes it will update.
+        """
         attributes: list[str] = kwargs[self.PARAM_ATTS]  # Should exist
         epsilon: float = kwargs[self.PARAM_EPSL]  # Should exist
         delta: float = kwargs.get(self.PARAM_DELT, 0)
@@ -95,84 +112,100 @@ class FlaskDPJob(AnonymizingJob):
         upper: float = kwargs.get(self.PARAM_UPPR, 1)
         lower: float = kwargs.get(self.PARAM_LOWR, 0)
         objects: list[str] = kwargs.get(self.PARAM_OBJS, [])
-        url = kwargs.get(self.PARAM_URLF,
-                         config.services.flaskdp.url.unicode_string())
 
-        # Prepare request
-        req = flaskdp_model.FlaskDPRequest(items=[])
-        request_attributes = {}
+        ret = []
 
         # If extracting Attributes from Objects:
         if len(objects) > 0:
             # Extract Objects Objects must be anonymizable and be from
             # a specific set of types.
             count = 0
-            objs = [o for o in data
-                    if isinstance(o, data_model.Object)
-                    and o.name in objects]
+            objs = self.anonymizable_components(names=objects,
+                                                kind=data_model.Object)
             for _obj in objs:
                 # Extract Attributes from _obj.  The Attribute must be
                 # anonymizable and (if specified), be of a specific
                 # type
-                tmp = [a for a in _obj.value
-                       if isinstance(a, data_model.Attribute)
-                       and a.type_is(self.TYPE_ANONYMIZABLE)
-                       and a.name in attributes]
+                tmp = _obj.components(self.TYPE_ANONYMIZABLE,
+                                      names=attributes,
+                                      kind=data_model.Attribute)
                 # Prepare FlaskDP request item
-                item_id = f'obj{_obj.name}-{count}'
+                item_id = f'{prefix}obj{_obj.name}-{count}'
                 item = self.prepare_values(item_id, tmp)
-
-                # Update FlaskDP request item values
-                item.epsilon = epsilon
-                item.delta = delta
-                item.sensitivity = sensitivity
-                item.upper = upper
-                item.lower = lower
-                item.mechanism = mechanism
-
-                # Append to request
-                req.items.append(item)
-                request_attributes[item_id] = tmp
+                ret.append((item, tmp))
                 count = count + 1
         # Otherwise, extracting Attributes from the Request
         else:
             for _att in attributes:
                 # Extract Attributes.  Attributes must be anonymizable
                 # and be of a specific type
-                tmp = [a for a in data
-                       if isinstance(a, data_model.Attribute)
-                       and a.name in attributes]
+                tmp = self.anonymizable_components(
+                    names=[_att],
+                    kind=data_model.Attribute,
+                )
                 # Prepare FlaskDP request item
-                item_id = _att
+                item_id = f'{prefix}{_att}'
                 item = self.prepare_values(item_id, tmp)
+                ret.append((item, tmp))
+
+        # Update FlaskDP request item values
+        for item, _ in ret:
+            item.epsilon = epsilon
+            item.delta = delta
+            item.sensitivity = sensitivity
+            item.upper = upper
+            item.lower = lower
+            item.mechanism = mechanism
+        return ret
 
-                # Update FlaskDP request item values
-                item.epsilon = epsilon
-                item.delta = delta
-                item.sensitivity = sensitivity
-                item.upper = upper
-                item.lower = lower
-                item.mechanism = mechanism
-
-                # Append to request
-                req.items.append(item)
-                request_attributes[item_id] = tmp
-
-        # Send request
+    async def apply_items(self,
+                          url: str | None,
+                          items: list[tuple[flaskdp_model.ItemRequest,
+                                            list[data_model.Attribute]]],
+                          ):
+        """Send FlaskDP items and update their Attributes.
+
+        If FlaskDP request coalescing is configured, the items are
+        sent along with those of concurrent jobs.
+        """
+        if len(items) == 0:
+            log.info('Job "%s": No DP items to apply', self.name)
+            return
+        requests = [item for item, _ in items]
+        coalescer: FlaskDPCoalescer | None = getattr(
+            self.app().ctx,
+            'flaskdp_coalescer',
+            None,
+        )
         try:
-            async with FlaskDPClient(url) as client:
-                resp = await client.apply_dp(req)
+            if coalescer is not None:
+                values = await coalescer.apply_dp(url, requests)
+            else:
+                async with FlaskDPClient(url, self.shared_session()) as client:
+                    resp = await client.apply_dp(
+                        flaskdp_model.FlaskDPRequest(items=requests),
+                    )
                 if resp is None:
                     msg = 'FlaskDP request failed'
                     raise JobError(msg)
+                by_id = {item.id: item.values for item in resp.items}
+                values = [by_id[item.id] for item in requests]
         except ClientError as e:
             msg = 'Client exception raised'
             raise JobError(msg) from e
 
         # Update values
-        for item in resp.items:
-            attribute_list = request_attributes[item.id]
-            self.update_values(attribute_list, item.values)
+        for (_, attribute_list), new_values in zip(items,
+                                                   values,
+                                                   strict=True):
+            self.update_values(attribute_list, new_values)
+
+    async def _inner(self,
+                     mechanism: flaskdp_model.Mechanism,
+                     **kwargs,
+                     ):
+        url = kwargs.get(self.PARAM_URLF)
+        await self.apply_items(url, self.prepare_items(mechanism, **kwargs))
 
 
 class FromPrivacyPolicy(GeneratorJob):
@@ -191,10 +224,22 @@ class FromPrivacyPolicy(GeneratorJob):
     - `str`
 
     An alternative URL to send the FlaskDP requests to.
+
+    - merge (Optional)
+    - `bool`
+
+    Whether to send the DP items of every policy in a single FlaskDP
+    request, instead of one request per policy.  Defaults to `True`.
     """
 
     PARAM_LOCT = 'privacy_policy_location'
     PARAM_URLF = 'flaskdp_url'
+    PARAM_MERG = 'merge'
+
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=self.locations(self.PARAM_LOCT),
+                        updates=frozenset({ENV_DATA}))
 
     def __init__(self,
                  name: str,
@@ -207,14 +252,15 @@ class FromPrivacyPolicy(GeneratorJob):
     @override
     async def generate(self, **kwargs) -> list[AnonymizingJob]:
         self.verify_parameters(kwargs, self.PARAM_LOCT)
-        url = kwargs.get(FromTechnique.PARAM_URLF,
-                         config.services.flaskdp.url.unicode_string())
-        ret = []
+        url = kwargs.get(FromTechnique.PARAM_URLF)
         privacy_policy = self.get_from_env(kwargs[self.PARAM_LOCT],
                                            PrivacyPolicy)
 
-        # The jobs can't be grouped by technique, because metadata
-        # might differ
+        # The policies can't be grouped by technique, because
+        # metadata might differ.  Every FlaskDP item carries its own
+        # technique and metadata though, so they can still share a
+        # request.
+        techniques = []
 
         # Parse attribute policies
         for attribute_policy in privacy_policy.attributes:
@@ -230,9 +276,7 @@ class FromPrivacyPolicy(GeneratorJob):
                 FromTechnique.PARAM_URLF: url,
             }
             args.update(attribute_policy.dp_policy.metadata)
-            ret.append(FromTechnique(name=f'{len(ret)}_attribute',
-                                     args=args,
-                                     generator=self))
+            techniques.append((f'{len(techniques)}_attribute', args))
 
         # Parse object policies
         for object_policy in privacy_policy.templates:
@@ -252,10 +296,20 @@ class FromPrivacyPolicy(GeneratorJob):
                 FromTechnique.PARAM_URLF: url,
             }
             args.update(object_policy.dp_policy.metadata)
-            ret.append(FromTechnique(name=f'{len(ret)}_object',
-                                     args=args,
-                                     generator=self))
-        return ret
+            techniques.append((f'{len(techniques)}_object', args))
+
+        if len(techniques) == 0:
+            return []
+        if kwargs.get(self.PARAM_MERG, True):
+            args = {
+                FromTechniques.PARAM_TCHS: [a for _, a in techniques],
+                FromTechniques.PARAM_URLF: url,
+            }
+            return [FromTechniques(name='apply_dp',
+                                   args=args,
+                                   generator=self)]
+        return [FromTechnique(name=name, args=args, generator=self)
+                for name, args in techniques]
 
 
 class FromTechnique(FlaskDPJob):
@@ -329,6 +383,45 @@ class FromTechnique(FlaskDPJob):
         await self._inner(tech, **kwargs)
 
 
+class FromTechniques(FlaskDPJob):
+    """Apply several Differential Privacy techniques at once.
+
+    The items of every technique are sent in a single FlaskDP request.
+
+    - techniques
+    - `list[dict]`
+
+    The techniques to apply.  Each entry contains the parameters of a
+    `FromTechnique` job, except for "flaskdp_url".
+
+    - flaskdp_url (Optional)
+    - `str`
+
+    An alternative URL to send the FlaskDP request to.
+    """
+
+    PARAM_TCHS = 'techniques'
+
+    @override
+    async def run(self, **kwargs):
+        self.verify_parameters(kwargs, self.PARAM_TCHS)
+        url = kwargs.get(self.PARAM_URLF)
+        items = []
+        for i, technique in enumerate(kwargs[self.PARAM_TCHS]):
+            self.verify_parameters(technique,
+                                   FromTechnique.PARAM_TECH,
+                                   self.PARAM_ATTS,
+                                   self.PARAM_EPSL,
+                                   self.PARAM_DELT,
+                                   self.PARAM_SENS)
+            tech = flaskdp_model.Mechanism.from_string(
+                technique[FromTechnique.PARAM_TECH],
+            )
+            items.extend(self.prepare_items(tech, f'{i}-', **technique))
+        log.debug('Job "%s": Prepared %s DP items', self.name, len(items))
+        await self.apply_items(url, items)
+
+
 class Laplace(FlaskDPJob):
     """Apply Differential Privacy (Laplace).
 
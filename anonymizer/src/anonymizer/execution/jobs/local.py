@@ -8,8 +8,14 @@ from typing import override
 import pgpy
 
 from anonymizer.config import log
+from anonymizer.execution import Dataflow
 from anonymizer.execution.exceptions import JobError
-from anonymizer.execution.jobs import AnonymizingJob, GeneratorJob, Job
+from anonymizer.execution.jobs import (
+    ENV_DATA,
+    AnonymizingJob,
+    GeneratorJob,
+    Job,
+)
 from anonymizer.models.data_model import Attribute, Object
 from anonymizer.models.policies import (
     HierarchyAttribute,
@@ -66,7 +72,6 @@ class ApplyAnonymizationLevel(LocalJob):
                                self.PARAM_ATTS,
                                self.PARAM_OBJS,
                                self.PARAM_ATTH)
-        data = self.anonymizable_components()
         level = int(kwargs[self.PARAM_LEVL])
         attributes: list[str] = kwargs[self.PARAM_ATTS]
         objects: list[str] = kwargs[self.PARAM_OBJS]
@@ -82,19 +87,14 @@ class ApplyAnonymizationLevel(LocalJob):
         # Set lookup collection
         lookup: list[Attribute] = []
         if len(objects) == 0:
-            lookup.extend([a for a in data
-                           if isinstance(a, Attribute)
-                           and a.type_is(self.TYPE_ANONYMIZABLE)])
+            lookup.extend(self.anonymizable_components(names=attributes,
+                                                       kind=Attribute))
         else:
-            for c in data:
-                if (isinstance(c, Object)
-                    and c.type_is(self.TYPE_ANONYMIZABLE)
-                    and c.name in objects):
-                    lookup.extend(
-                        [a for a in c.value
-                         if isinstance(a, Attribute)
-                         and a.type_is(self.TYPE_ANONYMIZABLE)],
-                    )
+            for c in self.anonymizable_components(names=objects,
+                                                  kind=Object):
+                lookup.extend(c.components(self.TYPE_ANONYMIZABLE,
+                                           names=attributes,
+                                           kind=Attribute))
 
         log.debug('Job "%s": Lookup list generated with length %s',
                   self.name,
@@ -108,16 +108,9 @@ class ApplyAnonymizationLevel(LocalJob):
 
         # Apply suppression
         for attribute in lookup:
-            name = None
-            for n in attributes:
-                if attribute.name == n:
-                    name = n
-                    break
-            if name is None:
-                continue
             values = get_hierarchy_values(
                 attribute.value,
-                hierarchy_map[name],
+                hierarchy_map[attribute.name],
             )
             if len(values) <= level:
                 log.debug('Job "%s": Not enough generalization levels ('
@@ -162,7 +155,7 @@ class ApplyPGPEncryption(LocalJob):
                                self.PARAM_KEY,
                                self.PARAM_ATTS,
                                self.PARAM_OBJS)
-        data = self.anonymizable_components()
+        data = self.data()
         key_name: str = kwargs[self.PARAM_KEY]
         attributes: list[str] = kwargs[self.PARAM_ATTS]
         objects: list[str] = kwargs[self.PARAM_OBJS]
@@ -180,13 +173,16 @@ class ApplyPGPEncryption(LocalJob):
         # Set lookup collection
         lookup: list[Attribute] = []
         if len(objects) == 0:
-            lookup.extend([a for a in data if isinstance(a, Attribute)])
+            lookup.extend([a for a in data.types_search(*attributes)
+                           if isinstance(a, Attribute)
+                           and a.type_is(self.TYPE_ANONYMIZABLE)])
         else:
-            for c in data:
+            for c in data.types_search(*objects):
                 if (isinstance(c, Object)
-                    and any(c.type_is(t) for t in objects)):
+                    and c.type_is(self.TYPE_ANONYMIZABLE)):
                     lookup.extend(
-                        [a for a in c.value if isinstance(a, Attribute)],
+                        [a for a in c.types_search(*attributes)
+                         if isinstance(a, Attribute)],
                     )
 
         log.debug('Job "%s": Lookup list generated with length %s',
@@ -198,14 +194,6 @@ class ApplyPGPEncryption(LocalJob):
 
         # Encrypt attributes
         for attribute in lookup:
-            name = None
-            for n in attributes:
-                if attribute.type_is(n):
-                    name = n
-                    break
-            if name is None:
-                continue
-
             attribute.value = self.encrypt(attribute.value, key)
 
     def retrieve_pgp_key(self, filename: str) -> pgpy.PGPKey:
@@ -348,6 +336,12 @@ class FromPrivacyPolicy(GeneratorJob):
     PARAM_LOCP = 'privacy_policy_location'
     PARAM_LOCH = 'hierarchy_policy_location'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=self.locations(self.PARAM_LOCP,
+                                             self.PARAM_LOCH),
+                        updates=frozenset({ENV_DATA}))
+
     @override
     async def generate(self, **kwargs) -> list[Job]:
         self.verify_parameters(kwargs, self.PARAM_LOCP, self.PARAM_LOCH)
@@ -13,8 +13,15 @@ from typing import override
 from anonymizer.clients import ClientError
 from anonymizer.clients.misp import MISPClient
 from anonymizer.config import config, log
+from anonymizer.execution import Dataflow
 from anonymizer.execution.exceptions import JobError
-from anonymizer.execution.jobs import GeneratorJob, Job, JsonReply
+from anonymizer.execution.jobs import (
+    ENV_DATA,
+    ENV_RESPONSE,
+    GeneratorJob,
+    Job,
+    JsonReply,
+)
 from anonymizer.models.base import Model
 from anonymizer.models.data_model import Request
 from anonymizer.models.misp import VERSION, Event, EventAnon
@@ -65,6 +72,11 @@ class MispPong(JsonReply):
 
     PARAM_OBJL = 'object_location'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=self.locations(self.PARAM_OBJL),
+                        writes=frozenset({ENV_RESPONSE}))
+
     @override
     def json_body(self, **kwargs) -> dict:
         self.verify_parameters(kwargs, self.PARAM_OBJL)
@@ -90,6 +102,11 @@ class UpdateEvent(Job):
 
     PARAM_EVTL = 'event_location'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=frozenset({ENV_DATA}),
+                        updates=self.locations(self.PARAM_EVTL))
+
     @override
     async def run(self, **kwargs):
         self.verify_parameters(kwargs, self.PARAM_EVTL)
@@ -146,6 +163,10 @@ class PostEvent(MispJob):
     PARAM_PUBL = 'publish'
     PARAM_EVAN = 'event_anon'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=self.locations(self.PARAM_EVTL))
+
     @override
     async def run(self, **kwargs):
         self.verify_parameters(kwargs, self.PARAM_EVTL, self.PARAM_PUBL)
@@ -182,7 +203,7 @@ class PostEvent(MispJob):
                             old_audit['published'] = publish
                             return old_audit
 
-                        await self.request().app.ctx.valkey.update_audit(
+                        await self.app().ctx.valkey.update_audit(
                             self.env.audit_timestamp,
                             update_misp_event_audit,
                         )
@@ -220,6 +241,11 @@ class ExtractEventFromEventAnon(Job):
     PARAM_SRCE = 'source'
     PARAM_DEST = 'destination'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=self.locations(self.PARAM_SRCE),
+                        writes=self.locations(self.PARAM_DEST))
+
     @override
     async def run(self, **kwargs):
         self.verify_parameters(kwargs,
@@ -9,6 +9,7 @@ from typing import Any, override
 
 from anonymizer.clients.mqtt import MQTTClient
 from anonymizer.config import config, log
+from anonymizer.execution import Dataflow
 from anonymizer.execution.exceptions import JobError
 from anonymizer.execution.jobs import GeneratorJob, Job
 
@@ -94,6 +95,10 @@ class Publish(MqttJob):
     PARAM_LOCA = 'location'
     PARAM_TOPC = 'topic'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=self.locations(self.PARAM_LOCA))
+
     @override
     async def run(self, **kwargs):
         self.verify_parameters(kwargs, self.PARAM_LOCA)
@@ -3,13 +3,32 @@
 #
 # See LICENSE file in the project root for details.
 
+from json import dumps
 from typing import override
+
 from anonymizer.config import log
+from anonymizer.execution import Dataflow
 from anonymizer.execution.exceptions import JobError
-from anonymizer.execution.jobs import Job
+from anonymizer.execution.jobs import ENV_DOCUMENT, Job
+from anonymizer.models.base import Model
 from anonymizer.models.policies import HierarchyPolicy, PrivacyPolicy
 
 
+def _parse_policy[T: Model](job: Job, policy_class: type[T], data: dict) -> T:
+    """Parse a policy document.
+
+    Runs sharing state (such as those of a single batch) reuse the
+    policies already parsed by each other.
+    """
+    shared: dict | None = getattr(job.env, 'shared', None)
+    if shared is None:
+        return policy_class.model_validate(data)
+    key = (policy_class.__name__, dumps(data, sort_keys=True))
+    if key not in shared:
+        shared[key] = policy_class.model_validate(data)
+    return shared[key]
+
+
 class ReadPrivacyPolicy(Job):
     """Read, parse and store a privacy policy.
 
@@ -30,10 +49,15 @@ class ReadPrivacyPolicy(Job):
     PARAM_ADDR = 'address'
     PARAM_LOCT = 'location'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=frozenset({ENV_DOCUMENT}),
+                        writes=self.locations(self.PARAM_LOCT))
+
     @override
     async def run(self, **kwargs):
         self.verify_parameters(kwargs, self.PARAM_ADDR, self.PARAM_LOCT)
-        data = self.request().json
+        data = self.document()
         address = kwargs[self.PARAM_ADDR]
         location = kwargs[self.PARAM_LOCT]
         split = address.split('.')
@@ -51,7 +75,7 @@ class ReadPrivacyPolicy(Job):
             msg = 'Target address is not a JSON object'
             raise JobError(msg)
 
-        policy = PrivacyPolicy.model_validate(data)
+        policy = _parse_policy(self, PrivacyPolicy, data)
         log.debug('Job "%s": Storing privacy policy in location "%s"',
                   self.name,
                   location)
@@ -78,10 +102,15 @@ class ReadHierarchyPolicy(Job):
     PARAM_ADDR = 'address'
     PARAM_LOCT = 'location'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=frozenset({ENV_DOCUMENT}),
+                        writes=self.locations(self.PARAM_LOCT))
+
     @override
     async def run(self, **kwargs):
         self.verify_parameters(kwargs, self.PARAM_ADDR)
-        data = self.request().json
+        data = self.document()
         address = kwargs[self.PARAM_ADDR]
         location = kwargs[self.PARAM_LOCT]
         split = address.split('.')
@@ -99,7 +128,7 @@ class ReadHierarchyPolicy(Job):
             msg = 'Target address is not a JSON object'
             raise JobError(msg)
 
-        policy = HierarchyPolicy.model_validate(data)
+        policy = _parse_policy(self, HierarchyPolicy, data)
         log.debug('Job "%s": Storing hierarchy policy in location "%s"',
                   self.name,
                   location)
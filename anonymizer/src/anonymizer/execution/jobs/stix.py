@@ -14,8 +14,14 @@ from misp_stix_converter import (
 )
 
 from anonymizer.config import log
+from anonymizer.execution import Dataflow
 from anonymizer.execution.exceptions import JobError
-from anonymizer.execution.jobs import GeneratorJob, Job, JsonReply
+from anonymizer.execution.jobs import (
+    ENV_RESPONSE,
+    GeneratorJob,
+    Job,
+    JsonReply,
+)
 from anonymizer.models.misp import Event
 
 
@@ -50,6 +56,11 @@ class StixPong(JsonReply):
 
     PARAM_OBJL = 'object_location'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=self.locations(self.PARAM_OBJL),
+                        writes=frozenset({ENV_RESPONSE}))
+
     @override
     def json_body(self, **kwargs) -> dict:
         self.verify_parameters(kwargs, self.PARAM_OBJL)
@@ -89,6 +100,11 @@ class TransformMISPEvent(StixJob):
     PARAM_EVTL = 'event_location'
     PARAM_DEST = 'destination'
 
+    @override
+    def declare_dataflow(self) -> Dataflow | None:
+        return Dataflow(reads=self.locations(self.PARAM_EVTL),
+                        writes=self.locations(self.PARAM_DEST))
+
     @override
     async def run(self, **kwargs):
         self.verify_parameters(kwargs,
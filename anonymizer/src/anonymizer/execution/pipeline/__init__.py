@@ -3,16 +3,38 @@
 #
 # See LICENSE file in the project root for details.
 
-from dataclasses import dataclass
+from __future__ import annotations
+
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass, field
 from traceback import format_exc
-from types import SimpleNamespace
-from typing import override
+from types import MappingProxyType, SimpleNamespace
+from typing import TYPE_CHECKING, Any, override
 
 from anonymizer.config import log
-from anonymizer.execution import ReadsFromPolicies, Result
-from anonymizer.execution.exceptions import PipelineError
-from anonymizer.execution.jobs import job_from_string
-from anonymizer.execution.stages import Stage, StageResult
+from anonymizer.execution import (
+    ReadsFromPolicies,
+    Result,
+    bind_deadline,
+    bind_env,
+    deadline_in,
+)
+from anonymizer.execution.exceptions import FatalFailureError, PipelineError
+from anonymizer.execution.jobs import Job, job_class_from_string
+from anonymizer.execution.stages import (
+    EXECUTION_CONCURRENT,
+    Stage,
+    StageResult,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Coroutine, Mapping
+    from pathlib import Path
+
+SCHEDULER_LINEAR = 'linear'
+SCHEDULER_DATAFLOW = 'dataflow'
+SCHEDULERS = (SCHEDULER_LINEAR, SCHEDULER_DATAFLOW)
 
 
 @dataclass
@@ -20,18 +42,36 @@ class PipelineResult(Result):
     result: dict[str, StageResult]
 
 
+@dataclass
+class PipelineRun:
+    """The state of a single execution of a pipeline.
+
+    Everything that changes while a pipeline runs lives here, so a
+    single `Pipeline` can serve any number of concurrent runs.
+    """
+
+    env: SimpleNamespace
+    next: int = 0
+    deadline: float | None = None
+    cancelled: bool = False
+    running: dict[asyncio.Task, Stage] = field(default_factory=dict)
+    result: PipelineResult = field(
+        default_factory=lambda: PipelineResult(success=True, result={}),
+    )
+
+
 class Pipeline(ReadsFromPolicies):
-    def __init__(self,
-                 env: SimpleNamespace,
-                 *stages: Stage,
-                 ):
+    def __init__(self, *stages: Stage):
         self.stages: list[Stage] = []
-        self.next: int = 0
-        self.result = PipelineResult(success=True, result={})
-        self.env: SimpleNamespace = env
         self.policies = {}
         self.discard_response_on_failure = True
         self.optional: list[str] = []
+        self.scheduler = SCHEDULER_LINEAR
+        self.respond_after: str | None = None
+        self.timeout: float | None = None
+        self.fail_fast = False
+        self.always_complete: list[str] = []
+        self.dependencies: dict[Job, list[Job]] = {}
         for stage in stages:
             self.stages.append(stage)
 
@@ -46,11 +86,101 @@ class Pipeline(ReadsFromPolicies):
             'optional',
             [],
         )
+        self.scheduler: str = policies.get(
+            'scheduler',
+            SCHEDULER_LINEAR,
+        )
+        if self.scheduler not in SCHEDULERS:
+            msg = f'Unknown pipeline scheduler: {self.scheduler}'
+            raise ValueError(msg)
+        if self.scheduler == SCHEDULER_DATAFLOW:
+            self.dependencies = self._dependency_graph()
+        # Stage after which the HTTP response is sent, with the
+        # remaining stages running in the background
+        self.respond_after: str | None = policies.get('respond_after')
+        if (self.respond_after is not None
+                and self.respond_after not in (s.name for s in self.stages)):
+            msg = f'Unknown response stage: {self.respond_after}'
+            raise ValueError(msg)
+        # Maximum amount of seconds a run of the pipeline can take
+        self.timeout: float | None = policies.get('timeout')
+        # Whether to stop the run after the first fatal failure of a
+        # mandatory stage.  Stages fail fast too unless they say
+        # otherwise.
+        self.fail_fast: bool = policies.get(
+            'fail_fast',
+            False,
+        )
+        for stage in self.stages:
+            if 'fail_fast' not in stage.policies:
+                stage.fail_fast = self.fail_fast
+        # Stages that still execute after a run is cancelled
+        self.always_complete: list[str] = policies.get(
+            'always_complete',
+            [],
+        )
+
+    def new_run(self, env: SimpleNamespace | None = None) -> PipelineRun:
+        """Prepare a new execution of the pipeline."""
+        return PipelineRun(env=env if env is not None else SimpleNamespace())
+
+    def finished(self, run: PipelineRun) -> bool:
+        """Check whether a run has executed every stage."""
+        return run.next >= len(self.stages)
+
+    def cancel(self, run: PipelineRun):
+        """Cancel a run.
+
+        Running jobs are cancelled and pending jobs are skipped,
+        except for those in the stages that must always complete.
+        """
+        log.warning('Pipeline:\tCancelling execution')
+        run.cancelled = True
+        for task, stage in run.running.items():
+            if stage.name not in self.always_complete:
+                task.cancel()
 
-    async def run_wrapped(self, **kwargs) -> PipelineResult:
-        """Execute all stages in the pipeline."""
+    def _skipped(self, run: PipelineRun, stage: Stage) -> bool:
+        return run.cancelled and stage.name not in self.always_complete
+
+    async def _cancellable[T](self,
+                              run: PipelineRun,
+                              stage: Stage,
+                              coro: Coroutine[Any, Any, T],
+                              ) -> T | None:
+        """Await a stage's work in a task `cancel()` can reach.
+
+        :return: The result of the work, or `None` if it was
+        cancelled by `cancel()`.
+        """
+        task = asyncio.create_task(coro)
+        run.running[task] = stage
+        try:
+            return await task
+        except asyncio.CancelledError:
+            current = asyncio.current_task()
+            if current is not None and current.cancelling() > 0:
+                raise
+            log.warning('Pipeline:\tCancelled stage "%s"', stage.name)
+            return None
+        finally:
+            del run.running[task]
+
+    async def run_wrapped(self,
+                          run: PipelineRun,
+                          until: str | None = None,
+                          **kwargs,
+                          ) -> PipelineResult:
+        """Execute all remaining stages in the pipeline.
+
+        :param until: The name of the last stage to execute.  The
+        run can be resumed later on by calling this method again.
+        """
+        if run.next == 0 and run.deadline is None:
+            run.deadline = deadline_in(self.timeout)
         try:
-            result = await self.all(**kwargs)
+            with bind_env(run.env), bind_deadline(run.deadline):
+                result = await self.all(run, until, **kwargs)
             for stage in result.result:
                 if stage in self.optional:
                     continue
@@ -66,74 +196,327 @@ class Pipeline(ReadsFromPolicies):
             log.debug(format_exc())
             return PipelineResult(success=False, result={})
 
-    async def all(self, **kwargs) -> PipelineResult:
+    async def all(self,
+                  run: PipelineRun,
+                  until: str | None = None,
+                  **kwargs,
+                  ) -> PipelineResult:
         """Execute all remaining stages in the pipeline.
 
         If previous stages have already been executed, resumes from
         the next stage in line.
+
+        :param until: The name of the last stage to execute.
         """
-        count = 0
-        one = await self.one(**kwargs)
-        while one:
-            if one == -1:
-                count = count + 1
-            one = await self.one(**kwargs)
-        return self.result
-
-    async def one(self, **kwargs) -> StageResult | None:
+        stop = len(self.stages)
+        if until is not None:
+            stop = [s.name for s in self.stages].index(until) + 1
+        if self.scheduler == SCHEDULER_DATAFLOW:
+            return await self._all_dataflow(run, stop, **kwargs)
+        while run.next < stop:
+            stage_result = await self.one(run, **kwargs)
+            stage = self.stages[run.next - 1]
+            if stage_result is not None and self._is_fatal(stage,
+                                                           stage_result):
+                log.error('Pipeline:\tStopped after stage "%s" failed',
+                          stage.name)
+                run.next = len(self.stages)
+        return run.result
+
+    def _is_fatal(self, stage: Stage, result: StageResult) -> bool:
+        """Check whether a stage's result should stop the run."""
+        return (self.fail_fast
+                and not result.success
+                and stage.name not in self.optional)
+
+    async def one(self, run: PipelineRun, **kwargs) -> StageResult | None:
         """Execute the next stage.
 
         :return: The stage's result, or `None` if there are no more
         stages.
         """
-        if self.next >= len(self.stages):
+        if run.next >= len(self.stages):
+            return None
+        stage = self.stages[run.next]
+        run.next = run.next + 1
+        if self._skipped(run, stage):
+            log.info('Pipeline:\tSkipping stage "%s"', stage.name)
             return None
-        stage = self.stages[self.next]
-        self.next = self.next + 1
 
         log.info('Pipeline:\tBegin execution of stage "%s"', stage.name)
-        stage_result = await stage.run_wrapped(**kwargs)
+        stage_result = await self._cancellable(run,
+                                               stage,
+                                               stage.run_wrapped(**kwargs))
+        if stage_result is None:
+            return None
         log.info('Pipeline:\tFinished execution of stage "%s"', stage.name)
-        self.result.result[stage.name] = stage_result
+        run.result.result[stage.name] = stage_result
         return stage_result
 
-    def reset(self, env: SimpleNamespace | None = None):
-        self.result = PipelineResult(success=True, result={})
-        self.env = env if env is not None else SimpleNamespace()
-        self.next = 0
+    async def _all_dataflow(self,
+                            run: PipelineRun,
+                            stop: int,
+                            **kwargs,
+                            ) -> PipelineResult:
+        """Execute the remaining stages before `stop` as a graph.
+
+        Every job starts as soon as the jobs it depends on finish,
+        regardless of the stage it belongs to.  Stages are still used
+        for reporting, optional jobs and generated job execution.
+        """
+        stages = self.stages[run.next:stop]
+        run.next = max(run.next, stop)
+        stage_runs = {stage.name: stage.new_run() for stage in stages}
+        # Stage timeouts count from the start of the graph, as that's
+        # when the first jobs of every stage may start
+        deadlines = {stage.name: deadline_in(stage.timeout)
+                     for stage in stages}
+        for stage in stages:
+            run.result.result[stage.name] = stage_runs[stage.name].result
+        tasks: dict[Job, asyncio.Task] = {}
+
+        async def _node(stage: Stage, job: Job):
+            # Dependencies missing from the task list belong to stages
+            # executed by a previous call, and have already finished
+            deps = [tasks[d] for d in self.dependencies[job] if d in tasks]
+            if deps:
+                await asyncio.wait(deps)
+            stage_run = stage_runs[stage.name]
+            if stage_run.stopped or self._skipped(run, stage):
+                return
+            try:
+                with bind_deadline(deadlines[stage.name]):
+                    await self._cancellable(
+                        run,
+                        stage,
+                        stage.run_job(stage_run, job, **kwargs),
+                    )
+            except* FatalFailureError:
+                log.error('Stage "%s":\tStopped after a fatal failure',
+                          stage.name)
+            if self._is_fatal(stage, stage_run.result):
+                msg = f'Stage "{stage.name}" failed'
+                raise FatalFailureError(msg)
+
+        log.info('Pipeline:\tExecuting %s jobs as a dataflow graph',
+                 sum(len(stage.jobs) for stage in stages))
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for stage in stages:
+                    for job in stage.jobs:
+                        tasks[job] = tg.create_task(_node(stage, job))
+        except* FatalFailureError:
+            log.error('Pipeline:\tStopped after a fatal failure')
+            run.next = len(self.stages)
+        return run.result
+
+    def _dependency_graph(self) -> dict[Job, list[Job]]:
+        """Compute the jobs each job has to wait for.
+
+        Jobs are visited in the order the linear scheduler would run
+        them, and depend on the earlier jobs that touch the same env
+        locations in an incompatible way:
+
+        - Every job waits for the last job writing its locations.
+        - Readers and writers wait for earlier updaters.
+        - Updaters and writers wait for earlier readers.
+        - Updaters wait for earlier updaters, unless both are in the
+          same concurrent stage.
+
+        Jobs that don't declare their dataflow act as barriers: they
+        wait for every earlier job, and every later job waits for
+        them.
+
+        Raises `ValueError` if a job of a concurrent stage writes to
+        a location another job of the same stage modifies, as their
+        order would be undefined.  In sequential stages, they run in
+        the order they're declared in.
+        """
+        graph: dict[Job, list[Job]] = {}
+        stage_of: dict[Job, Stage] = {}
+        writer: dict[str, Job] = {}
+        readers: defaultdict[str, list[Job]] = defaultdict(list)
+        updaters: defaultdict[str, list[Job]] = defaultdict(list)
+        barrier: Job | None = None
+        since_barrier: list[Job] = []
         for stage in self.stages:
-            stage.reset(env)
+            for job in stage.jobs:
+                stage_of[job] = stage
+                flow = job.dataflow
+                if flow is None:
+                    graph[job] = list(since_barrier)
+                    if barrier is not None:
+                        graph[job].append(barrier)
+                    barrier = job
+                    since_barrier = []
+                    writer.clear()
+                    readers.clear()
+                    updaters.clear()
+                    continue
 
+                deps: set[Job] = set()
+                if barrier is not None:
+                    deps.add(barrier)
+                for loc in flow.reads | flow.writes | flow.updates:
+                    if loc in writer:
+                        deps.add(writer[loc])
+                for loc in flow.reads | flow.writes:
+                    deps.update(updaters[loc])
+                for loc in flow.writes | flow.updates:
+                    deps.update(readers[loc])
+                for loc in flow.updates:
+                    deps.update(
+                        u for u in updaters[loc]
+                        if stage_of[u] is not stage
+                        or stage.execution != EXECUTION_CONCURRENT
+                    )
+                for loc in (flow.writes | flow.updates
+                            if stage.execution == EXECUTION_CONCURRENT
+                            else ()):
+                    others = [writer[loc]] if loc in writer else []
+                    if loc in flow.writes:
+                        others.extend(updaters[loc])
+                    for other in others:
+                        if stage_of[other] is stage:
+                            msg = (f'Jobs "{other.name}" and "{job.name}" '
+                                   f'of stage "{stage.name}" both modify '
+                                   f'location "{loc}"')
+                            raise ValueError(msg)
 
-def parse(pipeline: dict) -> Pipeline:
-    env = SimpleNamespace()
-    pipeline_policies = pipeline.get('policies', {})
-    ret = Pipeline(env)
-    ret.init_policies(pipeline_policies)
-    jobs = {}
-    stages = pipeline['stages']
-    for stage in stages:
+                for loc in flow.reads:
+                    readers[loc].append(job)
+                for loc in flow.updates:
+                    updaters[loc].append(job)
+                for loc in flow.writes:
+                    writer[loc] = job
+                    readers.pop(loc, None)
+                    updaters.pop(loc, None)
+                graph[job] = list(deps)
+                since_barrier.append(job)
+        return graph
+
+
+@dataclass(frozen=True)
+class JobPlan:
+    """The static description of a pipeline job.
+
+    The job class is resolved once when the plan is compiled, so
+    building a job from its plan requires no imports.
+    """
+
+    name: str
+    job_class: type[Job]
+    args: Mapping = field(default_factory=dict)
+    policies: Mapping = field(default_factory=dict)
+
+    def build(self, env: SimpleNamespace) -> Job:
+        job = self.job_class(self.name, env, dict(self.args))
+        job.init_policies(dict(self.policies))
+        return job
+
+
+@dataclass(frozen=True)
+class StagePlan:
+    """The static description of a pipeline stage."""
+
+    name: str
+    policies: Mapping = field(default_factory=dict)
+    jobs: tuple[JobPlan, ...] = ()
+
+    def build(self, env: SimpleNamespace) -> Stage:
+        stage = Stage(self.name, *(j.build(env) for j in self.jobs))
+        stage.init_policies(dict(self.policies))
+        return stage
+
+
+@dataclass(frozen=True)
+class PipelinePlan:
+    """A compiled, immutable pipeline.
+
+    Plans are compiled once from the pipeline file and can build any
+    number of `Pipeline` objects without touching the disk or the
+    import machinery again.
+
+    :param source: The file the plan was compiled from, if any.
+
+    :param mtime: The modification time of `source` (in nanoseconds)
+    at the moment the plan was compiled.
+    """
+
+    policies: Mapping = field(default_factory=dict)
+    stages: tuple[StagePlan, ...] = ()
+    source: Path | None = None
+    mtime: int | None = None
+
+    def build(self, env: SimpleNamespace | None = None) -> Pipeline:
+        """Build a pipeline from the plan.
+
+        :param env: The environment jobs fall back to when used
+        outside of a pipeline run.
+        """
+        env = env if env is not None else SimpleNamespace()
+        ret = Pipeline(*(s.build(env) for s in self.stages))
+        ret.init_policies(dict(self.policies))
+        return ret
+
+    def is_stale(self) -> bool:
+        """Check whether the source file changed since compiling.
+
+        Raises `OSError` if the source file can't be accessed.
+        """
+        if self.source is None:
+            return False
+        return self.source.stat().st_mtime_ns != self.mtime
+
+
+def compile_plan(pipeline: dict,
+                 source: Path | None = None,
+                 mtime: int | None = None,
+                 ) -> PipelinePlan:
+    """Compile a pipeline definition into a `PipelinePlan`.
+
+    :param pipeline: The pipeline definition, as read from a pipeline
+    file.
+
+    :param source: The file the definition was read from, if any.
+
+    :param mtime: The modification time of `source`, in nanoseconds.
+    """
+    stages: dict[str, dict] = {}
+    for stage in pipeline['stages']:
         match stage:
             case str():
-                jobs[stage] = {'policies': {}, 'jobs': []}
+                stages[stage] = {'policies': {}, 'jobs': []}
             case dict():
                 stage_policies = stage.get('policies', {})
-                jobs[stage['name']] = {'policies': stage_policies, 'jobs': []}
+                stages[stage['name']] = {'policies': stage_policies,
+                                         'jobs': []}
             case _:
                 msg = f'Unknown stage type: {type(stage)}'
                 raise TypeError(msg)
     for name, job in pipeline['jobs'].items():
-        args = job.get('args', None)
-        job_policies = job.get('policies', {})
-        job_obj = job_from_string(job['type'], name, args, env)
-        job_obj.init_policies(job_policies)
         stage = job['stage']
-        if stage not in jobs:
+        if stage not in stages:
             msg = f'Missing stage: {stage}'
             raise ValueError(msg)
-        jobs[stage]['jobs'].append(job_obj)
-    for stage, info in jobs.items():
-        stage_obj = Stage(stage, env, *info['jobs'])
-        stage_obj.init_policies(info['policies'])
-        ret.stages.append(stage_obj)
-    return ret
+        job_plan = JobPlan(name=name,
+                           job_class=job_class_from_string(job['type']),
+                           args=MappingProxyType(job.get('args') or {}),
+                           policies=MappingProxyType(job.get('policies', {})))
+        stages[stage]['jobs'].append(job_plan)
+    stage_plans = tuple(
+        StagePlan(name=name,
+                  policies=MappingProxyType(info['policies']),
+                  jobs=tuple(info['jobs']))
+        for name, info in stages.items()
+    )
+    return PipelinePlan(
+        policies=MappingProxyType(pipeline.get('policies', {})),
+        stages=stage_plans,
+        source=source,
+        mtime=mtime,
+    )
+
+
+def parse(pipeline: dict) -> Pipeline:
+    return compile_plan(pipeline).build()
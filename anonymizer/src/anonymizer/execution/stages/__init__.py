@@ -3,16 +3,25 @@
 #
 # See LICENSE file in the project root for details.
 
-from dataclasses import dataclass
+import asyncio
+from dataclasses import dataclass, field
 from traceback import format_exc
-from types import SimpleNamespace
 from typing import override
 
 from anonymizer.config import log
-from anonymizer.execution import ReadsFromPolicies, Result
-from anonymizer.execution.exceptions import StageError
+from anonymizer.execution import (
+    ReadsFromPolicies,
+    Result,
+    bind_deadline,
+    deadline_in,
+)
+from anonymizer.execution.exceptions import FatalFailureError, StageError
 from anonymizer.execution.jobs import GeneratorJobResult, Job, JobResult
 
+EXECUTION_SEQUENTIAL = 'sequential'
+EXECUTION_CONCURRENT = 'concurrent'
+EXECUTION_POLICIES = (EXECUTION_SEQUENTIAL, EXECUTION_CONCURRENT)
+
 
 @dataclass
 class StageResult(Result):
@@ -20,20 +29,40 @@ class StageResult(Result):
     failures: int
 
 
+@dataclass
+class StageRun:
+    """The state of a single execution of a stage.
+
+    Generated jobs are only ever added to the run's job list, never to
+    the stage itself, so a stage can be executed by several runs at
+    the same time.
+    """
+
+    jobs: list[Job]
+    next: int = 0
+    fatal_failures: int = 0
+    limit: asyncio.Semaphore | None = None
+    stopped: bool = False
+    result: StageResult = field(
+        default_factory=lambda: StageResult(success=True,
+                                            result={},
+                                            failures=0),
+    )
+
+
 class Stage(ReadsFromPolicies):
     def __init__(self,
                  name: str,
-                 env: SimpleNamespace,
                  *jobs: Job,
                  ) -> None:
         self.name: str = name
-        self.env: SimpleNamespace = env
-        self.result = StageResult(success=True, result={}, failures=0)
         self.jobs: list[Job] = []
-        self.next: int = 0
-        self.fatal_failures = 0
         self.policies = {}
-        self.optional: list[str]
+        self.optional: list[str] = []
+        self.execution: str = EXECUTION_SEQUENTIAL
+        self.max_concurrency: int = 0
+        self.timeout: float | None = None
+        self.fail_fast: bool = False
         for j in jobs:
             self.jobs.append(j)
 
@@ -44,12 +73,43 @@ class Stage(ReadsFromPolicies):
             'optional',
             [],
         )
+        self.execution: str = policies.get(
+            'execution',
+            EXECUTION_SEQUENTIAL,
+        )
+        if self.execution not in EXECUTION_POLICIES:
+            msg = (f'Unknown execution policy for stage "{self.name}": '
+                   f'{self.execution}')
+            raise ValueError(msg)
+        # Maximum amount of jobs of this stage running at the same
+        # time.  Zero or less means no limit.
+        self.max_concurrency: int = policies.get(
+            'max_concurrency',
+            0,
+        )
+        # Maximum amount of seconds the jobs of this stage can take in
+        # total
+        self.timeout: float | None = policies.get('timeout')
+        # Whether to stop executing jobs after the first fatal failure
+        self.fail_fast: bool = policies.get(
+            'fail_fast',
+            False,
+        )
+
+    def new_run(self) -> StageRun:
+        """Prepare a new execution of the stage."""
+        limit = (asyncio.Semaphore(self.max_concurrency)
+                 if self.max_concurrency > 0
+                 else None)
+        return StageRun(jobs=list(self.jobs), limit=limit)
 
     async def run_wrapped(self, **kwargs) -> StageResult:
         """Execute all jobs in the stage."""
+        run = self.new_run()
         try:
-            result = await self.all(**kwargs)
-            if self.fatal_failures > 0:
+            with bind_deadline(deadline_in(self.timeout)):
+                result = await self.all(run, **kwargs)
+            if run.fatal_failures > 0:
                 result.success = False
             return result
         except StageError as e:
@@ -60,27 +120,97 @@ class Stage(ReadsFromPolicies):
             log.debug(format_exc())
             return StageResult(success=False, result={}, failures=-1)
 
-    async def all(self, **kwargs) -> StageResult:
+    async def all(self, run: StageRun, **kwargs) -> StageResult:
         """Execute all jobs in the stage.
 
         If previous jobs have already been executed, resumes from the
         next job in line
         """
-        result = await self.one(**kwargs)
-        while result is not None:
-            result = await self.one(**kwargs)
-        return self.result
-
-    async def one(self, **kwargs) -> JobResult | None:
+        try:
+            if self.execution == EXECUTION_CONCURRENT:
+                return await self._all_concurrent(run, **kwargs)
+            result = await self.one(run, **kwargs)
+            while result is not None:
+                result = await self.one(run, **kwargs)
+        except* FatalFailureError:
+            log.error('Stage "%s":\tStopped after a fatal failure',
+                      self.name)
+        return run.result
+
+    async def one(self, run: StageRun, **kwargs) -> JobResult | None:
         """Execute the next job in the stage.
 
         :return: The job's result, or `None` if there are no more jobs
         """
-        if self.next >= len(self.jobs):
+        if run.next >= len(run.jobs):
             return None
-        job = self.jobs[self.next]
-        self.next = self.next + 1
+        job = run.jobs[run.next]
+        run.next = run.next + 1
 
+        job_result, generated = await self._execute(run, job, **kwargs)
+        for subjob in reversed(generated):
+            run.jobs.insert(run.next, subjob)
+        return job_result
+
+    async def run_job(self, run: StageRun, job: Job, **kwargs):
+        """Execute a job along with all the jobs it generates.
+
+        Generated jobs run one after the other, or all at once if the
+        stage uses concurrent execution.
+        """
+        _, generated = await self._execute(run, job, **kwargs)
+        run.jobs.extend(generated)
+        if self.execution == EXECUTION_CONCURRENT:
+            async with asyncio.TaskGroup() as tg:
+                for subjob in generated:
+                    tg.create_task(self.run_job(run, subjob, **kwargs))
+        else:
+            for subjob in generated:
+                await self.run_job(run, subjob, **kwargs)
+
+    async def _all_concurrent(self, run: StageRun, **kwargs) -> StageResult:
+        """Execute all remaining jobs in the stage concurrently.
+
+        Jobs created by generator jobs are started as soon as their
+        generator finishes.
+        """
+        log.info('Stage "%s":\tExecuting %s jobs concurrently',
+                 self.name,
+                 len(run.jobs) - run.next)
+        async with asyncio.TaskGroup() as tg:
+            while run.next < len(run.jobs):
+                job = run.jobs[run.next]
+                run.next = run.next + 1
+                tg.create_task(self.run_job(run, job, **kwargs))
+        run.next = len(run.jobs)
+        return run.result
+
+    async def _execute(self,
+                       run: StageRun,
+                       job: Job,
+                       **kwargs,
+                       ) -> tuple[JobResult, list[Job]]:
+        """Execute a job and record its result.
+
+        :return: The job's result, and the jobs it generated (if it is
+        a generator job).
+
+        Raises `FatalFailureError` if the job failed fatally and the
+        stage is set to fail fast.
+        """
+        if run.stopped:
+            msg = f'Stage "{self.name}" was stopped'
+            raise FatalFailureError(msg)
+        if run.limit is not None:
+            async with run.limit:
+                return await self._execute_unbounded(run, job, **kwargs)
+        return await self._execute_unbounded(run, job, **kwargs)
+
+    async def _execute_unbounded(self,
+                                 run: StageRun,
+                                 job: Job,
+                                 **kwargs,
+                                 ) -> tuple[JobResult, list[Job]]:
         log.info('Stage "%s":\tBegin execution of job "%s"',
                  self.name,
                  job.name)
@@ -88,19 +218,13 @@ class Stage(ReadsFromPolicies):
         log.info('Stage "%s":\tFinished execution of job "%s"',
                  self.name,
                  job.name)
-        if job.ephemeral:
-            log.info('Stage "%s":\tRemoving ephemeral job "%s"',
-                     self.name,
-                     job.name)
-            self.next = self.next - 1
-            self.jobs.remove(job)
+        generated: list[Job] = []
         if isinstance(job_result, GeneratorJobResult):
             log.info('Stage "%s":\tJob "%s" created %s new jobs',
                      self.name,
                      job.name,
                      len(job_result.result))
-            for subjob in reversed(job_result.result):
-                self.jobs.insert(self.next, subjob)
+            generated = job_result.result
 
             # For serialization purposes, we now replace the
             # GeneratorJobResult with a regular JobResult that has a
@@ -108,20 +232,18 @@ class Stage(ReadsFromPolicies):
             names = [j.name for j in job_result.result]
             success = job_result.success
             job_result = JobResult(success=success, result=str(names))
-        self.result.result[job.name] = job_result
+        run.result.result[job.name] = job_result
 
         if not job_result.success:
-            self.result.failures = self.result.failures + 1
+            run.result.failures = run.result.failures + 1
             if not self._is_optional(job):
-                self.fatal_failures = self.fatal_failures + 1
-        return job_result
-
-    def reset(self, env: SimpleNamespace | None = None) -> None:
-        StageResult(success=True, result={}, failures=0)
-        self.env = env if env is not None else SimpleNamespace()
-        self.next = 0
-        for job in self.jobs:
-            job.reset(env)
+                run.fatal_failures = run.fatal_failures + 1
+                run.result.success = False
+                if self.fail_fast:
+                    run.stopped = True
+                    msg = f'Job "{job.name}" failed'
+                    raise FatalFailureError(msg)
+        return job_result, generated
 
     def _is_optional(self, job: Job) -> bool:
         if job.parent is not None:
@@ -84,7 +84,9 @@ def protected(func):  # noqa: ANN201, ANN001
             response = _f(request, *args, **kwargs)
             if isawaitable(response):
                 response = await response
-            response.headers.update(auth.headers())
+            # Streamed responses have already been sent by now
+            if response is not None:
+                response.headers.update(auth.headers())
             return response
         return decorated_function
     return decorator(func)
@@ -6,16 +6,14 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from functools import reduce
+from functools import lru_cache, wraps
 from hashlib import sha256
-from json import dumps
-from typing import TYPE_CHECKING, override
+from typing import TYPE_CHECKING, Any, Self, override
 
 from anonymizer.config import log
-from anonymizer.models.base import Model
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
+    from collections.abc import Callable, Iterable
 
 DEFAULT_ATTRIBUTE_TYPE = 'attribute'
 DEFAULT_OBJECT_TYPE = 'object'
@@ -26,8 +24,112 @@ FIELD_TYPE_OBJ = 'object'
 FIELD_TYPE_REQ = 'request'
 
 
-class _HasType(Model, ABC):
-    type: set[str] = set()  # noqa: RUF012
+# Bumped whenever the type or name of any component changes, so the
+# indexes built before become stale
+_generation = 0
+# Bumped whenever anything changes in any component, so the hashes
+# of their containers are recomputed
+_revision = 0
+
+# Size of the caches keyed by type sets.  Events tend to repeat the
+# same few type sets many times, but types can come from clients, so
+# only the most recently used ones are kept.
+TYPE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=TYPE_CACHE_SIZE)
+def _intern(types: frozenset[str]) -> frozenset[str]:
+    return types
+
+
+def intern_types(t: Iterable[str]) -> frozenset[str]:
+    """Get the shared, immutable set of types with these elements.
+
+    Type sets are shared by every component with the same types, as
+    long as they're among the most recently used ones.
+    """
+    return _intern(frozenset(t))
+
+
+def _encode(s: str) -> bytes:
+    b = s.encode('utf-8')
+    return len(b).to_bytes(4) + b
+
+
+@lru_cache(maxsize=TYPE_CACHE_SIZE)
+def _encode_types(t: frozenset[str]) -> bytes:
+    return len(t).to_bytes(4) + b''.join(_encode(_t) for _t in sorted(t))
+
+
+def _mark_changed(*, indexed: bool):
+    global _generation, _revision
+    if indexed:
+        _generation = _generation + 1
+    _revision = _revision + 1
+
+
+def _tracked(method: Callable) -> Callable:
+    @wraps(method)
+    def _method(self: list, *args, **kwargs) -> object:
+        _mark_changed(indexed=True)
+        return method(self, *args, **kwargs)
+    return _method
+
+
+class ComponentList(list):
+    """A list of components that tracks changes made in place.
+
+    Adding, removing or replacing components marks the indexes and
+    hashes built from the list as stale, like changing a component
+    does.  Containers convert the lists they're given into these.
+    """
+
+    __slots__ = ()
+
+    __setitem__ = _tracked(list.__setitem__)
+    __delitem__ = _tracked(list.__delitem__)
+    __iadd__ = _tracked(list.__iadd__)
+    __imul__ = _tracked(list.__imul__)
+    append = _tracked(list.append)
+    extend = _tracked(list.extend)
+    insert = _tracked(list.insert)
+    pop = _tracked(list.pop)
+    remove = _tracked(list.remove)
+    clear = _tracked(list.clear)
+    sort = _tracked(list.sort)
+    reverse = _tracked(list.reverse)
+
+
+def _tracking[T](value: T) -> T | ComponentList:
+    if isinstance(value, list) and not isinstance(value, ComponentList):
+        return ComponentList(value)
+    return value
+
+
+class _HasType:
+    __slots__ = ('_digest', '_type')
+
+    def __init__(self, t: Iterable[str]) -> None:
+        self._type = intern_types(t)
+        self._digest: bytes | None = None
+
+    def _changed(self, *, indexed: bool = False):
+        """Discard whatever was computed from this component.
+
+        :param indexed: Whether the change affects the indexes of
+        its container, namely if it's a change of type or name.
+        """
+        _mark_changed(indexed=indexed)
+        self._digest = None
+
+    @property
+    def type(self) -> frozenset[str]:
+        return self._type
+
+    @type.setter
+    def type(self, t: Iterable[str]):
+        self._changed(indexed=True)
+        self._type = intern_types(t)
 
     def type_is(self, *t: str) -> bool:
         return all(_t in self.type for _t in t)
@@ -39,13 +141,77 @@ class _HasType(Model, ABC):
         self.type = self.type & set(t)
 
 
-class _HasDataWithTypes(Model, ABC):
+class _Index:
+    """Positions of the subcomponents of a container.
+
+    Indexes are only valid for the list they were built from, as long
+    as its length doesn't change and no component type or name does.
+    """
+
+    def __init__(self, data: list[Component]) -> None:
+        self.data = data
+        self.size = len(data)
+        self.generation = _generation
+        self.by_type: dict[str, list[int]] = {}
+        self.by_name: dict[str, list[int]] = {}
+        for i, d in enumerate(data):
+            for t in d.type:
+                self.by_type.setdefault(t, []).append(i)
+            self.by_name.setdefault(d.name, []).append(i)
+
+    def valid_for(self, data: list[Component]) -> bool:
+        return (data is self.data
+                and len(data) == self.size
+                and self.generation == _generation)
+
+    def any_type(self, *t: str) -> list[int]:
+        return sorted({i for _t in t for i in self.by_type.get(_t, ())})
+
+
+class _HasDataWithTypes(ABC):
+    """A container of components.
+
+    Lookups by type and name go through an index of the subcomponents,
+    built on first use and rebuilt whenever it becomes stale.  The
+    subcomponents are kept in a `ComponentList`, so changes made in
+    place are detected as well as changes to the subcomponents.
+
+    Subclasses must have `_index` and `_digest_at` slots.
+    """
+
+    __slots__ = ()
+    _index: _Index | None
+    _digest: bytes | None
+    # The state of the data the digest was computed from
+    _digest_at: tuple[int, int, int] | None
+
     @abstractmethod
     def _get_data(self) -> list[Component]:
         ...
 
-    def _types(self, function: Callable[[set, set], set]) -> set[str]:
-        return reduce(function, (a.type for a in self._get_data()))
+    def _indexed(self) -> _Index:
+        data = self._get_data()
+        if self._index is None or not self._index.valid_for(data):
+            self._index = _Index(data)
+        return self._index
+
+    def reindex(self):
+        """Discard the index and hash of the subcomponents."""
+        self._index = None
+        self._digest = None
+
+    def _digest_of(self, *header: bytes) -> bytes:
+        data = self._get_data()
+        state = (_revision, id(data), len(data))
+        if self._digest is None or self._digest_at != state:
+            digest = sha256(usedforsecurity=False)
+            for h in header:
+                digest.update(h)
+            for d in data:
+                digest.update(d.digest())
+            self._digest = digest.digest()
+            self._digest_at = state
+        return self._digest
 
     def types_one(self) -> set[str]:
         """Get the set of all types fulfilled by 1+ subcomponents.
@@ -55,7 +221,7 @@ class _HasDataWithTypes(Model, ABC):
 
         :rtype set:
         """
-        return self._types(lambda a, b: a | b)
+        return set(self._indexed().by_type)
 
     def types_all(self) -> set[str]:
         """Get the set of types fulfilled by all subcomponents.
@@ -65,7 +231,10 @@ class _HasDataWithTypes(Model, ABC):
 
         :rtype set:
         """
-        return self._types(lambda a, b: a & b)
+        index = self._indexed()
+        return {t
+                for t, positions in index.by_type.items()
+                if len(positions) == index.size}
 
     def types_count(self) -> dict[str, int]:
         """Get the map of types and their subcomponent count.
@@ -75,57 +244,174 @@ class _HasDataWithTypes(Model, ABC):
 
         :rtype dict[str, int]:
         """
-        ret = {}
-        for att in self._get_data():
-            for t in att.type:
-                ret[t] = ret[t] + 1 if t in ret else 1
-        return ret
+        return {t: len(p) for t, p in self._indexed().by_type.items()}
 
-    def types_get(self, *t: str) -> list[Component]:
+    def components[C: Component](self,
+                                 *t: str,
+                                 names: Iterable[str] | None = None,
+                                 kind: type[C] | None = None,
+                                 ) -> list[C]:
         """Get the list of subcomponents fulfilling all types.
 
+        :param names: If present, only subcomponents with one of these
+        names are included.
+
+        :param kind: If present, only subcomponents of this class are
+        included.
+
         :rtype list[Component]:
         """
+        index = self._indexed()
+        if names is not None:
+            positions = sorted({i
+                                for n in set(names)
+                                for i in index.by_name.get(n, ())})
+        elif len(t) > 0:
+            positions = min((index.by_type.get(_t, []) for _t in t),
+                            key=len)
+        else:
+            positions = range(index.size)
+        types = set(t)
         return [d
-                for d in self._get_data()
-                if all(d.type_is(_t) for _t in t)]
+                for d in (index.data[i] for i in positions)
+                if types <= d.type
+                and (kind is None or isinstance(d, kind))]
+
+    def types_get(self, *t: str) -> list[Component]:
+        """Get the list of subcomponents fulfilling all types.
+
+        :rtype list[Component]:
+        """
+        return self.components(*t)
 
     def types_search(self, *t: str) -> list[Component]:
         """Get the list of subcomponents fulfilling any type.
 
         :rtype list[Component]:
         """
-        return [d
-                for d in self._get_data()
-                if any(d.type_is(_t) for _t in t)]
+        index = self._indexed()
+        return [index.data[i] for i in index.any_type(*t)]
 
     def types_remove(self, *t: str) -> list[Component]:
         """Get the list of subcomponents not fulfilling all types.
 
         :rtype list[Component]:
         """
-        return [d
-                for d in self._get_data()
-                if all(not d.type_is(_t) for _t in t)]
+        index = self._indexed()
+        excluded = set(index.any_type(*t))
+        return [d for i, d in enumerate(index.data) if i not in excluded]
 
     def types_prune(self, *t: str) -> list[Component]:
         """Get the list of subcomponents not fulfilling any type.
 
         :rtype list[Component]:
         """
-        return [d
-                for d in self._get_data()
-                if any(not d.type_is(_t) for _t in t)]
+        if len(t) == 0:
+            return []
+        included = {id(d) for d in self.components(*t)}
+        return [d for d in self._get_data() if id(d) not in included]
+
+
+class Component(_HasType, ABC):
+    """Base class for the components of a Request.
+
+    Components are plain slotted classes rather than models, as a
+    single event can hold thousands of them.  Converting from and to
+    other representations is done with `to_dict()` and `from_dict()`.
+    """
+
+    __slots__ = ('_name', '_source', '_value')
+
+    def __init__(self,
+                 name: str,
+                 t: Iterable[str],
+                 value: str | list[Component],
+                 ) -> None:
+        super().__init__(t)
+        self._name = name
+        self._value = _tracking(value)
+        self._source = None
+
+    @override
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(name={self.name!r}, '
+                f'type={set(self.type)!r}, value={self.value!r})')
+
+    @override
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Component):
+            return NotImplemented
+        return (self.__class__ is other.__class__
+                and self.name == other.name
+                and self.type == other.type
+                and self.value == other.value)
+
+    __hash__ = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, name: str):
+        self._changed(indexed=True)
+        self._name = name
+
+    @property
+    def value(self) -> str | list[Component]:
+        return self._value
+
+    @value.setter
+    def value(self, value: str | list[Component]):
+        self._changed(indexed=isinstance(value, list))
+        self._value = _tracking(value)
+
+    @abstractmethod
+    def digest(self) -> bytes:
+        """Get the hash of the component's contents.
+
+        The hash is cached until the component changes.
+        """
+        ...
+
+    @property
+    def source(self) -> Any:  # noqa: ANN401
+        """The object this component was transformed from, if known.
 
+        Transformers can record it with `with_source()`, so they can
+        write values back without searching for them.
+        """
+        return self._source
 
-class Component(_HasType):
-    name: str
-    value: str | list[Component]
+    def with_source(self, source: Any) -> Self:  # noqa: ANN401
+        """Record the object this component was transformed from."""
+        self._source = source
+        return self
 
 
 class Attribute(Component):
-    type: set[str] = {DEFAULT_ATTRIBUTE_TYPE}  # noqa: RUF012
-    value: str = ''
+    __slots__ = ()
+    value: str
+
+    def __init__(self,
+                 *,
+                 name: str,
+                 type: Iterable[str] = (DEFAULT_ATTRIBUTE_TYPE,),  # noqa: A002
+                 value: str = '',
+                 ) -> None:
+        super().__init__(name, type, value)
+
+    @override
+    def digest(self) -> bytes:
+        if self._digest is None:
+            self._digest = sha256(
+                b'A'
+                + _encode(self.name)
+                + _encode_types(self.type)
+                + _encode(str(self.value)),
+                usedforsecurity=False,
+            ).digest()
+        return self._digest
 
     @classmethod
     def to_dict(cls, att: Attribute) -> dict:
@@ -156,9 +442,25 @@ class Attribute(Component):
 
 
 class Object(Component, _HasDataWithTypes):
-    type: set[str] = {DEFAULT_OBJECT_TYPE}  # noqa: RUF012
+    __slots__ = ('_digest_at', '_index')
     value: list[Component]
 
+    def __init__(self,
+                 *,
+                 name: str,
+                 type: Iterable[str] = (DEFAULT_OBJECT_TYPE,),  # noqa: A002
+                 value: list[Component],
+                 ) -> None:
+        super().__init__(name, type, value)
+        self._index = None
+        self._digest_at = None
+
+    @override
+    def digest(self) -> bytes:
+        return self._digest_of(b'O',
+                               _encode(self.name),
+                               _encode_types(self.type))
+
     @classmethod
     def to_dict(cls, obj: Object) -> dict:
         value = []
@@ -210,7 +512,39 @@ class Object(Component, _HasDataWithTypes):
 
 
 class Request(_HasType, _HasDataWithTypes):
-    data: list[Component] = []  # noqa: RUF012
+    __slots__ = ('_data', '_digest_at', '_index')
+
+    def __init__(self,
+                 *,
+                 type: Iterable[str] = (),  # noqa: A002
+                 data: list[Component] | None = None,
+                 ) -> None:
+        super().__init__(type)
+        self._index = None
+        self._digest_at = None
+        self.data = data if data is not None else []
+
+    @override
+    def __repr__(self) -> str:
+        return f'Request(type={set(self.type)!r}, data={self.data!r})'
+
+    @override
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Request):
+            return NotImplemented
+        return self.type == other.type and self.data == other.data
+
+    __hash__ = None
+
+    @property
+    def data(self) -> list[Component]:
+        """The components of the Request."""
+        return self._data
+
+    @data.setter
+    def data(self, data: list[Component]):
+        self._changed(indexed=True)
+        self._data = _tracking(data)
 
     @classmethod
     def to_dict(cls, req: Request) -> dict:
@@ -279,9 +613,108 @@ class Request(_HasType, _HasDataWithTypes):
         """
         return all(isinstance(d, Attribute) for d in self.data)
 
+    def digest(self) -> bytes:
+        """Get the hash of the Request's contents.
+
+        Every component caches its own hash, so after a change only
+        the changed components are hashed again, and their containers
+        combine the hashes of their components.
+        """
+        return self._digest_of(b'R', _encode_types(self.type))
+
     def to_hash(self) -> str:
-        hash_string = dumps(
-                Request.to_dict(self),
-                sort_keys=True,
-            ).encode('utf-8')
-        return sha256(hash_string, usedforsecurity=False).hexdigest()
+        """Get the hash of the Request's contents, as a string."""
+        return self.digest().hex()
+
+
+@lru_cache(maxsize=TYPE_CACHE_SIZE)
+def _sorted_types(t: frozenset[str]) -> tuple[str, ...]:
+    return tuple(sorted(t))
+
+
+def _decode_types(t: list[str]) -> frozenset[str]:
+    return _decoded_types(tuple(t))
+
+
+# Type lists as stored, mapped to their shared type sets, so decoding
+# doesn't build a new set for every component
+@lru_cache(maxsize=TYPE_CACHE_SIZE)
+def _decoded_types(t: tuple[str, ...]) -> frozenset[str]:
+    return intern_types(t)
+
+
+def _encode_component(c: Component) -> dict:
+    if isinstance(c, Attribute):
+        return {
+            FIELD_MODEL_TYPE: FIELD_TYPE_ATT,
+            'name': c.name,
+            'type': list(_sorted_types(c.type)),
+            'value': c.value,
+        }
+    if isinstance(c, Object):
+        return {
+            FIELD_MODEL_TYPE: FIELD_TYPE_OBJ,
+            'name': c.name,
+            'type': list(_sorted_types(c.type)),
+            'value': [_encode_component(v) for v in c.value],
+        }
+    msg = 'Not an Object or Attribute'
+    raise ValueError(msg)
+
+
+def _decode_component(c: dict) -> Component:
+    kind = c[FIELD_MODEL_TYPE]
+    if kind == FIELD_TYPE_ATT:
+        return Attribute(name=c['name'],
+                         type=_decode_types(c['type']),
+                         value=c['value'])
+    if kind == FIELD_TYPE_OBJ:
+        return Object(name=c['name'],
+                      type=_decode_types(c['type']),
+                      value=[_decode_component(v) for v in c['value']])
+    msg = 'Not an Object or Attribute'
+    raise ValueError(msg)
+
+
+def _decode_request(r: dict) -> Request:
+    if r[FIELD_MODEL_TYPE] != FIELD_TYPE_REQ:
+        msg = 'Not a Request'
+        raise ValueError(msg)
+    return Request(type=_decode_types(r['type']),
+                   data=[_decode_component(d) for d in r['data']])
+
+
+def encode_request(request: Request) -> dict:
+    """Convert a Request into a dict.
+
+    The dict is the same as the one from `Request.to_dict()`, but the
+    sorted types of each type set are only computed once.
+    """
+    return {
+        FIELD_MODEL_TYPE: FIELD_TYPE_REQ,
+        'type': list(_sorted_types(request.type)),
+        'data': [_encode_component(d) for d in request.data],
+    }
+
+
+def encode_requests(requests: Iterable[Request]) -> list[dict]:
+    """Convert many Requests into dicts."""
+    return [encode_request(r) for r in requests]
+
+
+def decode_requests(documents: Iterable[dict]) -> list[Request]:
+    """Convert many dicts into Requests.
+
+    Meant for reading back what `encode_requests()` wrote, such as the
+    contents of the context database: documents are checked only as
+    much as needed to build the Requests, and each distinct list of
+    types is only converted once for all of them.
+
+    Raises `ValueError` if a document isn't a valid Request.
+    """
+    try:
+        return [_decode_request(d) for d in documents]
+    except (KeyError, TypeError) as e:
+        log.error('Unable to decode Request dict: %s', e)
+        msg = 'Unable to validate Request'
+        raise ValueError(msg) from e
@@ -7,7 +7,11 @@ from sanic import Blueprint, Sanic
 
 from anonymizer import bg_anonymizer
 from anonymizer.debug import bg_debug
-from anonymizer.tasks.initialization import initialize_server, shutdown_server
+from anonymizer.tasks.initialization import (
+    initialize_server,
+    shutdown_server,
+    start_background_tasks,
+)
 
 
 def anonymizer() -> Sanic:
@@ -15,5 +19,6 @@ def anonymizer() -> Sanic:
     bp_main = Blueprint.group(bg_debug, bg_anonymizer, url_prefix='/api')
     app.blueprint(bp_main)
     app.before_server_start(initialize_server)
+    app.after_server_start(start_background_tasks)
     app.before_server_stop(shutdown_server)
     return app
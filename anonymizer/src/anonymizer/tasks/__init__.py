@@ -11,7 +11,7 @@ from uuid import uuid4
 from sanic import Sanic
 from typing import override
 
-from anonymizer.util import log
+from anonymizer.util import Registry, log
 
 
 class Task(ABC):
@@ -122,3 +122,65 @@ class PeriodicTask(Task):
                 log.warning('%s: Task cancelled', self.name)
                 await self.on_cancel()
                 raise e
+
+
+def _running(app: Sanic) -> dict[str, asyncio.Task]:
+    running = getattr(app.ctx, 'background_tasks', None)
+    if running is None:
+        running = app.ctx.background_tasks = {}
+    return running
+
+
+def start_task(app: Sanic, task: Task) -> bool:
+    """Start a task in the background.
+
+    Tasks are started on the running loop instead of through Sanic's
+    `add_task()`, which refuses to name tasks when the app isn't run
+    by its own server (as in tests).  Their handles are kept in
+    `app.ctx.background_tasks`, keyed by their identifier.
+
+    Returns False, without starting it, if the task is periodic and
+    already running.
+    """
+    running = _running(app)
+    for identifier, handle in list(running.items()):
+        if handle.done():
+            del running[identifier]
+    if isinstance(task, PeriodicTask) and task.identifier in running:
+        log.error('Attempted to create duplicate periodic task')
+        log.debug('Task name: %s', task.name)
+        return False
+    sanic_task = task()
+    running[sanic_task['name']] = asyncio.get_running_loop().create_task(
+        sanic_task['task'],
+        name=sanic_task['name'],
+    )
+    return True
+
+
+async def stop_task(app: Sanic, identifier: str) -> bool:
+    """Cancel a task started by `start_task()` and wait for it.
+
+    Returns False if no task with this identifier is running.
+    """
+    handle = _running(app).pop(identifier, None)
+    if handle is None:
+        return False
+    handle.cancel()
+    await asyncio.gather(handle, return_exceptions=True)
+    return True
+
+
+async def stop_all_tasks(app: Sanic):
+    """Cancel the tasks started by `start_task()` and await them."""
+    running = _running(app)
+    if len(running) == 0:
+        return
+    log.info('Stopping %s background tasks', len(running))
+    for handle in running.values():
+        handle.cancel()
+    await asyncio.gather(*running.values(), return_exceptions=True)
+    running.clear()
+
+
+registry = Registry(Task, 'anonymizer.tasks')
@@ -5,29 +5,80 @@
 
 from sanic import Sanic
 
-from anonymizer.clients import Client, auth, context, valkey
+from anonymizer import tasks, transformers
+from anonymizer.clients import (
+    Client,
+    SharedSession,
+    arxlet,
+    auth,
+    context,
+    flaskdp,
+    valkey,
+)
 from anonymizer.config import AuthProvider, ContextProvider, config, log
+from anonymizer.execution import jobs
+from anonymizer.execution.engine import (
+    ExecutionEngine,
+    load_plan,
+    wait_for_background_runs,
+)
+from anonymizer.tasks.mqtt import MqttIngest
+from anonymizer.tasks.pipeline import ReloadPipeline
+from anonymizer.tasks.queue import QueueWorker
 
 
 async def initialize_server(app: Sanic):
     """Initialize essential Anonymizer services."""
     log.info('Initializing server')
     try:
+        await _initialize_http_sessions(app)
         await _initialize_auth_service(app)
         await _initialize_context_service(app)
         await _initialize_valkey_service(app)
+        _initialize_coalescers(app)
+        _initialize_registries()
+        _initialize_pipeline(app)
     except ValueError as e:
         log.critical('Service initialization failed, unable to continue')
         log.critical('Reason: %s', e.args[0])
         app.stop()
 
 
+async def _initialize_http_sessions(app: Sanic):
+    log.info('Initializing HTTP connection pools')
+    sessions = {
+        'auth_session': (config.auth.keycloak.connection
+                         if config.auth.provider == AuthProvider.KEYCLOAK
+                         and config.auth.keycloak is not None
+                         else None),
+        'arxlet_session': (config.services.arxlet.connection
+                           if config.services.arxlet is not None
+                           else None),
+        'flaskdp_session': (config.services.flaskdp.connection
+                            if config.services.flaskdp is not None
+                            else None),
+    }
+    for name, connection_settings in sessions.items():
+        # The server can be initialized again, close previous pools
+        previous = getattr(app.ctx, name, None)
+        if isinstance(previous, SharedSession) and previous.initialized:
+            await previous.__aexit__(None, None, None)
+        if connection_settings is None:
+            setattr(app.ctx, name, None)
+            continue
+        session = SharedSession(connection_settings)
+        await session.__aenter__()
+        setattr(app.ctx, name, session)
+
+
 async def _initialize_auth_service(app: Sanic):
     log.info('Initializing auth service')
     match config.auth.provider:
         case AuthProvider.KEYCLOAK:
             log.info('Auth provider is Keycloak')
-            app.ctx.auth = await auth.create_keycloak_client()
+            app.ctx.auth = await auth.create_keycloak_client(
+                app.ctx.auth_session,
+            )
         case AuthProvider.NONE:
             log.warning('No auth provider specified')
             app.ctx.auth = auth.NoAuthClient()
@@ -62,8 +113,59 @@ async def _initialize_valkey_service(app: Sanic):
     app.ctx.valkey = client
 
 
+def _initialize_coalescers(app: Sanic):
+    app.ctx.arxlet_coalescer = None
+    arxlet_settings = config.services.arxlet
+    if arxlet_settings is not None and arxlet_settings.coalesce is not None:
+        log.info('Coalescing ARXlet requests')
+        app.ctx.arxlet_coalescer = arxlet.ARXletCoalescer(
+            arxlet_settings.coalesce.window_ms / 1000,
+            arxlet_settings.coalesce.max_rows,
+            app.ctx.arxlet_session,
+        )
+    app.ctx.flaskdp_coalescer = None
+    flaskdp_settings = config.services.flaskdp
+    if (flaskdp_settings is not None
+            and flaskdp_settings.coalesce is not None):
+        log.info('Coalescing FlaskDP requests')
+        app.ctx.flaskdp_coalescer = flaskdp.FlaskDPCoalescer(
+            flaskdp_settings.coalesce.window_ms / 1000,
+            flaskdp_settings.coalesce.max_rows,
+            app.ctx.flaskdp_session,
+        )
+
+
+def _initialize_registries():
+    log.info('Registering jobs, transformers and tasks')
+    jobs.registry.populate()
+    transformers.registry.populate()
+    tasks.registry.populate()
+
+
+def _initialize_pipeline(app: Sanic):
+    log.info('Compiling pipeline')
+    app.ctx.engine = ExecutionEngine(load_plan(config.pipeline.file))
+
+
+async def start_background_tasks(app: Sanic):  # noqa: RUF029
+    """Start the Anonymizer's own background tasks."""
+    if config.pipeline.reload_interval > 0:
+        log.info('Starting pipeline hot reloading')
+        tasks.start_task(app, ReloadPipeline(app))
+    if (config.services.mqtt is not None
+            and config.services.mqtt.ingest is not None):
+        log.info('Starting MQTT ingestion')
+        tasks.start_task(app, MqttIngest(app))
+    if config.queue.workers > 0:
+        log.info('Starting %s job queue workers', config.queue.workers)
+        for i in range(config.queue.workers):
+            tasks.start_task(app, QueueWorker(app, i))
+
+
 async def shutdown_server(app: Sanic):
     """Shutdown Anonymizer services."""
+    await tasks.stop_all_tasks(app)
+    await wait_for_background_runs()
     log.info('Closing service connections')
     for name, val in vars(app.ctx).items():
         if isinstance(val, Client):
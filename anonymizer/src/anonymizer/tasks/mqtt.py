@@ -0,0 +1,142 @@
+# Copyright (C) 2025 Ekam Puri Nieto (UMU), Antonio Skarmeta Gomez
+# (UMU), Jorge Bernal Bernabe (UMU), Juan Hernandez Acosta (UMU).
+#
+# See LICENSE file in the project root for details.
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+from traceback import format_exc
+from typing import override
+
+from sanic import Sanic
+
+from anonymizer.clients.mqtt import MQTTClient
+from anonymizer.config import MQTTIngestSettings, config, log
+from anonymizer.execution.engine import ExecutionEngine, summarize_response
+from anonymizer.tasks import PeriodicTask
+from anonymizer.validation import validator_for
+
+
+class MqttIngest(PeriodicTask):
+    """Execute the pipeline on requests received through MQTT.
+
+    Messages are consumed from `services.mqtt.ingest.input_topic`
+    through a long-lived connection, and the result of each one is
+    published to `services.mqtt.ingest.output_topic`.  Messages are
+    only acknowledged once a slot is available, and the broker can't
+    send more than `max_in_flight` unacknowledged messages, so it
+    stops delivering while `max_in_flight` messages are being
+    processed.
+
+    If the broker can't be reached, the task tries again after the
+    MQTT connection timeout.  If MQTT ingestion isn't configured, the
+    task stops right away.
+    """
+
+    def __init__(self, app: Sanic) -> None:
+        super().__init__(app,
+                         config.services.mqtt.connection.timeout
+                         if config.services.mqtt is not None
+                         else 5,
+                         skip_signals=(OSError, ConnectionError))
+
+    @property
+    def settings(self) -> MQTTIngestSettings | None:
+        """The ingestion settings, or `None` if not configured."""
+        if config.services.mqtt is None:
+            return None
+        return config.services.mqtt.ingest
+
+    @override
+    async def _skeleton(self, *args, **kwargs):
+        if self.settings is None:
+            log.warning('%s: MQTT ingestion is not configured, stopping',
+                        self.name)
+            return
+        await super()._skeleton(*args, **kwargs)
+
+    @override
+    async def on_start(self):
+        log.info('%s: Consuming from topic "%s"',
+                 self.name,
+                 self.settings.input_topic)
+
+    @override
+    async def run(self):
+        settings = self.settings
+        max_in_flight = max(settings.max_in_flight, 1)
+        slots = asyncio.Semaphore(max_in_flight)
+        queue: asyncio.Queue[bytes] = asyncio.Queue()
+        # Messages are acknowledged when the subscription callback
+        # returns, so the broker only sends up to `max_in_flight`
+        # messages waiting for a slot
+        async with MQTTClient(optimistic_acknowledgement=False,
+                              receive_maximum=max_in_flight) as client:
+            client.subscribe(settings.input_topic,
+                             self.accept(slots, queue),
+                             settings.qos)
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(max_in_flight):
+                    tg.create_task(self._consume(client, slots, queue))
+
+    def accept(self,
+               slots: asyncio.Semaphore,
+               queue: asyncio.Queue,
+               ) -> Callable[[bytes], Awaitable[None]]:
+        """Get the callback accepting the messages received.
+
+        The callback waits for one of the `slots` before adding each
+        message to the `queue`, and the slot is released once the
+        message has been processed.
+        """
+        async def callback(payload: bytes):
+            await slots.acquire()
+            queue.put_nowait(payload)
+        return callback
+
+    async def _consume(self,
+                       client: MQTTClient,
+                       slots: asyncio.Semaphore,
+                       queue: asyncio.Queue):
+        settings = self.settings
+        while True:
+            payload = await queue.get()
+            try:
+                result = await self._execute(settings, payload)
+            except Exception:
+                log.error('%s: Unable to process message', self.name)
+                log.debug(format_exc())
+                result = {'status': 500, 'result': None}
+            finally:
+                queue.task_done()
+                slots.release()
+            client.publish(settings.output_topic, result)
+
+    async def _execute(self,
+                       settings: MQTTIngestSettings,
+                       payload: bytes) -> dict:
+        validator = validator_for(settings.transformer)
+        item = validator.item(payload)
+        if item.error is not None:
+            log.error('%s: Discarding invalid message: %s',
+                      self.name,
+                      item.error)
+            return {'status': 400, 'result': None}
+        engine: ExecutionEngine = self.app.ctx.engine
+        response = await engine.run_queued(
+            self.app,
+            validator.transformer.transform(item.body),
+            item.body,
+            datetime.now().timestamp(),
+            item.document,
+        )
+        return summarize_response(response)
+
+    @override
+    async def on_skip(self):
+        log.error('%s: Lost connection to the MQTT broker', self.name)
+
+    @override
+    async def on_cancel(self):
+        return
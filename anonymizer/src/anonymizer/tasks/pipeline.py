@@ -0,0 +1,60 @@
+# Copyright (C) 2025 Ekam Puri Nieto (UMU), Antonio Skarmeta Gomez
+# (UMU), Jorge Bernal Bernabe (UMU), Juan Hernandez Acosta (UMU).
+#
+# See LICENSE file in the project root for details.
+
+from typing import override
+
+from sanic import Sanic
+
+from anonymizer.config import config, log
+from anonymizer.execution.engine import ExecutionEngine, read_plan
+from anonymizer.tasks import PeriodicTask
+
+
+class ReloadPipeline(PeriodicTask):
+    """Recompile the pipeline whenever the pipeline file changes.
+
+    The execution engine stored in `app.ctx.engine` is only replaced
+    once the new file has been compiled successfully, so requests
+    never observe a partially loaded pipeline.  Requests that are
+    already running keep using the previous engine.  If the file
+    is missing or invalid, the previous plan is kept.
+    """
+
+    def __init__(self, app: Sanic) -> None:
+        super().__init__(app,
+                         max(config.pipeline.reload_interval, 1),
+                         skip_signals=(OSError,
+                                       ValueError,
+                                       TypeError,
+                                       KeyError,
+                                       ImportError,
+                                       AttributeError))
+
+    @override
+    async def on_start(self):
+        log.info('%s: Watching pipeline file "%s"',
+                 self.name,
+                 config.pipeline.file)
+
+    @override
+    async def run(self):
+        plan = self.app.ctx.engine.plan
+        pipeline_file = config.pipeline.file
+        if pipeline_file is None:
+            return
+        if plan.source == pipeline_file and not plan.is_stale():
+            return
+        log.info('%s: Pipeline file changed, recompiling', self.name)
+        self.app.ctx.engine = ExecutionEngine(read_plan(pipeline_file))
+        log.info('%s: Pipeline reloaded', self.name)
+
+    @override
+    async def on_skip(self):
+        log.error('%s: Unable to reload pipeline, keeping previous one',
+                  self.name)
+
+    @override
+    async def on_cancel(self):
+        return
@@ -0,0 +1,121 @@
+# Copyright (C) 2025 Ekam Puri Nieto (UMU), Antonio Skarmeta Gomez
+# (UMU), Jorge Bernal Bernabe (UMU), Juan Hernandez Acosta (UMU).
+#
+# See LICENSE file in the project root for details.
+
+from traceback import format_exc
+from typing import TYPE_CHECKING, override
+
+from sanic import Sanic
+from valkey.exceptions import (
+    ConnectionError as ValkeyConnectionError,
+    TimeoutError as ValkeyTimeoutError,
+)
+
+from anonymizer.clients.mqtt import MQTTClient
+from anonymizer.config import config, log
+from anonymizer.execution.engine import summarize_response
+from anonymizer.tasks import PeriodicTask
+from anonymizer.util import UnknownTypeError
+from anonymizer.validation import validator_for
+
+if TYPE_CHECKING:
+    from anonymizer.clients.valkey import ValkeyClient
+    from anonymizer.execution.engine import ExecutionEngine
+
+
+class QueueWorker(PeriodicTask):
+    """Execute the pipeline on requests taken from the job queue.
+
+    Requests are queued by the `/anonymizer` endpoint when the client
+    asks for an asynchronous response.  Every Anonymizer process runs
+    `queue.workers` of these tasks, and the result of each request is
+    stored in Valkey under the identifier that was returned to the
+    client.  Requests the pipeline fails on get a 500 status, and the
+    worker moves on to the next one.
+    """
+
+    def __init__(self, app: Sanic, index: int = 0) -> None:
+        super().__init__(app,
+                         0,
+                         skip_signals=(ValkeyConnectionError,
+                                       ValkeyTimeoutError),
+                         skip_seconds=config.queue.poll_timeout)
+        self.index = index
+
+    @override
+    @property
+    def identifier(self) -> str:
+        return f'{self.name}-{self.index}'
+
+    @override
+    async def on_start(self):
+        log.info('%s: Waiting for queued requests', self.identifier)
+
+    @override
+    async def run(self):
+        valkey: ValkeyClient = self.app.ctx.valkey
+        job = await valkey.dequeue_job(config.queue.poll_timeout)
+        if job is None:
+            return
+        job_id = job.get('id')
+        if job_id is None:
+            log.error('%s: Discarding queued request without identifier',
+                      self.identifier)
+            return
+        ttl = config.queue.result_ttl
+        log.info('%s: Processing queued request "%s"',
+                 self.identifier,
+                 job_id)
+        await valkey.set_job(job_id, {'state': valkey.JOB_RUNNING}, ttl)
+        try:
+            result = await self._execute(job)
+        except Exception:
+            # A single request must not stop the worker, nor be left
+            # running forever
+            log.error('%s: Unable to process queued request "%s"',
+                      self.identifier,
+                      job_id)
+            log.debug(format_exc())
+            result = {'status': 500, 'result': None}
+        await valkey.set_job(job_id, {'state': valkey.JOB_DONE} | result, ttl)
+        log.info('%s: Queued request "%s" finished with status %s',
+                 self.identifier,
+                 job_id,
+                 result['status'])
+        if config.queue.notify and config.services.mqtt is not None:
+            async with MQTTClient() as client:
+                client.publish(client.topic,
+                               {'id': job_id, 'status': result['status']})
+
+    async def _execute(self, job: dict) -> dict:
+        try:
+            validator = validator_for(job['transformer'])
+        except UnknownTypeError:
+            log.error('%s: Unknown transformer type "%s"',
+                      self.identifier,
+                      job['transformer'])
+            return {'status': 400, 'result': None}
+        item = validator.item_from(job['document'])
+        if item.error is not None:
+            log.error('%s: Invalid queued request: %s',
+                      self.identifier,
+                      item.error)
+            return {'status': 400, 'result': None}
+        engine: ExecutionEngine = self.app.ctx.engine
+        response = await engine.run_queued(
+            self.app,
+            validator.transformer.transform(item.body),
+            item.body,
+            job['timestamp'],
+            item.document,
+        )
+        return summarize_response(response)
+
+    @override
+    async def on_skip(self):
+        log.error('%s: Unable to reach the job queue', self.identifier)
+
+    @override
+    async def on_cancel(self):
+        return
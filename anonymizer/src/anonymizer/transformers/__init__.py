@@ -9,10 +9,9 @@ from abc import ABC, abstractmethod
 from types import NoneType
 from typing import override
 
-from anonymizer.config import log
 from anonymizer.models.base import Model
 from anonymizer.models.data_model import Request
-from anonymizer.util import import_from_str
+from anonymizer.util import Registry
 
 RequestBody = Model | dict | list | None
 
@@ -20,14 +19,12 @@ RequestBody = Model | dict | list | None
 class Transformer[T: Model | dict | list | None](ABC):
     @classmethod
     def from_string(cls, transformer_type: str) -> Transformer:
-        transformer_class = import_from_str(Transformer,
-                                            transformer_type,
-                                            'anonymizer.transformers')
-        if transformer_class is None:
-            log.error('Class %s is not a Transformer subclass',
-                      transformer_type)
-            return NoTransformer()
-        return transformer_class()
+        """Instantiate a transformer from its type string.
+
+        Raises `anonymizer.util.UnknownTypeError` if there's no such
+        transformer class.
+        """
+        return registry.get(transformer_type)()
 
     @abstractmethod
     def get_body_type(self) -> type[T]:
@@ -94,3 +91,6 @@ class NoTransformer(Transformer[None]):
 
     def snapshot(self, *_) -> dict:
         return {}
+
+
+registry = Registry(Transformer, 'anonymizer.transformers')
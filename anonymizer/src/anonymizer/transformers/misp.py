@@ -3,6 +3,7 @@
 #
 # See LICENSE file in the project root for details.
 
+from functools import lru_cache
 from typing import override
 from uuid import uuid4
 
@@ -21,18 +22,28 @@ ATTRIBUTE_TYPES = {TYPE_ANONYMIZABLE_BY_ARXLET,
                    TYPE_ANONYMIZABLE_BY_LOCAL}
 
 
-def attribute_types(att: misp.Attribute) -> set[str]:
+def attribute_types(att: misp.Attribute) -> frozenset[str]:
+    return _attribute_types(att.object_relation)
+
+
+@lru_cache(maxsize=data_model.TYPE_CACHE_SIZE)
+def _attribute_types(object_relation: str) -> frozenset[str]:
     ret = {data_model.DEFAULT_ATTRIBUTE_TYPE}
     ret |= ATTRIBUTE_TYPES
-    ret |= {att.object_relation}
-    return ret
+    ret |= {object_relation}
+    return data_model.intern_types(ret)
 
 
-def object_types(obj: misp.Object) -> set[str]:
+def object_types(obj: misp.Object) -> frozenset[str]:
+    return _object_types(obj.name)
+
+
+@lru_cache(maxsize=data_model.TYPE_CACHE_SIZE)
+def _object_types(name: str) -> frozenset[str]:
     ret = {data_model.DEFAULT_OBJECT_TYPE}
     ret |= OBJECT_TYPES
-    ret |= {obj.name}
-    return ret
+    ret |= {name}
+    return data_model.intern_types(ret)
 
 
 def request_types(_: misp.Event) -> set[str]:
@@ -72,7 +83,7 @@ class MispTransformer(Transformer[misp.EventAnon]):
                 a = data_model.Attribute(name=generate_attribute_name(att),
                                          type=attribute_types(att),
                                          value=str(att.value))
-                atts.append(a)
+                atts.append(a.with_source(att))
             o = data_model.Object(name=generate_object_name(obj),
                                   type=object_types(obj),
                                   value=atts)
@@ -81,7 +92,7 @@ class MispTransformer(Transformer[misp.EventAnon]):
             a = data_model.Attribute(name=generate_attribute_name(att),
                                      type=attribute_types(att),
                                      value=str(att.value))
-            data.append(a)
+            data.append(a.with_source(att))
         return data_model.Request(type=request_types(event),
                                   data=data)
 
@@ -90,55 +101,66 @@ class MispTransformer(Transformer[misp.EventAnon]):
                request_body: misp.EventAnon,
                data: data_model.Request,
                ) -> bool:
-        updated = False
         event = request_body.event
+        # Every attribute of the event, along with its object
+        pending: dict[int, tuple[misp.Attribute, misp.Object | None]] = {
+            id(att): (att, None) for att in event.attributes
+        }
         for obj in event.objects:
-            # Get data
-            obj_data: data_model.Object | None = None
-            obj_types = object_types(obj)
-            for _obj in data.types_get(*obj_types):
-                if (isinstance(_obj, data_model.Object)
-                    and _obj.name == generate_object_name(obj)):
-                    obj_data = _obj
-                    break
-            if obj_data is None:
-                msg = (f'Unable to find data for object "{obj.name}" with '
-                       f'UUID "{obj.uuid}"')
-                raise ValueError(msg)
-            for att in obj.attributes:
-                # Get data
-                att_data: data_model.Attribute | None = None
-                att_types = attribute_types(att)
-                for _att in obj_data.types_get(*att_types):
-                    if (isinstance(_att, data_model.Attribute)
-                        and _att.name == generate_attribute_name(att)):
-                        att_data = _att
-                        break
-                if att_data is None:
-                    msg = ('Unable to find data for object attribute '
-                           f'"{att.object_relation}" with UUID "{att.uuid}"')
-                    raise ValueError(msg)
-                if att.value != att_data.value:
-                    updated = True
-                    att.value = att_data.value
-        for att in event.attributes:
-            # Get data
-            att_data: data_model.Attribute | None = None
-            att_types = attribute_types(att)
-            for _att in data.types_get(*att_types):
-                if (isinstance(_att, data_model.Attribute)
-                    and _att.name == generate_attribute_name(att)):
-                    att_data = _att
-                    break
-            if att_data is None:
-                msg = ('Unable to find data for attribute '
-                       f'"{att.object_relation}" with UUID "{att.uuid}"')
-                raise ValueError(msg)
+            pending.update({id(att): (att, obj) for att in obj.attributes})
+
+        # Write values back through the attributes recorded by
+        # transform(), as long as they belong to this very event
+        written = []
+        for component in data.data:
+            components = (component.value
+                          if isinstance(component, data_model.Object)
+                          else [component])
+            for att_data in components:
+                target = pending.pop(id(att_data.source), None)
+                if target is not None:
+                    written.append((target[0], att_data))
+
+        # Otherwise, look the data up by name
+        for att, obj in pending.values():
+            written.append((att, self._find_attribute(data, att, obj)))
+
+        updated = False
+        for att, att_data in written:
             if att.value != att_data.value:
                 updated = True
                 att.value = att_data.value
         return updated
 
+    def _find_attribute(self,
+                        data: data_model.Request,
+                        att: misp.Attribute,
+                        obj: misp.Object | None,
+                        ) -> data_model.Attribute:
+        container: data_model.Request | data_model.Object = data
+        if obj is not None:
+            obj_data = next(iter(data.components(
+                *object_types(obj),
+                names=[generate_object_name(obj)],
+                kind=data_model.Object,
+            )), None)
+            if obj_data is None:
+                msg = (f'Unable to find data for object "{obj.name}" with '
+                       f'UUID "{obj.uuid}"')
+                raise ValueError(msg)
+            container = obj_data
+        att_data = next(iter(container.components(
+            *attribute_types(att),
+            names=[generate_attribute_name(att)],
+            kind=data_model.Attribute,
+        )), None)
+        if att_data is None:
+            kind = 'attribute' if obj is None else 'object attribute'
+            msg = (f'Unable to find data for {kind} '
+                   f'"{att.object_relation}" with UUID "{att.uuid}"')
+            raise ValueError(msg)
+        return att_data
+
     @override
     def snapshot(self, request_body: misp.EventAnon) -> dict:
         ret = {}
@@ -8,16 +8,31 @@ from collections.abc import Awaitable, Callable
 from importlib import import_module
 from json import dumps
 from pathlib import Path
+from pkgutil import iter_modules
+from random import uniform
+from traceback import format_exc
+from types import ModuleType
 from typing import Any
 
 from anonymizer.config import config, log
 
 
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Get the seconds to wait before retrying, with full jitter.
+
+    The delay is random between zero and `base * 2 ** attempt`, and
+    never longer than `cap`, so callers failing at the same time
+    don't retry at the same time.
+    """
+    return uniform(0, min(cap, base * 2 ** min(attempt, 32)))  # noqa: S311
+
+
 async def retry(_f: Callable[[], Awaitable],
                 *,
                 until: tuple[type[Exception], ...],
                 attempts: int,
                 timeout: int,
+                base: float = 0.1,
                 on_attempt_before: Callable[[int], Awaitable] | None = None,
                 on_attempt_after: Callable[[int], Awaitable] | None = None,
                 on_timeout: Callable[[int], Awaitable] | None = None,
@@ -32,7 +47,11 @@ async def retry(_f: Callable[[], Awaitable],
 
     :param attempts: The amount of times to retry the method.
 
-    :param timeout: The amount of seconds to wait in between attempts.
+    :param timeout: The maximum amount of seconds to wait in between
+    attempts.
+
+    :param base: The amount of seconds to wait before the first retry,
+    doubled for every following one.  See `backoff()`.
 
     :on_attempt_before: Optional callable to run before each attempt.
 
@@ -57,7 +76,8 @@ async def retry(_f: Callable[[], Awaitable],
             if on_timeout is not None:
                 await on_timeout(attempt)
             attempt = attempt + 1
-            await asyncio.sleep(timeout)
+            if attempt < attempts:
+                await asyncio.sleep(backoff(attempt - 1, base, timeout))
             continue
     if on_failure is not None:
         await on_failure()
@@ -99,6 +119,73 @@ def import_from_str[T](expected_type: type[T],
         raise e
 
 
+class UnknownTypeError(ImportError):
+    """Raised when a type string doesn't match any known class."""
+
+
+class Registry[T]:
+    """Map type strings to the subclasses of a base class.
+
+    Type strings follow the format used by `import_from_str()`:
+    "Class" for classes in the base package, and "module.Class" for
+    classes in one of its modules.
+
+    The registry imports the whole base package once, so looking up a
+    class doesn't touch the import machinery.  Type strings missing
+    from the registry are unknown: they're never imported, as they
+    may come from clients, and modules added afterwards only become
+    available once the registry is populated again.
+    """
+
+    def __init__(self, base_class: type[T], base_module: str) -> None:
+        self.base_class = base_class
+        self.base_module = base_module
+        self._classes: dict[str, type[T]] = {}
+        self._populated = False
+
+    def populate(self):
+        """Register the subclasses found in the base package.
+
+        Modules that fail to import are skipped, so that a missing
+        optional dependency only makes its own classes unavailable.
+        """
+        package = import_module(self.base_module)
+        self._classes = {}
+        self._register(package, '')
+        for info in iter_modules(package.__path__):
+            name = f'{self.base_module}.{info.name}'
+            try:
+                module = import_module(name)
+            except ImportError:
+                log.error('Unable to import module "%s"', name)
+                log.debug(format_exc())
+                continue
+            self._register(module, f'{info.name}.')
+        self._populated = True
+        log.info('Registered %s %s classes',
+                 len(self._classes),
+                 self.base_class.__name__)
+
+    def _register(self, module: ModuleType, prefix: str):
+        for name, thing in vars(module).items():
+            if isinstance(thing, type) and issubclass(thing, self.base_class):
+                self._classes[prefix + name] = thing
+
+    def get(self, type_string: str) -> type[T]:
+        """Get the class a type string refers to.
+
+        Raises `UnknownTypeError` if the type string doesn't refer to
+        a subclass of the base class.
+        """
+        if not self._populated:
+            self.populate()
+        try:
+            return self._classes[type_string]
+        except KeyError:
+            msg = f'Unknown {self.base_class.__name__} type "{type_string}"'
+            raise UnknownTypeError(msg) from None
+
+
 def generate_config_schema():
     """Generate a JSON schema for the Config class."""
     path = 'config-schema.json'
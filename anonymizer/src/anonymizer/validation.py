@@ -3,18 +3,20 @@
 #
 # See LICENSE file in the project root for details.
 
-from functools import wraps
+from dataclasses import dataclass
+from functools import cache, wraps
 from inspect import isawaitable
+from json import loads
 from traceback import format_exc
 from types import NoneType
 from collections.abc import Callable
 
+from pydantic import TypeAdapter, ValidationError
 from sanic import HTTPResponse, Request, empty
-from sanic_ext import validate as sanic_validate
-from sanic_ext.exceptions import ValidationError
 
 from anonymizer.config import log
-from anonymizer.transformers import Transformer
+from anonymizer.transformers import RequestBody, Transformer
+from anonymizer.util import UnknownTypeError
 
 HEADER_TTYPE = 'Transformer-Type'
 PARAM_EXCH = 'exception_handler'
@@ -29,16 +31,82 @@ def validation_fail(reason: str) -> HTTPResponse:
     return empty(400)
 
 
+@dataclass(frozen=True)
+class BatchItem:
+    """A single item of a batch request.
+
+    If the item couldn't be parsed or validated, `error` contains the
+    reason and `body` is `None`.
+    """
+
+    document: dict | list | None
+    body: RequestBody
+    error: str | None = None
+
+
+@dataclass(frozen=True)
+class Validator:
+    """The transformer and validation class for a request body."""
+
+    transformer: Transformer | None
+    validation_class: type
+    # Only present when validating against a model class
+    adapter: TypeAdapter | None = None
+
+    def item(self, line: bytes | str) -> BatchItem:
+        """Parse and validate a single JSON document."""
+        try:
+            document = loads(line)
+        except ValueError as e:
+            return BatchItem(None, None, f'Invalid JSON: {e}')
+        return self.item_from(document)
+
+    def item_from(self, document: dict | list | None) -> BatchItem:
+        """Validate a single parsed JSON document."""
+        if self.validation_class is NoneType:
+            return BatchItem(document, None)
+        if self.adapter is None:
+            if not isinstance(document, self.validation_class):
+                name = self.validation_class.__name__
+                return BatchItem(document, None, f'Item is not a {name}')
+            return BatchItem(document, document)
+        try:
+            return BatchItem(document, self.adapter.validate_python(document))
+        except ValidationError as e:
+            return BatchItem(document, None, str(e))
+
+
+def _compile(transformer: Transformer | None,
+             validation_class: type) -> Validator:
+    adapter = None
+    if validation_class not in {NoneType, dict, list}:
+        adapter = TypeAdapter(validation_class)
+    return Validator(transformer, validation_class, adapter)
+
+
+@cache
+def validator_for(transformer_type: str) -> Validator:
+    """Compile the validator for a transformer type.
+
+    Validators are compiled once per transformer type and reused by
+    every request afterwards.
+
+    Raises `UnknownTypeError` if there's no such transformer.
+    """
+    transformer = Transformer.from_string(transformer_type)
+    return _compile(transformer, transformer.get_body_type())
+
+
 def validate(*_args, from_transformer: bool = True, **_kwargs):  # noqa: ANN201
     """Validate a web request.
 
-    Wraps over Sanic's validation decorator by providing exception
-    handling and enabling dynamic data validation according to the
-    transformer class used.
+    Provides exception handling and enables dynamic data validation
+    according to the transformer class used.
 
-    Any additional parameters are passed to Sanic's validator
-    decorator, with the exception of 'form' and 'query' as this
-    validator is strictly designed to only work with JSON requests.
+    Request bodies are validated with Pydantic `TypeAdapter`s,
+    compiled once per validation class.  This validator is strictly
+    designed to only work with JSON requests, so parameters other
+    than 'json' are ignored.
 
     :param from_transformer: If True, the request HTTP headers will be
     inspected to determine the transformer and validation classes to
@@ -52,19 +120,14 @@ def validate(*_args, from_transformer: bool = True, **_kwargs):  # noqa: ANN201
     # Extract exception handler if it exists
     exception_handler = _kwargs.get(PARAM_EXCH)
 
-    # Remove our arguments so Sanic doesn't complain.  Also remove
-    # other validation class parameters that aren't the JSON body.
-    to_remove = [PARAM_EXCH, PARAM_FROM_TRANSFORMER, 'form', 'query']
-    _kwargs = {key: value
-               for key, value in _kwargs.items()
-               if key not in to_remove}
+    # Without a transformer, the validation class is known beforehand
+    static_validator = None
+    if not from_transformer and PARAM_JSON in _kwargs:
+        static_validator = _compile(None, _kwargs[PARAM_JSON])
 
     def decorator(f: Callable):  # noqa: ANN202
         @wraps(f)
         async def decorated_function(request: Request, *args, **kwargs):  # noqa: ANN202
-            validation_class = NoneType
-            transformer = None
-
             # Utility function
             async def execute_not_wrapped(body: dict | None):  # noqa: ANN202
                 # Execute the (not) wrapped function like normal
@@ -79,13 +142,13 @@ def validate(*_args, from_transformer: bool = True, **_kwargs):  # noqa: ANN201
                 # class type for validation and the empty transformer
                 # for an empty Request value
                 log.debug('Validating according to supplied parameters')
-                if PARAM_JSON not in _kwargs:
+                if static_validator is None:
                     # If no validation class is specified for some
                     # reason, skip the validation process (we can't
                     # infer anything)
                     return validation_fail('No validation class parameters '
                                            'supplied')
-                validation_class = kwargs[PARAM_JSON]
+                validator = static_validator
             else:
                 # If PARAM_FROM_TRANSFORMER is true, we will validate
                 # according to what the transformer requires
@@ -97,12 +160,14 @@ def validate(*_args, from_transformer: bool = True, **_kwargs):  # noqa: ANN201
                 log.debug('HTTP header solicits transformer "%s"',
                           transformer_type)
                 try:
-                    transformer = Transformer.from_string(transformer_type)
-                except (ImportError, ModuleNotFoundError):
-                    return validation_fail('Unable to import transformer')
-                validation_class: type = transformer.get_body_type()
+                    validator = validator_for(transformer_type)
+                except UnknownTypeError:
+                    return validation_fail('Unknown transformer type '
+                                           f'"{transformer_type}"')
 
             # Final results
+            transformer = validator.transformer
+            validation_class = validator.validation_class
             tname = transformer.__class__.__qualname__
             vname = validation_class.__name__
             log.info('Transformer: %s', tname)
@@ -131,35 +196,103 @@ def validate(*_args, from_transformer: bool = True, **_kwargs):  # noqa: ANN201
                     return validation_fail('Request body is not a JSON list')
                 return await execute_not_wrapped(request.json)
 
-            # Otherwise, validate using Sanic.
-            # Insert the validation class into kwargs, overwrite any
-            # preexisting values
-            _kwargs[PARAM_JSON] = validation_class
+            # Otherwise, validate using the compiled type adapter
+            try:
+                body = validator.adapter.validate_json(request.body)
+            except ValidationError as e:
+                if exception_handler is not None:
+                    return exception_handler(e)
+                log.error('Request body does not conform to validation '
+                          'class')
+                log.error('Unable to validate request')
+                log.debug(format_exc())
+                return empty(400)
+            return await execute_not_wrapped(body)
+        return decorated_function
+    return decorator
 
-            log.debug('Sanic decorator args: %s', _args)
-            log.debug('Sanic decorator kwargs: %s', _kwargs)
 
-            # Get the decorator from the decorator factory
-            sanic_decorator = sanic_validate(*_args, **_kwargs)
+def _validator_from_headers(request: Request) -> Validator | HTTPResponse:
+    """Get the validator solicited by the request's HTTP headers.
 
-            # Wrap the function we're wrapping with the decorator
-            validator = sanic_decorator(f)
+    :return: The validator, or an error response if there's none.
+    """
+    if HEADER_TTYPE not in request.headers:
+        return validation_fail(f'Unable to locate "{HEADER_TTYPE}" HTTP '
+                               'header')
+    transformer_type = request.headers[HEADER_TTYPE]
+    try:
+        validator = validator_for(transformer_type)
+    except UnknownTypeError:
+        return validation_fail('Unknown transformer type '
+                               f'"{transformer_type}"')
+    request.ctx.transformer = validator.transformer
+    return validator
 
-            try:
-                # Execute the wrapped function like normal
-                response = validator(request, *args, **kwargs)
-                if isawaitable(response):
-                    response = await response
-                return response
-            except Exception as e:
-                if exception_handler is not None:
-                    return exception_handler(e)
-                if isinstance(e, ValidationError):
-                    log.error('Request body does not conform to validation '
-                              'class')
-                    log.error('Unable to validate request')
-                    log.debug(format_exc())
-                    return empty(400)
-                raise e
+
+def validate_batch(*, exception_handler: Callable | None = None):  # noqa: ANN201
+    """Validate a web request containing many request bodies.
+
+    The request body must be either a JSON list or newline-delimited
+    JSON, and the transformer is determined by the HTTP headers like
+    in `validate()`.  Every item is validated on its own, and the
+    wrapped function receives a list of `BatchItem`s, so invalid
+    items don't invalidate the whole batch.
+
+    :param exception_handler: A custom exception handling function to
+    be used when the request body can't be parsed.
+    """
+    def decorator(f: Callable):  # noqa: ANN202
+        @wraps(f)
+        async def decorated_function(request: Request, *args, **kwargs):  # noqa: ANN202
+            log.info('Validating batch request')
+            validator = _validator_from_headers(request)
+            if isinstance(validator, HTTPResponse):
+                return validator
+
+            body = request.body.lstrip()
+            if body.startswith(b'['):
+                try:
+                    documents = loads(body)
+                except ValueError as e:
+                    if exception_handler is not None:
+                        return exception_handler(e)
+                    return validation_fail('Request body is not a JSON '
+                                           'list')
+                items = [validator.item_from(d) for d in documents]
+            else:
+                items = [validator.item(line)
+                         for line in body.splitlines()
+                         if line.strip()]
+            log.info('Batch contains %s items, %s invalid',
+                     len(items),
+                     sum(1 for i in items if i.error is not None))
+
+            response = f(request, items, *args, **kwargs)
+            if isawaitable(response):
+                response = await response
+            return response
+        return decorated_function
+    return decorator
+
+
+def validate_stream():  # noqa: ANN201
+    """Prepare the validation of a streamed web request.
+
+    The transformer is determined by the HTTP headers like in
+    `validate()`.  As the body hasn't been received yet, the wrapped
+    function receives the `Validator` to use on each item instead.
+    """
+    def decorator(f: Callable):  # noqa: ANN202
+        @wraps(f)
+        async def decorated_function(request: Request, *args, **kwargs):  # noqa: ANN202
+            log.info('Validating streamed request')
+            validator = _validator_from_headers(request)
+            if isinstance(validator, HTTPResponse):
+                return validator
+            response = f(request, validator, *args, **kwargs)
+            if isawaitable(response):
+                response = await response
+            return response
         return decorated_function
     return decorator
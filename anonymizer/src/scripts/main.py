@@ -8,6 +8,8 @@ import argparse
 from pathlib import Path
 import shutil
 import subprocess  # noqa: S404
+from json import dumps, loads
+from timeit import timeit
 
 
 # Extra ruff arguments when checking inside a CI/CD pipeline.
@@ -165,6 +167,102 @@ def lint():
     _run('ruff check', *options)
 
 
+def benchmark():
+    """Benchmark script."""
+    parser = argparse.ArgumentParser(
+        prog='uv run benchmark',
+        description='Anonymizer context (de)serialization benchmark',
+    )
+    parser.add_argument('-n', '--documents',
+                        type=int,
+                        default=1000,
+                        help='Amount of Requests to (de)serialize')
+    parser.add_argument('-s', '--size',
+                        type=int,
+                        default=20,
+                        help='Amount of Objects per Request')
+    parser.add_argument('-r', '--repeat',
+                        type=int,
+                        default=5,
+                        help='Amount of times to repeat each measurement')
+    args = parser.parse_args()
+
+    # Importing the data model loads the configuration, which the
+    # other scripts don't need
+    from anonymizer.models.data_model import (
+        Attribute,
+        Object,
+        Request,
+        decode_requests,
+        encode_requests,
+    )
+
+    requests = [
+        Request(type={'event'}, data=[
+            Object(name='network', type={'object', 'anonymizable'}, value=[
+                Attribute(name='ip', type={'ip', 'anonymizable'},
+                          value=f'10.0.{i % 256}.{j % 256}'),
+                Attribute(name='port', type={'port'}, value=str(j)),
+                Attribute(name='domain', type={'domain'},
+                          value=f'host{j}.example.com'),
+            ])
+            for j in range(args.size)
+        ])
+        for i in range(args.documents)
+    ]
+    rows = [dumps(d) for d in encode_requests(requests)]
+    documents = [loads(r) for r in rows]
+
+    cases = {
+        'encode (to_dict)': lambda: [Request.to_dict(r) for r in requests],
+        'encode (bulk)': lambda: encode_requests(requests),
+        'decode (from_dict)': lambda: [Request.from_dict(d)
+                                       for d in documents],
+        'decode (bulk)': lambda: decode_requests(documents),
+        'decode JSON rows (from_dict)': lambda: [Request.from_dict(loads(r))
+                                                 for r in rows],
+        'decode JSON rows (bulk)': lambda: decode_requests(loads(r)
+                                                           for r in rows),
+    }
+    print(f'{args.documents} Requests with {args.size} Objects each',
+          flush=True)
+    for name, case in cases.items():
+        best = min(timeit(case, number=1) for _ in range(args.repeat))
+        print(f'{name:<30}{best * 1e6 / args.documents:>10.1f} us/doc',
+              flush=True)
+
+
+def rehash():
+    """Context database migration script."""
+    parser = argparse.ArgumentParser(
+        prog='uv run rehash',
+        description=('Store the Requests in the context database again '
+                     'under their current hash'),
+    )
+    parser.parse_args()
+
+    # Importing the clients loads the configuration, which the other
+    # scripts don't need
+    import asyncio
+
+    from anonymizer.clients.context import (
+        MongoDBContextClient,
+        MySQLContextClient,
+    )
+    from anonymizer.config import ContextProvider, config
+
+    match config.context.provider:
+        case ContextProvider.MONGODB:
+            client = MongoDBContextClient()
+        case ContextProvider.MYSQL:
+            client = MySQLContextClient()
+        case _:
+            print('No context database configured', flush=True)
+            return
+    rehashed = asyncio.run(client.rehash())
+    print(f'Rehashed {rehashed} Requests', flush=True)
+
+
 def _run(base: str, *args) -> int:
     cmd = base.split(' ')
     cmd.extend(args)
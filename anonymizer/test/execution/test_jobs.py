@@ -1,5 +1,36 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp import ClientError
+import pytest
+from pytest_mock import MockerFixture
 from sanic_testing.reusable import ReusableClient
 
+from anonymizer.clients import (
+    AiohttpClient,
+    ClientUnavailableError,
+    LoadBalancer,
+    ResponseStatusError,
+)
+from anonymizer.clients.arxlet import ARXletClient, ARXletCoalescer
+from anonymizer.clients.flaskdp import FlaskDPClient
+from anonymizer.config import BalanceSettings, ConnectionSettings
+from anonymizer.execution.exceptions import JobError
+from anonymizer.execution.jobs import DummyJob, job_class_from_string
+from anonymizer.execution.jobs.arxlet import MergePets
+from anonymizer.execution.jobs.flaskdp import (
+    TYPE_ANONYMIZABLE_BY_FLASKDP,
+    FromTechniques,
+)
+from anonymizer.execution.jobs.misp import PostEvent
+from anonymizer.models.arxlet import SCHEME_DLDIV, SCHEME_KANON
+from anonymizer.models.data_model import Attribute, Request
+from anonymizer.models.flaskdp import (
+    FlaskDPRequest,
+    FlaskDPResponse,
+    ItemResponse,
+)
+from anonymizer.util import UnknownTypeError
 from test import log_results
 
 
@@ -64,3 +95,316 @@ def test_failed_generator_job(
     assert response.json is not None
     log_results(response.json)
     assert len(response.json['result']['1']['result']) == 1
+
+
+def test_job_timeout(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+):
+    """
+    In this scenario, there is one stage with one job that takes
+    longer than its timeout.  The job should be cancelled, and its
+    "success" field should be `False`.
+    """
+    cfg_override = {
+        'pipeline.file': 'test/resources/pipelines/job_timeout.json',
+    }
+    f_sanic.put('/api/debug/config', json=cfg_override)
+
+    _, response = f_sanic.post('/api/anonymizer',
+                               headers=f_no_transformer_headers)
+    assert response.json is not None
+    log_results(response.json)
+    assert not response.json['result']['1']['result']['1']['success']
+
+
+def test_job_registry():
+    """
+    In this scenario, job classes are looked up by their type string.
+    Known job types should resolve to their classes, and unknown ones
+    should raise `UnknownTypeError`.
+    """
+    assert job_class_from_string('DummyJob') is DummyJob
+    assert job_class_from_string('misp.PostEvent') is PostEvent
+    with pytest.raises(UnknownTypeError):
+        job_class_from_string('misp.DoesNotExist')
+    with pytest.raises(UnknownTypeError):
+        job_class_from_string('DummyJobResult')
+
+
+def test_arxlet_coalescer(mocker: MockerFixture):
+    """
+    In this scenario, three requests are sent through the ARXlet
+    coalescer at the same time.  The two compatible ones should be
+    sent as a single ARXlet request, and every requester should get
+    back its own rows.
+    """
+    anonymize = mocker.patch(
+        'anonymizer.clients.arxlet.ARXletClient.anonymize',
+        side_effect=lambda _endpoint, data, _pets: [d.upper() for d in data],
+    )
+    coalescer = ARXletCoalescer(window=0.01, max_rows=100)
+    endpoint = ARXletClient.ENDPOINT_ATTRIBUTES
+
+    async def _requests() -> list[list]:
+        return await asyncio.gather(
+            coalescer.anonymize('url', endpoint, ['a', 'b'], [], ('x',)),
+            coalescer.anonymize('url', endpoint, ['c'], [], ('x',)),
+            coalescer.anonymize('url', endpoint, ['d'], [], ('y',)),
+        )
+
+    results = asyncio.run(_requests())
+    assert results == [['A', 'B'], ['C'], ['D']]
+    assert anonymize.call_count == 2
+
+
+def test_circuit_breaker(mocker: MockerFixture):
+    """
+    In this scenario, ARXlet is down and three requests are sent to
+    it one after the other.  Once enough attempts have failed, the
+    circuit breaker should open, and the remaining requests should
+    fail without reaching ARXlet.
+    """
+    mocker.patch('anonymizer.clients.backoff', return_value=0)
+    client = ARXletClient('http://arxlet-down')
+    settings = client.connection_settings
+    calls = []
+
+    async def _down():  # noqa: RUF029
+        calls.append(None)
+        raise ClientError
+
+    async def _requests() -> list[Exception]:
+        return [await client.retry(_down,
+                                   until=(ClientError,),
+                                   otherwise=lambda e: e[-1])
+                for _ in range(3)]
+
+    results = asyncio.run(_requests())
+    assert len(calls) == settings.breaker_threshold
+    assert isinstance(results[-1], ClientUnavailableError)
+
+
+def test_load_balancer():
+    """
+    In this scenario, requests are spread across two replicas, one of
+    which keeps failing.  Once it has failed enough times, it should
+    be left out of rotation, and every request should go to the
+    other one.
+    """
+    balancer = LoadBalancer(['http://a', 'http://b'], BalanceSettings())
+    failures = 0
+
+    async def _request() -> str:
+        nonlocal failures
+        try:
+            async with balancer.endpoint() as url:
+                if url == 'http://a':
+                    raise ClientError
+                return url
+        except ClientError:
+            failures = failures + 1
+            return 'failed'
+
+    async def _requests() -> list[str]:
+        return [await _request() for _ in range(50)]
+
+    results = asyncio.run(_requests())
+    assert failures == BalanceSettings().eject_failures
+    assert results[-10:] == ['http://b'] * 10
+
+
+def test_load_balancer_error_statuses(mocker: MockerFixture):
+    """
+    In this scenario, requests are spread across three replicas: one
+    answers every request with a 404 status, another one with a 503
+    status.  Client errors are the request's fault, so the first
+    replica should stay in rotation, while the second one should be
+    left out of it.
+    """
+    settings = BalanceSettings(slow_factor=float('inf'))
+    balancer = LoadBalancer(['http://a', 'http://b', 'http://c'], settings)
+    client = AiohttpClient(ConnectionSettings(), balancer=balancer)
+    statuses = {'http://a': 404, 'http://b': 503}
+
+    async def _post(base: str) -> str:  # noqa: RUF029
+        if base in statuses:
+            raise ResponseStatusError(mocker.Mock(),
+                                      (),
+                                      status=statuses[base])
+        return base
+
+    async def _requests() -> list[str | None]:
+        results = []
+        for _ in range(50):
+            try:
+                results.append(await client.send(_post))
+            except ResponseStatusError:
+                results.append('error')
+        return results
+
+    results = asyncio.run(_requests())
+    a, b, _ = balancer.replicas
+    assert a.failures == 0
+    assert a.ejected_until == 0
+    assert b.ejected_until > 0
+    assert results.count('error') == settings.eject_failures
+    assert None in results
+
+
+def test_flaskdp_url(mocker: MockerFixture):
+    """
+    In this scenario, the FlaskDP URL has a path.  Requests should be
+    sent to the endpoint under that path.
+    """
+    post = mocker.patch('aiohttp.ClientSession.post')
+    response = post.return_value.__aenter__.return_value
+    response.status = 200
+    response.json = mocker.AsyncMock(return_value={'items': []})
+
+    async def _apply():
+        async with FlaskDPClient('http://flaskdp:8000/dp/') as client:
+            await client.apply_dp(FlaskDPRequest(items=[]))
+
+    asyncio.run(_apply())
+    assert post.call_args.args[0] == 'http://flaskdp:8000/dp/api/dp/apply'
+
+
+def test_flaskdp_single_request(mocker: MockerFixture):
+    """
+    In this scenario, two DP techniques are applied to two different
+    attributes.  Both should be sent in a single FlaskDP request, and
+    each attribute should get back its own noisy value.
+    """
+    def _apply_dp(request: FlaskDPRequest) -> FlaskDPResponse:
+        return FlaskDPResponse(items=[
+            ItemResponse(id=i.id, values=[v + 1 for v in i.values])
+            for i in request.items
+        ])
+
+    apply_dp = mocker.patch(
+        'anonymizer.clients.flaskdp.FlaskDPClient.apply_dp',
+        side_effect=_apply_dp,
+    )
+    anonymizable = {TYPE_ANONYMIZABLE_BY_FLASKDP}
+    data = Request(data=[
+        Attribute(name='a', type=anonymizable, value='1'),
+        Attribute(name='b', type=anonymizable, value='2'),
+    ])
+    env = SimpleNamespace(app=SimpleNamespace(ctx=SimpleNamespace()),
+                          data=data)
+    techniques = [
+        {'technique': technique,
+         'attributes': [name],
+         'epsilon': 1,
+         'delta': 0,
+         'sensitivity': 1}
+        for technique, name in (('laplace', 'a'), ('gaussian', 'b'))
+    ]
+    job = FromTechniques('apply_dp',
+                         env,
+                         {'techniques': techniques,
+                          'flaskdp_url': 'http://flaskdp'})
+
+    result = asyncio.run(job.run_wrapped())
+    assert result.success
+    assert apply_dp.call_count == 1
+    assert [a.value for a in data.data] == ['2.0', '3.0']
+
+
+def test_merge_pets():
+    """
+    In this scenario, four PET jobs are merged, three of which target
+    the same objects.  Those three should become a single job with a
+    single k-anonymity PET (the one with the highest k), and the
+    remaining one should be left on its own.
+    """
+    def _pet_job(job_type: str, object_type: str, **args) -> dict:
+        return {
+            'type': job_type,
+            'args': {
+                'objects': [{'type': object_type, 'values': ['ip']}],
+                'object_hierarchies': [],
+                **args,
+            },
+        }
+
+    jobs = [
+        _pet_job('arxlet.KAnonymity', 'network', k=2),
+        _pet_job('arxlet.DistinctLDiversity', 'network', sensitive='ip', l=2),
+        _pet_job('arxlet.KAnonymity', 'network', k=5),
+        _pet_job('arxlet.KAnonymity', 'file', k=3),
+    ]
+    job = MergePets('merge', args={'jobs': jobs, 'arxlet_url': 'http://a'})
+
+    result = asyncio.run(job.run_wrapped())
+    assert result.success
+    assert len(result.result) == 2
+    pets = result.result[0].args['pets']
+    assert [p.scheme for p in pets] == [SCHEME_KANON, SCHEME_DLDIV]
+    assert pets[0].metadata.k == 5
+
+
+@pytest.mark.parametrize('entry', [
+    {'type': 'arxlet.DoesNotExist', 'args': {}},
+    {'args': {}},
+])
+def test_merge_pets_invalid_type(entry: dict):
+    """
+    In this scenario, PET jobs are merged, but the second entry has an
+    unknown type or no type at all.  Merging should fail with a
+    `JobError` pointing at the entry.
+    """
+    jobs = [{'type': 'arxlet.KAnonymity', 'args': {'k': 2}}, entry]
+    job = MergePets('merge', args={})
+    with pytest.raises(JobError, match='PET job 1'):
+        asyncio.run(job.generate(jobs=jobs))
+
+
+def test_arxlet_urls(mocker: MockerFixture):
+    """
+    In this scenario, the ARXlet URL has a path.  Both attribute and
+    object requests should be sent to their endpoint under that path.
+    """
+    post = mocker.patch('aiohttp.ClientSession.post')
+    response = post.return_value.__aenter__.return_value
+    response.status = 200
+    response.json = mocker.AsyncMock(return_value=[])
+
+    async def _anonymize():
+        async with ARXletClient('http://arxlet:8080/api/') as client:
+            await client.anonymize_attributes([], [])
+            await client.anonymize_objects([], [])
+
+    asyncio.run(_anonymize())
+    assert [c.args[0] for c in post.call_args_list] == [
+        'http://arxlet:8080/api/attributes',
+        'http://arxlet:8080/api/objects',
+    ]
+
+
+def test_circuit_breaker_server_errors(mocker: MockerFixture):
+    """
+    In this scenario, ARXlet answers every request with a 503 status.
+    The responses should count as failures, so the circuit breaker
+    should open and the remaining requests should not reach ARXlet.
+    """
+    mocker.patch('anonymizer.clients.backoff', return_value=0)
+    post = mocker.patch('aiohttp.ClientSession.post')
+    response = post.return_value.__aenter__.return_value
+    response.status = 503
+
+    async def _requests() -> list[Exception]:
+        errors = []
+        async with ARXletClient('http://arxlet-unavailable') as client:
+            for _ in range(3):
+                try:
+                    await client.anonymize_attributes([], [])
+                except JobError as e:
+                    errors.append(e.__cause__)
+        return errors
+
+    errors = asyncio.run(_requests())
+    settings = ARXletClient('http://arxlet-unavailable').connection_settings
+    assert post.call_count == settings.breaker_threshold
+    assert isinstance(errors[-1], ClientUnavailableError)
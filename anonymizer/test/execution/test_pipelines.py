@@ -1,5 +1,13 @@
+import asyncio
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
 from sanic_testing.reusable import ReusableClient
 
+from anonymizer.execution.engine import read_plan
+from anonymizer.execution.pipeline import PipelineResult, compile_plan
 from test import log_results
 
 
@@ -63,3 +71,220 @@ def test_policy_optional(
     assert response.json is not None
     log_results(response.json)
     assert response.status_code == 200
+
+
+def test_plan_builds_independent_pipelines():
+    """
+    In this scenario, a pipeline file is compiled once.  Every
+    pipeline built from the compiled plan should have the same
+    structure, but share no job objects.
+    """
+    plan = read_plan(
+        Path('test/resources/pipelines/simple_pipeline_success.json'),
+    )
+    first = plan.build()
+    second = plan.build()
+    assert [s.name for s in first.stages] == ['1', 'response']
+    assert [s.name for s in second.stages] == ['1', 'response']
+    assert first.stages[0].jobs[0] is not second.stages[0].jobs[0]
+
+
+def test_plan_detects_modified_file(tmp_path: Path):
+    """
+    In this scenario, a pipeline file is compiled and then modified.
+    The plan should only be considered stale after the modification.
+    """
+    source = Path('test/resources/pipelines/simple_pipeline_success.json')
+    pipeline_file = tmp_path / 'pipeline.json'
+    pipeline_file.write_text(source.read_text())
+    plan = read_plan(pipeline_file)
+    assert not plan.is_stale()
+
+    mtime = pipeline_file.stat().st_mtime_ns + 1_000_000_000
+    os.utime(pipeline_file, ns=(mtime, mtime))
+    assert plan.is_stale()
+
+
+def test_concurrent_runs_share_no_state():
+    """
+    In this scenario, one pipeline with a generator job is executed
+    by two concurrent runs.  Each run should contain the generated
+    job's result, and the pipeline itself should remain unchanged.
+    """
+    plan = read_plan(
+        Path('test/resources/pipelines/generator_job_success.json'),
+    )
+    pipeline = plan.build()
+
+    async def _run_twice() -> list:
+        runs = [pipeline.new_run(SimpleNamespace()) for _ in range(2)]
+        for run in runs:
+            run.env.pipeline_results = run.result
+        return await asyncio.gather(
+            *(pipeline.run_wrapped(run) for run in runs),
+        )
+
+    results = asyncio.run(_run_twice())
+    for result in results:
+        assert result.success
+        assert '1-1' in result.result['1'].result
+    assert results[0] is not results[1]
+    assert len(pipeline.stages[0].jobs) == 1
+
+
+def test_dataflow_pipeline(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+):
+    """
+    In this scenario, the pipeline uses the dataflow scheduler.  Every
+    job should execute like normal, and the results should still be
+    grouped by stage.
+    """
+    cfg_override = {
+        'pipeline.file': 'test/resources/pipelines/dataflow_pipeline.json',
+    }
+    f_sanic.put('/api/debug/config', json=cfg_override)
+
+    _, response = f_sanic.post('/api/anonymizer',
+                               headers=f_no_transformer_headers)
+    assert response.json is not None
+    log_results(response.json)
+    assert response.status_code == 200
+    assert response.json['result']['1']['success']
+    assert response.json['result']['2']['success']
+    assert 'consume' in response.json['result']['2']['result']
+    assert 'independent' in response.json['result']['2']['result']
+
+
+def test_dataflow_dependencies():
+    """
+    In this scenario, the pipeline uses the dataflow scheduler.  Jobs
+    should only wait for the jobs touching the same env locations,
+    and jobs without declared dataflow should wait for every other
+    job.
+    """
+    plan = read_plan(Path('test/resources/pipelines/dataflow_pipeline.json'))
+    pipeline = plan.build()
+    jobs = {j.name: j for s in pipeline.stages for j in s.jobs}
+    deps = {j.name: {d.name for d in pipeline.dependencies[j]}
+            for j in jobs.values()}
+    assert deps['produce'] == set()
+    assert deps['consume'] == {'produce'}
+    assert deps['independent'] == set()
+    assert deps['respond-with-pipeline-results'] == {'produce',
+                                                     'consume',
+                                                     'independent'}
+
+
+def test_dataflow_conflicting_writers():
+    """
+    In this scenario, two jobs of the same stage write to the same env
+    location under the dataflow scheduler.  Building the pipeline
+    should fail if the stage is concurrent, and the second job should
+    wait for the first one if it's sequential.
+    """
+    def _definition(execution: str) -> dict:
+        return {
+            'policies': {'scheduler': 'dataflow'},
+            'stages': [{'name': '1', 'policies': {'execution': execution}}],
+            'jobs': {
+                name: {'type': 'DummyJob',
+                       'stage': '1',
+                       'args': {'message': name},
+                       'policies': {'writes': ['a']}}
+                for name in ('first', 'second')
+            },
+        }
+
+    with pytest.raises(ValueError, match='both modify'):
+        compile_plan(_definition('concurrent')).build()
+    pipeline = compile_plan(_definition('sequential')).build()
+    jobs = {j.name: j for s in pipeline.stages for j in s.jobs}
+    assert pipeline.dependencies[jobs['second']] == [jobs['first']]
+
+
+def test_early_response(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+):
+    """
+    In this scenario, the pipeline responds after its second stage.
+    The response should be sent before the third stage executes, so
+    the pipeline results should not contain it.
+    """
+    cfg_override = {
+        'pipeline.file': 'test/resources/pipelines/early_response.json',
+    }
+    f_sanic.put('/api/debug/config', json=cfg_override)
+
+    _, response = f_sanic.post('/api/anonymizer',
+                               headers=f_no_transformer_headers)
+    assert response.json is not None
+    log_results(response.json)
+    assert response.status_code == 200
+    assert response.json['result']['1']['success']
+    assert '2' not in response.json['result']
+
+
+def test_request_deadline(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+):
+    """
+    In this scenario, the client sends a request timeout shorter than
+    the pipeline's only job.  The job should be cancelled, the
+    remaining jobs should not execute, and the resulting response
+    should be `400`.
+    """
+    cfg_override = {
+        'pipeline.file': 'test/resources/pipelines/slow_pipeline.json',
+    }
+    f_sanic.put('/api/debug/config', json=cfg_override)
+
+    headers = {**f_no_transformer_headers, 'Request-Timeout': '0.1'}
+    _, response = f_sanic.post('/api/anonymizer', headers=headers)
+    assert response is not None
+    assert response.status_code == 400
+
+
+def test_fail_fast():
+    """
+    In this scenario, the pipeline fails fast and its first job fails.
+    No other job should execute, and the pipeline should be
+    unsuccessful.
+    """
+    plan = read_plan(Path('test/resources/pipelines/fail_fast.json'))
+    pipeline = plan.build()
+    run = pipeline.new_run(SimpleNamespace())
+    run.env.pipeline_results = run.result
+
+    result = asyncio.run(pipeline.run_wrapped(run))
+    assert not result.success
+    assert not result.result['1'].success
+    assert '2' not in result.result['1'].result
+    assert '2' not in result.result
+
+
+def test_cancelled_run_completes_mandatory_stages():
+    """
+    In this scenario, a run is cancelled while its first stage
+    executes.  The first stage should be cancelled and the third
+    stage skipped, but the second stage must always complete and
+    should still execute.
+    """
+    plan = read_plan(Path('test/resources/pipelines/always_complete.json'))
+    pipeline = plan.build()
+    run = pipeline.new_run(SimpleNamespace())
+    run.env.pipeline_results = run.result
+
+    async def _cancel_run() -> PipelineResult:
+        execution = asyncio.create_task(pipeline.run_wrapped(run))
+        await asyncio.sleep(0.1)
+        pipeline.cancel(run)
+        return await execution
+
+    result = asyncio.run(_cancel_run())
+    assert '1' not in result.result
+    assert result.result['2'].success
+    assert '3' not in result.result
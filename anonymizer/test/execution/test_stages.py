@@ -1,5 +1,10 @@
+import asyncio
+
+from pytest_mock import MockerFixture
 from sanic_testing.reusable import ReusableClient
 
+from anonymizer.execution.exceptions import JobError
+from anonymizer.execution.jobs import DummyJob
 from test import log_results
 
 
@@ -109,3 +114,52 @@ def test_failed_optional_generated_job_successful_stage(
     assert response.json is not None
     log_results(response.json)
     assert response.json['result']['1']['success']
+
+
+def test_concurrent_stage_runs_generated_jobs(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+        mocker: MockerFixture,
+):
+    """
+    In this scenario, there is one concurrent stage with one generator
+    job and one regular job.  The generator job should generate a
+    single job that fails.  The generator job should be optional.  The
+    stage results should contain results for all three jobs, and the
+    stage's "success" field should be `True`.  The regular job and the
+    generated one should run at the same time, so both should get
+    past a barrier only they wait on.
+    """
+    cfg_override = {
+        'pipeline.file': 'test/resources/pipelines/concurrent_stage.json',
+    }
+    f_sanic.put('/api/debug/config', json=cfg_override)
+
+    barrier: asyncio.Barrier | None = None
+    met = []
+
+    async def _run(self: DummyJob, **kwargs):
+        nonlocal barrier
+        if barrier is None:
+            barrier = asyncio.Barrier(2)
+        try:
+            async with asyncio.timeout(2):
+                await barrier.wait()
+            met.append(self.name)
+        except TimeoutError:
+            pass
+        if kwargs.get('fail'):
+            msg = f'Dummy job {self.name} failed'
+            raise JobError(msg)
+
+    mocker.patch.object(DummyJob, 'run', _run)
+
+    _, response = f_sanic.post('/api/anonymizer',
+                               headers=f_no_transformer_headers)
+    assert response.json is not None
+    log_results(response.json)
+    results = response.json['result']['1']['result']
+    assert {'1', '1-1', '2'} <= set(results)
+    assert not results['1-1']['success']
+    assert response.json['result']['1']['success']
+    assert sorted(met) == ['1-1', '2']
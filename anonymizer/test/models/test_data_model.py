@@ -0,0 +1,179 @@
+import asyncio
+from collections.abc import AsyncIterator
+
+import pytest
+from pytest_mock import MockerFixture
+
+from anonymizer.clients.context import MongoDBContextClient
+from anonymizer.models.data_model import (
+    Attribute,
+    Object,
+    Request,
+    decode_requests,
+    encode_requests,
+)
+
+
+def test_data_model_index_follows_changes():
+    """
+    In this scenario, components are looked up by type and name while
+    the request changes.  Lookups should always reflect the current
+    contents of the request, in order.
+    """
+    a = Attribute(name='ip', type={'anonymizable', 'ip'}, value='1')
+    b = Attribute(name='port', type={'port'}, value='2')
+    o = Object(name='network', type={'anonymizable'}, value=[a, b])
+    request = Request(data=[a, o, b])
+
+    assert request.types_get('anonymizable') == [a, o]
+    assert request.components(names=['port', 'ip']) == [a, b]
+    assert request.components('anonymizable', kind=Object) == [o]
+    assert o.components(names=['ip'], kind=Attribute) == [a]
+    assert request.types_count() == {'anonymizable': 2, 'ip': 1, 'port': 1}
+
+    b.type_merge('anonymizable')
+    assert request.types_get('anonymizable') == [a, o, b]
+    assert request.types_remove('port') == [a, o]
+
+    c = Attribute(name='ip', type={'ip'}, value='3')
+    request.data.append(c)
+    assert request.components(names=['ip']) == [a, c]
+    assert request.types_search('ip', 'port') == [a, b, c]
+    assert request.types_prune('anonymizable') == [c]
+
+
+def test_data_model_shares_type_sets():
+    """
+    In this scenario, many attributes are created with the same types.
+    They should all share a single set of types, and changing the
+    types of one of them shouldn't change the others.
+    """
+    attributes = [Attribute(name=str(i), type=['ip', 'anonymizable'])
+                  for i in range(100)]
+    assert all(a.type is attributes[0].type for a in attributes)
+
+    attributes[0].type_merge('port')
+    assert attributes[0].type == {'ip', 'anonymizable', 'port'}
+    assert attributes[1].type == {'ip', 'anonymizable'}
+    assert Request.from_dict(Request.to_dict(Request(data=attributes))) == (
+        Request(data=attributes)
+    )
+
+
+def test_data_model_hash_follows_changes():
+    """
+    In this scenario, two identical requests are hashed while one of
+    them changes.  Their hashes should match whenever their contents
+    do, whatever the order the changes and hashes happen in.
+    """
+    def _request() -> Request:
+        return Request(type={'event'}, data=[
+            Object(name='network', value=[
+                Attribute(name='ip', type={'ip'}, value='10.0.0.1'),
+                Attribute(name='port', type={'port'}, value='22'),
+            ]),
+            Attribute(name='domain', type={'domain'}, value='example.com'),
+        ])
+
+    first = _request()
+    second = _request()
+    assert first.to_hash() == second.to_hash()
+
+    first.data[0].value[0].value = '10.0.0.0'
+    assert first.to_hash() != second.to_hash()
+    second.data[0].value[0].value = '10.0.0.0'
+    assert first.to_hash() == second.to_hash()
+
+    first.data[1].type_merge('anonymizable')
+    assert first.to_hash() != second.to_hash()
+    copy = Request.from_dict(Request.to_dict(first))
+    assert first.to_hash() == copy.to_hash()
+
+
+def test_data_model_follows_replaced_components():
+    """
+    In this scenario, components are replaced in place in the lists
+    of a request and of one of its objects.  Hashes and lookups
+    should reflect the replacements, even when the amount of
+    components doesn't change.
+    """
+    o = Object(name='network', value=[Attribute(name='a', value='1')])
+    request = Request(data=[Attribute(name='ip', value='10.0.0.1'), o])
+    assert o.components(names=['b']) == []
+
+    digest = request.to_hash()
+    request.data[0] = Attribute(name='ip', value='10.0.0.2')
+    assert request.to_hash() != digest
+
+    digest = request.to_hash()
+    o.value.pop()
+    o.value.append(Attribute(name='b', value='1'))
+    assert request.to_hash() != digest
+    assert [c.name for c in o.components(names=['b'])] == ['b']
+
+
+def test_context_rehash(mocker: MockerFixture):
+    """
+    In this scenario, the context database holds two Requests, one of
+    them stored under a hash computed differently.  Rehashing should
+    store that one again under its current hash, and leave the other
+    one as is.
+    """
+    current = Request(type={'event'}, data=[
+        Attribute(name='ip', type={'ip'}, value='10.0.0.1'),
+    ])
+    stale = Request(type={'event'}, data=[
+        Attribute(name='ip', type={'ip'}, value='10.0.0.2'),
+    ])
+    documents = [
+        Request.to_dict(current) | {'_id': current.to_hash()},
+        Request.to_dict(stale) | {'_id': 'old-hash'},
+    ]
+
+    async def _find() -> AsyncIterator[dict]:  # noqa: RUF029
+        for document in documents:
+            yield document
+
+    mocker.patch('anonymizer.clients.context.config')
+    mocker.patch('anonymizer.clients.context.AsyncIOMotorClient')
+    client = MongoDBContextClient('mongodb://context')
+    client.collection = mocker.AsyncMock()
+    client.collection.find = mocker.Mock(return_value=_find())
+
+    assert asyncio.run(client.rehash()) == 1
+    client.collection.update_one.assert_awaited_once()
+    assert client.collection.update_one.call_args.args[0] == {
+        '_id': stale.to_hash(),
+    }
+    client.collection.delete_one.assert_awaited_once_with({'_id': 'old-hash'})
+
+
+def test_data_model_bulk_codec():
+    """
+    In this scenario, requests are encoded and decoded in bulk, like
+    the context database does.  They should be the same as with
+    `to_dict()` and `from_dict()`, and invalid documents should be
+    rejected.
+    """
+    requests = [
+        Request(type={'event'}, data=[
+            Object(name='network', type={'anonymizable'}, value=[
+                Attribute(name='ip', type={'ip', 'anonymizable'},
+                          value=f'10.0.0.{i}'),
+            ]),
+            Attribute(name='port', type={'port'}, value=str(i)),
+        ])
+        for i in range(10)
+    ]
+    documents = encode_requests(requests)
+    assert documents == [Request.to_dict(r) for r in requests]
+
+    decoded = decode_requests(documents)
+    assert decoded == requests
+    assert decoded == [Request.from_dict(d) for d in documents]
+    assert decoded[0].data[1].type is decoded[9].data[1].type
+    assert decoded[3].to_hash() == requests[3].to_hash()
+
+    del documents[0]['data'][0]['value'][0]['name']
+    with pytest.raises(ValueError, match='Unable to validate Request'):
+        decode_requests(documents)
@@ -1,5 +1,28 @@
+import asyncio
+from json import loads
+from types import SimpleNamespace
+
+from pytest_mock import MockerFixture
+from sanic import HTTPResponse
 from sanic_testing.reusable import ReusableClient
 
+from anonymizer.config import PipelineSettings
+from anonymizer.execution.engine import ExecutionEngine
+from anonymizer.tasks.mqtt import MqttIngest
+from anonymizer.tasks.queue import QueueWorker
+
+
+def _fail_on(mocker: MockerFixture, document: dict):
+    run = ExecutionEngine.run
+
+    async def _run(self: ExecutionEngine, *args, **kwargs) -> HTTPResponse:
+        if kwargs.get('document') == document:
+            msg = 'Pipeline failure'
+            raise RuntimeError(msg)
+        return await run(self, *args, **kwargs)
+
+    mocker.patch.object(ExecutionEngine, 'run', _run)
+
 
 def test_debug_endpoint(f_sanic: ReusableClient):
     _, response = f_sanic.get('/api/debug/hello-world',
@@ -7,3 +30,246 @@ def test_debug_endpoint(f_sanic: ReusableClient):
     assert response is not None
     assert response.status_code == 200
     assert response.content == b'Hello World!'
+
+
+def test_task_endpoints(f_sanic: ReusableClient):
+    """
+    In this scenario, the pipeline reloading task is managed through
+    the task endpoints.  As it runs from startup, adding it again
+    should fail, and once deleted it should be possible to add it
+    back.
+    """
+    endpoint = '/api/tasks/pipeline.ReloadPipeline'
+    running = f_sanic.app.ctx.background_tasks
+
+    _, response = f_sanic.put(endpoint)
+    assert response.status_code == 500
+
+    _, response = f_sanic.delete(endpoint)
+    assert response.status_code == 200
+    assert 'ReloadPipeline' not in running
+
+    _, response = f_sanic.put(endpoint)
+    assert response.status_code == 200
+    previous = running['ReloadPipeline']
+
+    _, response = f_sanic.patch(endpoint)
+    assert response.status_code == 200
+    assert previous.cancelled()
+    assert not running['ReloadPipeline'].done()
+
+
+def test_batch_endpoint(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+):
+    """
+    In this scenario, a batch of three NDJSON items is sent, the last
+    of which is not valid JSON.  Every item should get its own
+    result, and the invalid item should not fail the others.
+    """
+    cfg_override = {
+        'pipeline.file':
+        'test/resources/pipelines/simple_pipeline_success.json',
+    }
+    f_sanic.put('/api/debug/config', json=cfg_override)
+
+    body = '{"a": 1}\n{"b": 2}\n{"c": \n'
+    _, response = f_sanic.post('/api/anonymizer/batch',
+                               headers=f_no_transformer_headers,
+                               content=body)
+    assert response.status_code == 200
+    assert response.json is not None
+    assert [r['status'] for r in response.json] == [200, 200, 400]
+
+
+def test_batch_endpoint_failing_item(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+        mocker: MockerFixture,
+):
+    """
+    In this scenario, a batch of three items is sent, and the pipeline
+    raises an exception for the second one.  The failing item should
+    get a 500 status, and the others should still get their results.
+    """
+    cfg_override = {
+        'pipeline.file':
+        'test/resources/pipelines/simple_pipeline_success.json',
+    }
+    f_sanic.put('/api/debug/config', json=cfg_override)
+    _fail_on(mocker, {'b': 2})
+
+    body = '{"a": 1}\n{"b": 2}\n{"c": 3}\n'
+    _, response = f_sanic.post('/api/anonymizer/batch',
+                               headers=f_no_transformer_headers,
+                               content=body)
+    assert response.status_code == 200
+    assert [r['status'] for r in response.json] == [200, 500, 200]
+
+
+def test_stream_endpoint(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+):
+    """
+    In this scenario, a stream of three NDJSON items is sent, the
+    second of which is not valid JSON.  Every item should get its own
+    result line, tagged with the item's position in the stream.
+    """
+    cfg_override = {
+        'pipeline.file':
+        'test/resources/pipelines/simple_pipeline_success.json',
+    }
+    f_sanic.put('/api/debug/config', json=cfg_override)
+
+    body = '{"a": 1}\n{"b": \n{"c": 3}\n'
+    _, response = f_sanic.post('/api/anonymizer/stream',
+                               headers=f_no_transformer_headers,
+                               content=body)
+    assert response.status_code == 200
+    results = [loads(line) for line in response.text.splitlines()]
+    statuses = {r['index']: r['status'] for r in results}
+    assert statuses == {0: 200, 1: 400, 2: 200}
+
+
+def test_stream_endpoint_oversized_item(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+):
+    """
+    In this scenario, a stream of three NDJSON items is sent, the
+    second of which is larger than the maximum item size.  It should
+    get a 413 status without being buffered, and the items around it
+    should still get their results.
+    """
+    cfg_override = {
+        'pipeline.file':
+        'test/resources/pipelines/simple_pipeline_success.json',
+        'pipeline.max_item_size': 16,
+    }
+    f_sanic.put('/api/debug/config', json=cfg_override)
+
+    body = '{"a": 1}\n{"b": "' + 'x' * 64 + '"}\n{"c": 3}'
+    _, response = f_sanic.post('/api/anonymizer/stream',
+                               headers=f_no_transformer_headers,
+                               content=body)
+    f_sanic.put('/api/debug/config', json={
+        'pipeline.max_item_size': PipelineSettings().max_item_size,
+    })
+    assert response.status_code == 200
+    results = [loads(line) for line in response.text.splitlines()]
+    statuses = {r['index']: r['status'] for r in results}
+    assert statuses == {0: 200, 1: 413, 2: 200}
+
+
+def test_stream_endpoint_failing_item(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+        mocker: MockerFixture,
+):
+    """
+    In this scenario, a stream of three items is sent, and the
+    pipeline raises an exception for the first one.  The failing item
+    should get a 500 result line, and the stream should still carry
+    the results of the others.
+    """
+    cfg_override = {
+        'pipeline.file':
+        'test/resources/pipelines/simple_pipeline_success.json',
+    }
+    f_sanic.put('/api/debug/config', json=cfg_override)
+    _fail_on(mocker, {'a': 1})
+
+    body = '{"a": 1}\n{"b": 2}\n{"c": 3}\n'
+    _, response = f_sanic.post('/api/anonymizer/stream',
+                               headers=f_no_transformer_headers,
+                               content=body)
+    assert response.status_code == 200
+    results = [loads(line) for line in response.text.splitlines()]
+    statuses = {r['index']: r['status'] for r in results}
+    assert statuses == {0: 500, 1: 200, 2: 200}
+
+
+def test_async_submission(
+        f_sanic: ReusableClient,
+        f_no_transformer_headers: dict[str, str],
+        mocker: MockerFixture,
+):
+    """
+    In this scenario, a request asking for an asynchronous response
+    is sent.  The request should be queued and answered with 202 and
+    the job identifier, which can then be used to poll the result.
+    """
+    enqueue = mocker.patch(
+        'anonymizer.clients.valkey.ValkeyClient.enqueue_job',
+        return_value='job-id',
+    )
+    mocker.patch(
+        'anonymizer.clients.valkey.ValkeyClient.get_job',
+        return_value={'state': 'done', 'status': 200, 'result': None},
+    )
+
+    headers = f_no_transformer_headers | {'Prefer': 'respond-async'}
+    _, response = f_sanic.post('/api/anonymizer',
+                               headers=headers,
+                               json={'a': 1})
+    assert response.status_code == 202
+    assert response.json == {'id': 'job-id'}
+    assert response.headers['Location'].endswith('/jobs/job-id')
+    assert enqueue.call_args.args[0]['document'] == {'a': 1}
+
+    _, response = f_sanic.get('/api/anonymizer/jobs/job-id')
+    assert response.status_code == 200
+    assert response.json['state'] == 'done'
+
+
+def test_failed_queued_request(mocker: MockerFixture):
+    """
+    In this scenario, a queue worker takes a request the pipeline
+    raises an exception for.  The request should be stored as done
+    with a 500 status, and the worker should keep running.
+    """
+    job = {'id': 'job-id',
+           'transformer': 'NoTransformer',
+           'document': {'a': 1},
+           'timestamp': 0}
+    valkey = mocker.AsyncMock(JOB_RUNNING='running', JOB_DONE='done')
+    valkey.dequeue_job.return_value = job
+    engine = mocker.AsyncMock()
+    engine.run_queued.side_effect = RuntimeError('Pipeline failure')
+    app = SimpleNamespace(ctx=SimpleNamespace(valkey=valkey, engine=engine))
+
+    asyncio.run(QueueWorker(app).run())
+    valkey.set_job.assert_called_with(
+        'job-id',
+        {'state': 'done', 'status': 500, 'result': None},
+        mocker.ANY,
+    )
+
+
+def test_mqtt_ingest_backpressure(mocker: MockerFixture):
+    """
+    In this scenario, more MQTT messages arrive than can be processed
+    at the same time.  Messages beyond the limit should wait for a
+    slot before being accepted, and therefore acknowledged, and MQTT
+    ingestion should stop right away if it isn't configured.
+    """
+    task = MqttIngest(mocker.Mock())
+
+    async def _accept_messages() -> list[bool]:
+        slots = asyncio.Semaphore(2)
+        queue = asyncio.Queue()
+        accept = task.accept(slots, queue)
+        accepted = []
+        for payload in (b'1', b'2', b'3'):
+            try:
+                await asyncio.wait_for(accept(payload), 0.1)
+                accepted.append(True)
+            except TimeoutError:
+                accepted.append(False)
+        return accepted
+
+    assert asyncio.run(_accept_messages()) == [True, True, False]
+    assert task.settings is None
+    assert asyncio.run(task()['task']) is None
@@ -1,5 +1,5 @@
 import pytest
-from anonymizer.models.data_model import Request
+from anonymizer.models.data_model import Object, Request
 from anonymizer.models.misp import EventAnon
 from anonymizer.transformers.misp import MispTransformer
 
@@ -17,3 +17,30 @@ def test_transform_and_update_work_together_well(
     extracted_data_2 = f_MispTransformer.transform(f_misp_EventAnon)
 
     assert Request.to_dict(extracted_data) == Request.to_dict(extracted_data_2)
+
+
+def test_update_writes_back_changed_values(
+        f_MispTransformer: MispTransformer,
+        f_misp_EventAnon: EventAnon):
+    """
+    In this scenario, every value of the transformed data is changed.
+    Updating the event should write them all back, both with the data
+    returned by the transformer and with a copy of it that lost track
+    of where each value came from.
+    """
+    extracted_data = f_MispTransformer.transform(f_misp_EventAnon)
+    copied_data = Request.from_dict(Request.to_dict(extracted_data))
+    for data, value in ((extracted_data, 'first'), (copied_data, 'second')):
+        for component in data.data:
+            if isinstance(component, Object):
+                for attribute in component.value:
+                    attribute.value = value
+            else:
+                component.value = value
+
+        assert f_MispTransformer.update(f_misp_EventAnon, data)
+        event = f_misp_EventAnon.event
+        attributes = [*event.attributes,
+                      *(a for o in event.objects for a in o.attributes)]
+        assert all(a.value == value for a in attributes)
+        assert not f_MispTransformer.update(f_misp_EventAnon, data)